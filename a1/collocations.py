@@ -0,0 +1,178 @@
+from array import array
+import numpy as np
+from ngram import corpus_tokens
+
+
+# association measures over the contingency counts of the pairs (w1, w2), all arguments are arrays:
+# n_ii = count of the pair, n_ix = count of w1, n_xi = count of w2, n_xx = corpus size
+def pmi(n_ii, n_ix, n_xi, n_xx):
+    return np.log2(n_ii * n_xx / (n_ix * n_xi))
+
+
+def npmi(n_ii, n_ix, n_xi, n_xx):
+    # pmi normalized to [-1, 1] by -log2 p(w1, w2)
+    return pmi(n_ii, n_ix, n_xi, n_xx) / -np.log2(n_ii / n_xx)
+
+
+def dice(n_ii, n_ix, n_xi, n_xx):
+    return 2 * n_ii / (n_ix + n_xi)
+
+
+def t_score(n_ii, n_ix, n_xi, n_xx):
+    return (n_ii - n_ix * n_xi / n_xx) / np.sqrt(n_ii)
+
+
+def contingency(n_ii, n_ix, n_xi, n_xx):
+    # observed and expected counts of the 2x2 table, rows w1 / not w1, columns w2 / not w2
+    observed = [n_ii, n_ix - n_ii, n_xi - n_ii, n_xx - n_ix - n_xi + n_ii]
+    expected = [n_ix * n_xi / n_xx, n_ix * (n_xx - n_xi) / n_xx, (n_xx - n_ix) * n_xi / n_xx,
+                (n_xx - n_ix) * (n_xx - n_xi) / n_xx]
+    return observed, expected
+
+
+def chi_sq(n_ii, n_ix, n_xi, n_xx):
+    observed, expected = contingency(n_ii, n_ix, n_xi, n_xx)
+    return sum((o - e) ** 2 / e for o, e in zip(observed, expected))
+
+
+def likelihood_ratio(n_ii, n_ix, n_xi, n_xx):
+    observed, expected = contingency(n_ii, n_ix, n_xi, n_xx)
+    # 0 * log 0 = 0, a windowed pair count can leave a cell empty
+    return 2 * sum(np.where(o > 0, o * np.log(np.maximum(o, 1e-300) / e), 0) for o, e in zip(observed, expected))
+
+
+MEASURES = {
+    "pmi": pmi,
+    "npmi": npmi,
+    "dice": dice,
+    "t_score": t_score,
+    "chi_sq": chi_sq,
+    "likelihood_ratio": likelihood_ratio,
+}
+
+
+class Collocations:
+    """
+    Word pair statistics of a corpus counted once with NumPy. Words are interned to ids, the pairs (w1, w2) with w2 at
+    most window words after w1 are packed into int64 keys id1 * vocabulary size + id2 and counted with np.unique.
+    Every measure of MEASURES is computed as array operations from the same counts. With window > 1 the pair counts
+    are divided by window, so the scores stay comparable to window = 1 (like nltk's BigramCollocationFinder).
+
+    >>> collocations = Collocations(['a', 'b', 'a', 'b', 'c'])
+    >>> collocations.top_k(1, min_count=2)
+    [(('a', 'b'), 1.3219280948873624)]
+
+    :param words: a list or any iterable of words, or the path of a text file that is streamed line by line
+    :param window: the maximum distance of the two words of a pair
+    """
+
+    def __init__(self, words, window=1):
+        assert (window > 0)
+        self.window = window
+        word_to_id = dict()
+        ids = np.asarray(array('q', (word_to_id.setdefault(word, len(word_to_id)) for word in corpus_tokens(words))),
+                         dtype=np.int64)
+        self.vocabulary = list(word_to_id)
+        self.corpus_size = len(ids)
+        self.word_counts = np.bincount(ids, minlength=len(self.vocabulary))
+
+        vocabulary_size = max(len(self.vocabulary), 1)
+        keys = [ids[:-distance] * vocabulary_size + ids[distance:] for distance in range(1, window + 1)
+                if distance < len(ids)]
+        self.pair_keys, self.pair_counts = np.unique(np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64),
+                                                     return_counts=True)
+
+    def pair_ids(self):
+        vocabulary_size = max(len(self.vocabulary), 1)
+        return self.pair_keys // vocabulary_size, self.pair_keys % vocabulary_size
+
+    def scores(self, measure="pmi", min_count=10):
+        """
+        :param measure: Name of a measure of MEASURES or a function (n_ii, n_ix, n_xi, n_xx) -> array
+        :param min_count: Ignore the pairs with a word that occurs less than min_count times
+        :return: The keys of the remaining pairs and their scores
+        """
+        first, second = self.pair_ids()
+        valid = (self.word_counts[first] >= min_count) & (self.word_counts[second] >= min_count)
+
+        measure = MEASURES[measure] if isinstance(measure, str) else measure
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = measure(self.pair_counts[valid] / self.window, self.word_counts[first[valid]].astype(np.float64),
+                             self.word_counts[second[valid]].astype(np.float64), float(self.corpus_size))
+
+        return self.pair_keys[valid], scores
+
+    def top_k(self, k=20, measure="pmi", min_count=10, lowest=False):
+        """
+        Return the k pairs with the highest (or lowest) score, best first, as a list of ((w1, w2), score).
+        argpartition selects them in O(pairs), only those k are sorted.
+        """
+        keys, scores = self.scores(measure, min_count)
+        signed = -scores if not lowest else scores
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+
+        selected = np.argpartition(signed, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        # ties are ordered by key, so the result does not depend on the partition
+        selected = selected[np.lexsort((keys[selected], signed[selected]))]
+
+        vocabulary_size = max(len(self.vocabulary), 1)
+        return [((self.vocabulary[key // vocabulary_size], self.vocabulary[key % vocabulary_size]), score)
+                for key, score in zip(keys[selected].tolist(), scores[selected].tolist())]
+
+    def bottom_k(self, k=20, measure="pmi", min_count=10):
+        return self.top_k(k, measure, min_count, lowest=True)
+
+
+if __name__ == "__main__":
+    import math
+    import sys
+    import time
+    from collections import Counter
+
+    # the King James Bible of the assignment is not bundled, junglebook.txt is the default
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "./junglebook.txt"
+
+    # calculate_pmi of p3.ipynb for comparison
+    def calculate_pmi(corpus, min_count=10):
+        unigram_freq = Counter(corpus)
+        bigram_freq = Counter(zip(corpus[:-1], corpus[1:]))
+        N = len(corpus)
+        valid_words = {word for word, count in unigram_freq.items() if count >= min_count}
+        pmi_values = {}
+        for (w1, w2), bigram_count in bigram_freq.items():
+            if w1 in valid_words and w2 in valid_words:
+                pmi_values[(w1, w2)] = math.log2((bigram_count * N) / (unigram_freq[w1] * unigram_freq[w2]))
+        return pmi_values
+
+    corpus = list(corpus_tokens(file_path))
+
+    time1 = time.time()
+    pmi_values = calculate_pmi(corpus)
+    sorted_pmi = sorted(pmi_values.items(), key=lambda item: item[1], reverse=True)
+    print("Counter + sort: %.3f s" % (time.time() - time1))
+
+    time1 = time.time()
+    collocations = Collocations(corpus)
+    top_20, bottom_20 = collocations.top_k(20), collocations.bottom_k(20)
+    print("Collocations:   %.3f s" % (time.time() - time1))
+
+    # same scores as the notebook
+    keys, scores = collocations.scores()
+    assert len(scores) == len(pmi_values)
+    assert all(abs(pmi_values[pair] - score) < 1e-9 for pair, score in top_20 + bottom_20)
+    assert abs(top_20[0][1] - sorted_pmi[0][1]) < 1e-9 and abs(bottom_20[0][1] - sorted_pmi[-1][1]) < 1e-9
+
+    print("highest 20 pmi:")
+    for pair, score in top_20:
+        print(f"{pair}: {score}")
+    print("lowest 20 pmi:")
+    for pair, score in bottom_20:
+        print(f"{pair}: {score}")
+
+    # other measures and a wider window from one count pass each
+    for window in [1, 3]:
+        collocations = Collocations(corpus, window)
+        for measure in MEASURES:
+            print("window %d %-16s %s" % (window, measure, [" ".join(pair) for pair, _ in collocations.top_k(5, measure)]))
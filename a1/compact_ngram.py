@@ -0,0 +1,197 @@
+import tracemalloc
+from array import array
+import numpy as np
+from nltk.probability import FreqDist, ProbDistI
+
+
+class CompactProbDist(ProbDistI):
+    """
+    Maximum likelihood distribution P(.|context) read from the arrays of a CompactNgramCounts, nothing is copied.
+    """
+
+    def __init__(self, counts, context_index):
+        self._counts = counts
+        self._context_index = context_index
+
+    def prob(self, sample):
+        return self._counts.prob_by_index(self._context_index, sample)
+
+    def max(self):
+        samples, counts = self._counts.outcomes(self._context_index)
+        return samples[int(np.argmax(counts))] if len(samples) else None
+
+    def samples(self):
+        return self._counts.outcomes(self._context_index)[0]
+
+
+class CompactNgramCounts:
+    """
+    Count store of BasicNgram(storage="compact"): the counts are kept in sorted NumPy arrays instead of one FreqDist
+    per context, and the word list is not kept.
+    Words are interned to integer ids. Level k of the store is the sorted array of the unique k-grams, each encoded
+    as (index of its (k-1)-gram prefix in level k-1) * vocabulary size + id of its last word. Level n-1 holds the
+    contexts, level n the ngrams; the ngrams of a context are one contiguous slice of level n, found with offsets.
+    A lookup walks the levels with binary search.
+
+    :param n: the dimension of the n-grams (i.e. the size of the context+1).
+    :type n: int
+    :param tokens: iterable of the already padded words, read once
+    :type tokens: iterable(Str)
+    """
+
+    def __init__(self, n, tokens):
+        assert (n > 0)
+        self._n = n
+        self._vocabulary = []
+        self._word_to_id = dict()
+        self._levels = []
+        self._keys = None
+        self._counts = None
+        self._offsets = None
+        self._totals = None
+        self._train(tokens)
+
+    def _train(self, tokens):
+        word_to_id = self._word_to_id
+        ids = np.asarray(array('q', (word_to_id.setdefault(word, len(word_to_id)) for word in tokens)),
+                         dtype=np.int64)
+        self._vocabulary = list(word_to_id)
+
+        n = self._n
+        vocabulary_size = max(len(self._vocabulary), 1)
+        position_num = max(len(ids) - n + 1, 0)
+
+        # index of the prefix of every ngram position in the previous level, all prefixes of unigrams are ()
+        prefix_index = np.zeros(position_num, dtype=np.int64)
+        for k in range(n - 1):
+            keys, prefix_index = np.unique(prefix_index * vocabulary_size + ids[k:k + position_num],
+                                           return_inverse=True)
+            self._levels.append(keys)
+
+        self._keys, counts = np.unique(prefix_index * vocabulary_size + ids[n - 1:n - 1 + position_num],
+                                       return_counts=True)
+        self._counts = counts.astype(np.int32)
+
+        # the ngrams of context c are self._keys[offsets[c]:offsets[c + 1]]
+        context_num = len(self._levels[-1]) if n > 1 else min(position_num, 1)
+        self._offsets = np.searchsorted(self._keys // vocabulary_size, np.arange(context_num + 1))
+        self._totals = np.add.reduceat(self._counts, self._offsets[:-1]).astype(np.int64) if context_num \
+            else np.zeros(0, dtype=np.int64)
+
+    def context_index(self, context):
+        # index of the context in level n-1, -1 if the context was never seen
+        if len(context) != self._n - 1:
+            return -1
+        if self._n == 1:
+            return 0 if len(self._totals) else -1
+
+        vocabulary_size = len(self._vocabulary)
+        index = 0
+        for level, word in zip(self._levels, context):
+            word_id = self._word_to_id.get(word)
+            if word_id is None:
+                return -1
+            key = index * vocabulary_size + word_id
+            index = int(np.searchsorted(level, key))
+            if index == len(level) or level[index] != key:
+                return -1
+        return index
+
+    def prob_by_index(self, context_index, word):
+        word_id = self._word_to_id.get(word)
+        if context_index < 0 or word_id is None:
+            return 0
+
+        start, stop = self._offsets[context_index], self._offsets[context_index + 1]
+        key = context_index * len(self._vocabulary) + word_id
+        position = start + int(np.searchsorted(self._keys[start:stop], key))
+        if position == stop or self._keys[position] != key:
+            return 0
+        return int(self._counts[position]) / int(self._totals[context_index])
+
+    def outcomes(self, context_index):
+        # the words following a context and their counts
+        if context_index < 0:
+            return [], np.zeros(0, dtype=np.int32)
+
+        start, stop = self._offsets[context_index], self._offsets[context_index + 1]
+        word_ids = (self._keys[start:stop] % len(self._vocabulary)).tolist()
+        return [self._vocabulary[word_id] for word_id in word_ids], self._counts[start:stop]
+
+    def outcome_counts(self, context):
+        # (words, counts) following the context, None for an unseen context
+        context_index = self.context_index(context)
+        if context_index < 0:
+            return None
+        samples, counts = self.outcomes(context_index)
+        return samples, counts.tolist()
+
+    def freqdist(self, context):
+        samples, counts = self.outcomes(self.context_index(tuple(context)))
+        return FreqDist(dict(zip(samples, counts.tolist())))
+
+    def __len__(self):
+        return len(self._totals)
+
+    def contexts(self):
+        """
+        Return the list of contexts, sorted by word id (ids are given in order of first occurrence)
+        """
+        if self._n == 1:
+            return [()] * len(self._totals)
+
+        # decode the levels from the contexts back to the unigrams
+        vocabulary_size = len(self._vocabulary)
+        columns = []
+        index = np.arange(len(self._levels[-1]))
+        for level in reversed(self._levels):
+            keys = level[index]
+            columns.append(keys % vocabulary_size)
+            index = keys // vocabulary_size
+
+        id_rows = np.stack(columns[::-1], axis=1).tolist()
+        return [tuple(self._vocabulary[word_id] for word_id in row) for row in id_rows]
+
+    def nbytes(self):
+        # size of the count arrays, the vocabulary strings are not included
+        arrays = self._levels + [self._keys, self._counts, self._offsets, self._totals]
+        return sum(array.nbytes for array in arrays)
+
+
+# memory in bytes still allocated after building a model (the model itself), and the peak during the build
+def model_memory(build):
+    tracemalloc.start()
+    model = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return model, current, peak
+
+
+if __name__ == "__main__":
+    import sys
+    from ngram import BasicNgram
+
+    # the King James Bible of the assignment is not bundled, junglebook.txt is the default
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "./junglebook.txt"
+
+    words = []
+    with open(file_path, "r", encoding='utf-8') as file:
+        for line in file:
+            words += line.lower().split(" ")
+    print("%s: %d tokens" % (file_path, len(words)))
+
+    for n in range(2, 6):
+        basic, basic_size, basic_peak = model_memory(lambda: BasicNgram(n, words))
+        compact, compact_size, compact_peak = model_memory(lambda: BasicNgram(n, words, storage="compact"))
+
+        # both storages must give the same probabilities
+        for context in basic.contexts()[:200]:
+            for word in basic[context].samples():
+                assert abs(basic[context].prob(word) - compact[context].prob(word)) < 1e-12
+        assert sorted(basic.contexts()) == sorted(compact.contexts())
+
+        print("n=%d %7d contexts | dict storage %8.1f MB (peak %8.1f MB) | compact storage %6.1f MB (peak %6.1f MB), "
+              "count arrays %.1f MB" % (n, len(compact), basic_size / 2 ** 20, basic_peak / 2 ** 20,
+                                        compact_size / 2 ** 20, compact_peak / 2 ** 20,
+                                        compact._store.nbytes() / 2 ** 20))
+        del basic, compact
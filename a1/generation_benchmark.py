@@ -0,0 +1,56 @@
+import random
+import time
+from ngram import BasicNgram
+
+
+# generate_text of p2.ipynb, one ProbDistI.generate() call per word
+def generate_text(ngram, n, length=100):
+    # # add the padding start symbol to the init context
+    context = tuple([ngram._start_symbol] * (n - 1))
+    result = list(context)
+    for i in range(length):
+        if context in ngram:
+            prob_dist = ngram[context]
+            # # predict the next word
+            word = prob_dist.generate()
+        else:
+            word = ngram._end_symbol
+
+        result.append(word)
+
+        if word == ngram._end_symbol:
+            break
+        # # update the context
+        context = tuple(result[-(n - 1):])
+
+    return ' '.join(result)
+
+
+if __name__ == "__main__":
+    file_path = "./junglebook.txt"
+    sequence_num = 200
+    length = 100
+
+    for n in [2, 3, 4]:
+        ngram = BasicNgram(n, file_path)
+
+        random.seed(0)
+        time1 = time.time()
+        word_num = sum(len(generate_text(ngram, n, length).split(" ")) - (n - 1) for _ in range(sequence_num))
+        nltk_rate = word_num / (time.time() - time1)
+
+        # the first batch builds the alias tables, the same batch again only reuses them
+        time1 = time.time()
+        word_num = sum(len(words) for words in ngram.generate_batch(sequence_num, length, seed=0))
+        cold_rate = word_num / (time.time() - time1)
+
+        time1 = time.time()
+        word_num = sum(len(words) for words in ngram.generate_batch(sequence_num, length, seed=0))
+        warm_rate = word_num / (time.time() - time1)
+
+        print("n=%d ProbDistI.generate %9.0f words/s | alias tables cold %9.0f words/s, warm %9.0f words/s "
+              "(%d cached contexts, %d hits, %d misses)" % (n, nltk_rate, cold_rate, warm_rate,
+                                                            len(ngram._sampler_cache), ngram.sampler_hits,
+                                                            ngram.sampler_misses))
+
+    print(" ".join(BasicNgram(3, file_path).generate(length, seed=42)))
@@ -1,5 +1,11 @@
+import os
+import random
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
 from nltk.probability import (FreqDist, ConditionalFreqDist, ConditionalProbDist, MLEProbDist, SimpleGoodTuringProbDist)
 from nltk.util import ngrams
+from compact_ngram import CompactNgramCounts, CompactProbDist
 
 
 def ml_estimator(freqdist):
@@ -10,7 +16,129 @@ def goodturing_estimator(freqdist):
     return SimpleGoodTuringProbDist(freqdist)
 
 
-class BasicNgram(ConditionalProbDist):
+# stream the tokens of a file line by line, tokenized like read_file in the notebooks
+def read_tokens(file_path):
+    with open(file_path, "r", encoding='utf-8') as file:
+        for line in file:
+            yield from line.lower().split(" ")
+
+
+# a corpus is a list or any iterable of words, or the path of a text file that is streamed
+def corpus_tokens(words):
+    if isinstance(words, (str, os.PathLike)):
+        return read_tokens(words)
+    return words
+
+
+# split a token stream into lists of about chunk_size tokens, each chunk starts with the last overlap tokens of
+# the previous one, so every ngram of the stream lies in exactly one chunk
+def overlapping_chunks(tokens, chunk_size, overlap):
+    tokens = iter(tokens)
+    carry = []
+    while True:
+        chunk = carry + list(islice(tokens, chunk_size))
+        if len(chunk) <= len(carry):
+            return
+        yield chunk
+        carry = chunk[len(chunk) - overlap:] if overlap > 0 else []
+
+
+# count the ngrams of one chunk in a worker
+def count_chunk(chunk, n):
+    return Counter(ngrams(chunk, n))
+
+
+# Walker alias table (Vose's construction) over the outcomes of one context, built in O(k) from the counts
+def alias_table(counts):
+    k = len(counts)
+    total = sum(counts)
+    scaled = [count * k / total for count in counts]
+    prob = [1.0] * k
+    alias = list(range(k))
+
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] = scaled[l] + scaled[s] - 1
+        (small if scaled[l] < 1 else large).append(l)
+
+    return prob, alias
+
+
+class GenerationMixin:
+    """
+    Random text generation in O(1) per word. The alias table of a context is built on its first draw and kept in an
+    LRU cache of at most sampler_cache_size contexts.
+    The model provides _n, _start_symbol, _end_symbol and _outcome_counts(context).
+    """
+    sampler_cache_size = 100000
+
+    def _sampler(self, context):
+        # (outcomes, prob, alias) of the context, None for an unseen context
+        cache = self.__dict__.get("_sampler_cache")
+        if cache is None:
+            cache = self._sampler_cache = OrderedDict()
+            self.sampler_hits = self.sampler_misses = 0
+
+        sampler = cache.get(context)
+        if sampler is not None:
+            cache.move_to_end(context)
+            self.sampler_hits += 1
+            return sampler
+
+        self.sampler_misses += 1
+        outcome_counts = self._outcome_counts(context)
+        if outcome_counts is None:
+            return None
+
+        outcomes, counts = outcome_counts
+        sampler = (outcomes, *alias_table(counts))
+        cache[context] = sampler
+        if len(cache) > self.sampler_cache_size:
+            cache.popitem(last=False)
+        return sampler
+
+    def generate(self, length=100, seed=None):
+        """
+        Generate up to length words after the start context, stop after the end symbol or at an unseen context
+        (which emits the end symbol), like generate_text in p2.ipynb.
+        :param seed: None, an int or a random.Random, the same seed gives the same text
+        :return: List of words without the start context
+        """
+        rng = seed if isinstance(seed, random.Random) else random.Random(seed)
+        n = self._n
+        context = tuple([self._start_symbol] * (n - 1))
+        result = []
+        for i in range(length):
+            sampler = self._sampler(context)
+            if sampler is None:
+                word = self._end_symbol
+            else:
+                outcomes, prob, alias = sampler
+                # one uniform draw picks the column and decides between it and its alias
+                u = rng.random() * len(outcomes)
+                column = int(u)
+                word = outcomes[column] if u - column < prob[column] else outcomes[alias[column]]
+
+            result.append(word)
+
+            if word == self._end_symbol:
+                break
+            if n > 1:
+                context = context[1:] + (word,)
+
+        return result
+
+    def generate_batch(self, sequence_num, length=100, seed=None):
+        # sequence_num texts from one random generator, they share the cached alias tables
+        rng = seed if isinstance(seed, random.Random) else random.Random(seed)
+        return [self.generate(length, rng) for _ in range(sequence_num)]
+
+
+class BasicNgram(ConditionalProbDist, GenerationMixin):
     """
     Define and train an Ngram Model over the corpus represented by the list words. 
     Given an BasicNgram instance ngram and a (n-1)-gram context (i.e., a tuple of n-1 strings), 
@@ -26,27 +154,50 @@ class BasicNgram(ConditionalProbDist):
     0.5
     >>> p_b.prob('b')
     0.5
+    >>> BasicNgram(2,corpus,storage="compact")[('b',)].prob('a')
+    0.5
     
     :param n: the dimension of the n-grams (i.e. the size of the context+1).
     :type n: int
-    :param corpus: 
-    :type corpus: list(Str)
+    :param corpus: a list or any iterable of words, or the path of a text file that is streamed line by line
+    :type corpus: list(Str) or iterable(Str) or str
     
     other parameters are optional and may be omitted. They define whether to add artificial symbols before or after the word list, 
     and whether to use another estimation methods than maximum likelihood.
+    The corpus is counted in one streaming pass and never materialized. With max_workers != 1 it is cut into chunks of
+    chunk_size tokens that are counted in worker processes (None for os.cpu_count()) and merged in corpus order, so
+    the model is the same as the serial one.
+    storage="compact" keeps the counts in the sorted NumPy arrays of a CompactNgramCounts instead of one FreqDist per
+    context, which needs a fraction of the memory. The contexts are then sorted by word id and no ProbDist is kept:
+    ngram[context] reads the arrays (with ml_estimator) or builds estimator(FreqDist of the context). The compact
+    counts are built in one NumPy pass, max_workers must be 1.
     """
 
     def __init__(self, n, words, start_symbol="<$>", end_symbol="</$>", pad_left=True, pad_right=False,
-                 estimator=ml_estimator):
+                 estimator=ml_estimator, max_workers=1, chunk_size=1000000, storage="dict"):
         assert (n > 0)
+        if storage not in ("dict", "compact"):
+            raise ValueError("unknown storage %r, use 'dict' or 'compact'" % storage)
+        if storage == "compact" and max_workers != 1:
+            raise ValueError("the compact storage is counted in one process, max_workers must be 1")
         self._n = n
         self._words = words
+        # an iterator (e.g. a generator) can be read only once, by the training
+        self._one_shot = iter(words) is words if not isinstance(words, (str, os.PathLike)) else False
+        self._words_read = False
         self._counter = ConditionalFreqDist()
         self._start_symbol = start_symbol
         self._end_symbol = end_symbol
         self._pad_left = pad_left
         self._pad_right = pad_right
-        self._train()
+        self._store = None
+        if storage == "compact":
+            self._store = CompactNgramCounts(n, self._padded_tokens())
+        elif max_workers == 1:
+            self._train()
+        else:
+            self._train_parallel(max_workers, chunk_size)
+        # with the compact storage the counter stays empty, every context is answered by __missing__
         super().__init__(self._counter, estimator)
 
     def _train(self):
@@ -56,12 +207,56 @@ class BasicNgram(ConditionalProbDist):
             outcome = ngram[-1]
             self._counter[context][outcome] += 1
 
+    def _train_parallel(self, max_workers=None, chunk_size=1000000):
+        if max_workers is None:
+            max_workers = os.cpu_count()
+
+        # pad the whole stream once, the chunks are counted without padding
+        padding = self._n - 1
+        tokens = self._padded_tokens()
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # at most two chunks per worker are in flight, this bounds the memory of the parent process
+            futures = deque()
+            for chunk in overlapping_chunks(tokens, chunk_size, padding):
+                futures.append(executor.submit(count_chunk, chunk, self._n))
+                if len(futures) >= 2 * max_workers:
+                    self._merge_counts(futures.popleft().result())
+            while futures:
+                self._merge_counts(futures.popleft().result())
+
+    # the corpus with the padding of nltk.util.ngrams
+    def _padded_tokens(self):
+        padding = self._n - 1
+        return chain([self._start_symbol] * padding if self._pad_left else [], self._corpus_tokens(),
+                     [self._end_symbol] * padding if self._pad_right else [])
+
+    def _corpus_tokens(self):
+        if self._one_shot and self._words_read:
+            raise ValueError("the corpus was an iterator that the training already consumed, pass a list or a file "
+                             "path to read its ngrams again")
+        self._words_read = True
+        return corpus_tokens(self._words)
+
+    def _merge_counts(self, ngram_counts):
+        for ngram, count in ngram_counts.items():
+            self._counter[ngram[0:-1]][ngram[-1]] += count
+
+    def _outcome_counts(self, context):
+        if self._store is not None:
+            return self._store.outcome_counts(context)
+        if context not in self._counter:
+            return None
+        freqdist = self._counter[context]
+        return list(freqdist.keys()), list(freqdist.values())
+
     """
-    returns an iterable over the ngrams of the word corpus
+    returns an iterable over the ngrams of the word corpus, ValueError if the corpus was an iterator (it is consumed
+    by the training)
     """
 
     def generate_ngrams(self):
-        return ngrams(self._words, self._n, self._pad_left, self._pad_right,
+        return ngrams(self._corpus_tokens(), self._n, pad_left=self._pad_left, pad_right=self._pad_right,
                       left_pad_symbol=self._start_symbol,
                       right_pad_symbol=self._end_symbol)
 
@@ -72,6 +267,35 @@ class BasicNgram(ConditionalProbDist):
     def contexts(self):
         return list(self.conditions())
 
+    # with the compact storage the dict of ProbDists stays empty, these read the count arrays instead
+
+    def __missing__(self, context):
+        if self._store is None:
+            return super().__missing__(context)
+        if self._probdist_factory is ml_estimator:
+            return CompactProbDist(self._store, self._store.context_index(tuple(context)))
+        return self._probdist_factory(self._store.freqdist(context))
+
+    def __contains__(self, context):
+        if self._store is None:
+            return super().__contains__(context)
+        return self._store.context_index(tuple(context)) >= 0
+
+    def __len__(self):
+        if self._store is None:
+            return super().__len__()
+        return len(self._store)
+
+    def __iter__(self):
+        if self._store is None:
+            return super().__iter__()
+        return iter(self._store.contexts())
+
+    def conditions(self):
+        if self._store is None:
+            return super().conditions()
+        return self._store.contexts()
+
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,68 @@
+import os
+import time
+from corpus_handler import CorpusHandler
+from viterbi import viterbi
+
+
+# tag every sentence with the dict viterbi restricted to a beam, return the time, the accuracy and
+# the share of sentences tagged like the exhaustive search
+def decode_with_beam(corpus_handler, token_lists, gold_pos_lists, exact_pos_lists=None, beam_size=None,
+                     beam_threshold=None):
+    time1 = time.time()
+    pos_lists = [viterbi(corpus_handler.init_prob, corpus_handler.transition_prob, corpus_handler.emission_prob,
+                         token_list, beam_size=beam_size, beam_threshold=beam_threshold)[1]
+                 for token_list in token_lists]
+    elapsed = time.time() - time1
+
+    correct = sum(tag_gold == tag_system for gold_pos_list, pos_list in zip(gold_pos_lists, pos_lists)
+                  for tag_gold, tag_system in zip(gold_pos_list, pos_list))
+    accuracy = correct / sum(len(gold_pos_list) for gold_pos_list in gold_pos_lists)
+
+    agreement = None
+    if exact_pos_lists is not None:
+        agreement = sum(pos_list == exact for pos_list, exact in zip(pos_lists, exact_pos_lists)) / len(pos_lists)
+
+    return pos_lists, elapsed, accuracy, agreement
+
+
+if __name__ == "__main__":
+    # define file path
+    DE_GSD_TRAIN = "./data/de_gsd-ud-train.conllu"
+    DE_GSD_TEST = "./data/de_gsd-ud-test.conllu"
+    DE_SGD_DEV = "./data/de_gsd-ud-dev.conllu"
+
+    # the train file is not always bundled, the dev file stands in for it
+    corpusHandler = CorpusHandler(DE_GSD_TRAIN if os.path.exists(DE_GSD_TRAIN) else DE_SGD_DEV)
+    corpusHandler.train_on_corpus(14000)
+
+    token_lists, gold_pos_lists = corpusHandler.read_sentences(DE_GSD_TEST)
+    token_num = sum(len(token_list) for token_list in token_lists)
+
+    exact_pos_lists, elapsed, accuracy, _ = decode_with_beam(corpusHandler, token_lists, gold_pos_lists)
+    print("%-16s %8.3f s %10.0f tokens/s accuracy %.4f" % ("exhaustive", elapsed, token_num / elapsed, accuracy))
+
+    # speed/accuracy curve over the beam width, then over the log prob threshold
+    for beam_size in [1, 2, 3, 5, 8, 12]:
+        _, elapsed, accuracy, agreement = decode_with_beam(corpusHandler, token_lists, gold_pos_lists,
+                                                           exact_pos_lists, beam_size=beam_size)
+        print("%-16s %8.3f s %10.0f tokens/s accuracy %.4f same path as exhaustive %.4f" %
+              ("beam k=%d" % beam_size, elapsed, token_num / elapsed, accuracy, agreement))
+
+    for beam_threshold in [2.0, 5.0, 10.0]:
+        _, elapsed, accuracy, agreement = decode_with_beam(corpusHandler, token_lists, gold_pos_lists,
+                                                           exact_pos_lists, beam_threshold=beam_threshold)
+        print("%-16s %8.3f s %10.0f tokens/s accuracy %.4f same path as exhaustive %.4f" %
+              ("threshold %.0f" % beam_threshold, elapsed, token_num / elapsed, accuracy, agreement))
+
+    # the numpy decoders of DenseHMM, beam pruning only pays off there for large tagsets
+    dense_hmm = corpusHandler.to_dense()
+    for beam_size in [None, 3]:
+        time1 = time.time()
+        for token_list in token_lists:
+            dense_hmm.viterbi_beam(token_list, beam_size=beam_size)
+        elapsed = time.time() - time1
+        print("%-16s %8.3f s %10.0f tokens/s" % ("dense k=%s" % beam_size, elapsed, token_num / elapsed))
+
+    # n-best paths of the first test sentence
+    for score, pos_list in dense_hmm.viterbi_nbest(token_lists[0], 3):
+        print("%.4f %s" % (score, " ".join(pos_list)))
@@ -0,0 +1,92 @@
+import json
+import numpy as np
+
+# file layout: magic, header length, json header, then the raw blocks at aligned offsets
+# array blocks are memory-mapped on load, byte blocks (e.g. string tables) are read
+BLOCK_ALIGNMENT = 64
+
+
+def aligned(offset):
+    # round up to the next multiple of BLOCK_ALIGNMENT
+    return -(-offset // BLOCK_ALIGNMENT) * BLOCK_ALIGNMENT
+
+
+# words never contain a line break in CoNLL-U, so a string table is stored as one newline separated blob
+def pack_strings(strings):
+    return "\n".join(strings).encode('utf-8')
+
+
+def unpack_strings(blob, count):
+    return blob.decode('utf-8').split("\n") if count > 0 else []
+
+
+def save_blocks(file_path, magic: bytes, version: int, header: dict, blocks: dict):
+    """
+    :param file_path: Path of the binary file
+    :param magic: Bytes identifying the file type
+    :param version: Format version, checked on load
+    :param header: Json serializable dict stored with the blocks
+    :param blocks: Dict of block name to bytes or numpy array
+    """
+    header = dict(header, version=version, blocks={})
+
+    # offsets are relative to the start of the data section and aligned for every block
+    offsets = []
+    offset = 0
+    for name, block in blocks.items():
+        offset = aligned(offset)
+        offsets.append(offset)
+        if isinstance(block, bytes):
+            header["blocks"][name] = {"offset": offset, "size": len(block)}
+            offset += len(block)
+        else:
+            header["blocks"][name] = {"offset": offset, "shape": list(block.shape), "dtype": block.dtype.str}
+            offset += block.nbytes
+    data_size = offset
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = aligned(len(magic) + 8 + len(header_bytes))
+
+    with open(file_path, 'wb') as file:
+        file.write(magic)
+        file.write(len(header_bytes).to_bytes(8, 'little'))
+        file.write(header_bytes)
+        for block, block_offset in zip(blocks.values(), offsets):
+            file.seek(data_start + block_offset)
+            file.write(block if isinstance(block, bytes) else np.ascontiguousarray(block).tobytes())
+        # make the file end exactly after the last block
+        file.truncate(data_start + data_size)
+
+
+def load_blocks(file_path, magic: bytes, version: int):
+    """
+    :param file_path: Path of a file written by save_blocks
+    :param magic: Bytes identifying the file type
+    :param version: Expected format version
+    :return: The header dict and a dict of block name to bytes or read-only numpy memmap
+    """
+    with open(file_path, 'rb') as file:
+        if file.read(len(magic)) != magic:
+            raise ValueError("%s is not a %s file" % (file_path, magic.decode()))
+        header_length = int.from_bytes(file.read(8), 'little')
+        header = json.loads(file.read(header_length).decode('utf-8'))
+        if header["version"] != version:
+            raise ValueError("unsupported %s file version %s" % (magic.decode(), header["version"]))
+
+        data_start = aligned(len(magic) + 8 + header_length)
+        blocks = dict()
+        for name, spec in header["blocks"].items():
+            if "size" in spec:
+                file.seek(data_start + spec["offset"])
+                blocks[name] = file.read(spec["size"])
+
+    for name, spec in header["blocks"].items():
+        if "shape" in spec:
+            # np.memmap can't map zero bytes
+            if np.prod(spec["shape"]) == 0:
+                blocks[name] = np.empty(tuple(spec["shape"]), dtype=spec["dtype"])
+            else:
+                blocks[name] = np.memmap(file_path, dtype=spec["dtype"], mode='r', offset=data_start + spec["offset"],
+                                         shape=tuple(spec["shape"]))
+
+    return header, blocks
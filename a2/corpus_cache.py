@@ -0,0 +1,114 @@
+import hashlib
+import os
+import numpy as np
+from conllu import parse_incr
+from binary_store import save_blocks, load_blocks, pack_strings, unpack_strings
+
+CACHE_MAGIC = b"CONLLUCACHE"
+CACHE_VERSION = 1
+
+
+# columnar cache of the word forms and upos of a CoNLL-U file, the only columns the tagger uses
+class CorpusCache:
+    words = None
+    tags = None
+    word_ids = None
+    tag_ids = None
+    offsets = None
+
+    def __init__(self, words, tags, word_ids, tag_ids, offsets):
+        """
+        :param words: List of word forms, the position in the list is the word id
+        :param tags: List of upos tags, the position in the list is the tag id
+        :param word_ids: Array (N,) of the word id of every token in the file
+        :param tag_ids: Array (N,) of the tag id of every token in the file
+        :param offsets: Array (sentences + 1,) of the first token of each sentence, the last entry is N
+        """
+        self.words = words
+        self.tags = tags
+        self.word_ids = word_ids
+        self.tag_ids = tag_ids
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def load(cls, file_path, cache_dir=None):
+        """
+        Return the cache of a CoNLL-U file, it is built with the conllu parser on first access and memory-mapped
+        afterwards. Changing the file (size or mtime) builds a new cache.
+        :param file_path: Path of the CoNLL-U file
+        :param cache_dir: Directory of the cache files, .corpus_cache next to the CoNLL-U file by default
+        :return: CorpusCache
+        """
+        cache_path = cls.cache_path(file_path, cache_dir)
+
+        if not os.path.exists(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # write to a temporary file first, so a parallel reader never maps a half written cache
+            temp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+            cls.build(file_path).save(temp_path)
+            os.replace(temp_path, cache_path)
+
+        header, blocks = load_blocks(cache_path, CACHE_MAGIC, CACHE_VERSION)
+
+        return cls(unpack_strings(blocks["words"], header["word_num"]), header["tags"], blocks["word_ids"],
+                   blocks["tag_ids"], blocks["offsets"])
+
+    @staticmethod
+    def cache_path(file_path, cache_dir=None):
+        # the key covers the path, size and mtime of the source file
+        stat = os.stat(file_path)
+        key = "%s|%d|%d" % (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), ".corpus_cache")
+
+        return os.path.join(cache_dir, "%s.%s.cache" % (os.path.basename(file_path), digest))
+
+    @classmethod
+    def build(cls, file_path):
+        # parse the CoNLL-U file once and intern words and tags
+        word_to_id = dict()
+        tag_to_id = dict()
+        word_ids = []
+        tag_ids = []
+        offsets = [0]
+
+        with open(file_path, 'r', encoding='utf-8') as file:
+            for sentence in parse_incr(file):
+                for token in sentence:
+                    word_ids.append(word_to_id.setdefault(token['form'], len(word_to_id)))
+                    tag_ids.append(tag_to_id.setdefault(token['upos'], len(tag_to_id)))
+                offsets.append(len(word_ids))
+
+        return cls(list(word_to_id), list(tag_to_id), np.array(word_ids, dtype='<i4'),
+                   np.array(tag_ids, dtype='<i2'), np.array(offsets, dtype='<i8'))
+
+    def save(self, file_path):
+        save_blocks(file_path, CACHE_MAGIC, CACHE_VERSION, {"word_num": len(self.words), "tags": self.tags},
+                    {"words": pack_strings(self.words), "word_ids": self.word_ids, "tag_ids": self.tag_ids,
+                     "offsets": self.offsets})
+
+    def sentence(self, i):
+        # word ids and tag ids of sentence i as array slices (views of the memmap)
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.word_ids[start:stop], self.tag_ids[start:stop]
+
+    def sentences(self, start=0, stop=None):
+        # stream the sentences [start, stop) as array slices
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(start, stop):
+            yield self.sentence(i)
+
+    def token_lists(self, start=0, stop=None):
+        # word forms and gold tags of the sentences [start, stop) as string lists
+        token_lists = []
+        gold_pos_lists = []
+        for word_ids, tag_ids in self.sentences(start, stop):
+            token_lists.append([self.words[word_id] for word_id in word_ids.tolist()])
+            gold_pos_lists.append([self.tags[tag_id] for tag_id in tag_ids.tolist()])
+
+        return token_lists, gold_pos_lists
@@ -1,8 +1,14 @@
 import numpy as np
 from conllu import parse_incr
 import matplotlib.pyplot as plt
-from viterbi import viterbi
+from viterbi import viterbi, viterbi_log_batch
+from dense_hmm import DenseHMM
+from parallel_eval import evaluate_parallel
+from corpus_cache import CorpusCache
+from profiler import PROFILER
 import time
+from time import perf_counter_ns
+from itertools import islice
 from scipy.interpolate import interp1d
 
 
@@ -12,34 +18,85 @@ class CorpusHandler:
     init_prob = None
     transition_prob = None
     emission_prob = None
-
-    def __init__(self, file_path):
+    # counts of the sentences read so far, kept between calls for incremental training and the oov policies
+    sentence_count = 0
+    first_pos_count = None
+    pos_count = None
+    transition_count = None
+    emission_count = None
+    corpus_file = None
+    corpus_reader = None
+    corpus_cache = None
+    use_cache = False
+    cache_dir = None
+    dense_hmm = None
+
+    def __init__(self, file_path, use_cache=False, cache_dir=None):
+        """
+        :param file_path: Path of the CoNLL-U training file
+        :param use_cache: Read all CoNLL-U files through the columnar CorpusCache instead of the conllu parser
+        :param cache_dir: Directory of the cache files, see CorpusCache.load
+        """
         self.file_path = file_path
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
 
     def train_on_corpus(self, sentence_num):
-        # open corpus file and train HMM
-        with open(self.file_path, 'r', encoding='utf-8') as file:
-            reader = parse_incr(file)
-            init_prob, transition_prob, emission_prob = self.train(reader, sentence_num)
+        # continue counting where the last call stopped if the corpus is still open and the size grows,
+        # so a learning curve over increasing sizes reads every sentence only once
+        if self.use_cache:
+            if self.corpus_cache is None or sentence_num < self.sentence_count:
+                self.corpus_cache = CorpusCache.load(self.file_path, self.cache_dir)
+                self.reset_counts()
+            self.count_cached(self.corpus_cache, sentence_num - self.sentence_count)
+        else:
+            if self.corpus_reader is None or sentence_num < self.sentence_count:
+                self.open_corpus()
+            self.count(self.corpus_reader, sentence_num - self.sentence_count)
+
+        init_prob, transition_prob, emission_prob = self.normalize()
 
         return init_prob, transition_prob, emission_prob
 
-    def train(self, reader, sentence_num):
-        init_prob = dict()
-        transition_prob = dict()
-        emission_prob = dict()
+    # open corpus file from the beginning and clear the counts
+    def open_corpus(self):
+        self.close()
+        self.corpus_file = open(self.file_path, 'r', encoding='utf-8')
+        self.corpus_reader = parse_incr(self.corpus_file)
+        self.reset_counts()
 
-        sentence_count = 0
-        first_pos_count = dict()
-        pos_count = dict()
-        transition_count = dict()
-        emission_count = dict()
+    def close(self):
+        if self.corpus_file is not None:
+            self.corpus_file.close()
+        self.corpus_file = None
+        self.corpus_reader = None
 
-        for sentence in reader:
-            sentence_count += 1
-
-            if sentence_count > sentence_num:
-                break
+    # train from scratch on the first sentence_num sentences of any reader, the next train_on_corpus starts over
+    def train(self, reader, sentence_num):
+        self.close()
+        self.corpus_cache = None
+        self.reset_counts()
+        self.count(reader, sentence_num)
+
+        return self.normalize()
+
+    def reset_counts(self):
+        self.sentence_count = 0
+        self.first_pos_count = dict()
+        self.pos_count = dict()
+        self.transition_count = dict()
+        self.emission_count = dict()
+
+    # add the next sentence_num sentences of the reader to the counts
+    def count(self, reader, sentence_num):
+        first_pos_count = self.first_pos_count
+        pos_count = self.pos_count
+        transition_count = self.transition_count
+        emission_count = self.emission_count
+
+        # islice stops before taking a sentence too much from the reader, so the next call can go on from there
+        for sentence in islice(reader, max(sentence_num, 0)):
+            self.sentence_count += 1
 
             # count the first word pos for init prob
             first_pos = sentence[0]['upos']
@@ -81,6 +138,62 @@ class CorpusHandler:
                     else:
                         emission_count[pos][word] += 1
 
+    # add the next sentence_num sentences of a CorpusCache to the counts, counted on the id arrays
+    def count_cached(self, corpus_cache, sentence_num):
+        start = self.sentence_count
+        stop = min(start + max(sentence_num, 0), len(corpus_cache))
+        if stop <= start:
+            return
+
+        offsets = np.asarray(corpus_cache.offsets[start:stop + 1])
+        lo, hi = offsets[0], offsets[-1]
+        word_ids = np.asarray(corpus_cache.word_ids[lo:hi], dtype=np.int64)
+        tag_ids = np.asarray(corpus_cache.tag_ids[lo:hi], dtype=np.int64)
+        tag_num = len(corpus_cache.tags)
+        word_num = len(corpus_cache.words)
+
+        # first token of every non-empty sentence
+        sentence_starts = offsets[:-1][offsets[:-1] < offsets[1:]] - lo
+        first_tag_count = np.bincount(tag_ids[sentence_starts], minlength=tag_num)
+        tag_count = np.bincount(tag_ids, minlength=tag_num)
+
+        # transitions inside sentences only, a pair that starts a new sentence is skipped
+        in_sentence = np.ones(len(tag_ids), dtype=bool)
+        in_sentence[sentence_starts] = False
+        pair_ids = tag_ids[:-1] * tag_num + tag_ids[1:]
+        transition_pair_count = np.bincount(pair_ids[in_sentence[1:]], minlength=tag_num * tag_num)
+
+        emission_pairs, emission_pair_count = np.unique(tag_ids * word_num + word_ids, return_counts=True)
+
+        # add the array counts to the count dicts that normalize works on
+        self.sentence_count = stop
+        for tag_id in np.flatnonzero(first_tag_count):
+            pos = corpus_cache.tags[tag_id]
+            self.first_pos_count[pos] = self.first_pos_count.get(pos, 0) + int(first_tag_count[tag_id])
+        for tag_id in np.flatnonzero(tag_count):
+            pos = corpus_cache.tags[tag_id]
+            self.pos_count[pos] = self.pos_count.get(pos, 0) + int(tag_count[tag_id])
+        for pair_id in np.flatnonzero(transition_pair_count):
+            last_pos, pos = corpus_cache.tags[pair_id // tag_num], corpus_cache.tags[pair_id % tag_num]
+            transition_count_here = self.transition_count.setdefault(last_pos, dict())
+            transition_count_here[pos] = transition_count_here.get(pos, 0) + int(transition_pair_count[pair_id])
+        for pair_id, count in zip(emission_pairs.tolist(), emission_pair_count.tolist()):
+            pos, word = corpus_cache.tags[pair_id // word_num], corpus_cache.words[pair_id % word_num]
+            emission_count_here = self.emission_count.setdefault(pos, dict())
+            emission_count_here[word] = emission_count_here.get(word, 0) + count
+
+    # turn the current counts into probs
+    def normalize(self):
+        init_prob = dict()
+        transition_prob = dict()
+        emission_prob = dict()
+
+        sentence_count = self.sentence_count
+        first_pos_count = self.first_pos_count
+        pos_count = self.pos_count
+        transition_count = self.transition_count
+        emission_count = self.emission_count
+
         # calculate init prob for each pos (init_prob contains every pos)
         for pos in pos_count:
             if pos not in first_pos_count:
@@ -112,64 +225,138 @@ class CorpusHandler:
         self.init_prob = init_prob
         self.transition_prob = transition_prob
         self.emission_prob = emission_prob
+        self.dense_hmm = None
 
         return init_prob, transition_prob, emission_prob
 
+    # convert the trained dicts to arrays once, they are rebuilt after the next training
+    def to_dense(self):
+        if self.dense_hmm is None:
+            self.dense_hmm = DenseHMM.from_dicts(self.init_prob, self.transition_prob, self.emission_prob)
+
+        return self.dense_hmm
+
+    # write the trained model as a compiled binary file, a tagger process loads it with DenseHMM.load
+    def save(self, model_path):
+        self.to_dense().save(model_path)
+
+    # read the word forms and gold pos of every sentence
+    def read_sentences(self, file_path):
+        if self.use_cache:
+            return CorpusCache.load(file_path, self.cache_dir).token_lists()
+
+        token_lists = []
+        gold_pos_lists = []
+        with open(file_path, 'r', encoding='utf-8') as file:
+            for sentence in parse_incr(file):
+                token_lists.append([token['form'] for token in sentence])
+                gold_pos_lists.append([token['upos'] for token in sentence])
+
+        return token_lists, gold_pos_lists
+
     # predict
-    def predict(self, evaluate_file_path):
+    def predict(self, evaluate_file_path, oov_policy=None):
         token_count = 0
         accurate_pos_count = 0
 
-        # open evaluation corpus file and predict pos
-        with open(evaluate_file_path, 'r', encoding='utf-8') as file:
-            reader = parse_incr(file)
-            for sentence in reader:
-                # predict token pos
-                token_list = [token['form'] for token in sentence]
-                token_count += len(token_list)
-                _, pos_list = viterbi(self.init_prob, self.transition_prob, self.emission_prob, token_list)
-
-                # compare predict pos and gold pos
-                for i in range(len(sentence)):
-                    gold_pos = sentence[i]['upos']
-                    predict_pos = pos_list[i]
-                    if predict_pos == gold_pos:
-                        accurate_pos_count += 1
+        # read evaluation corpus file (or its cache) and predict pos
+        token_lists, gold_pos_lists = self.read_sentences(evaluate_file_path)
+        for token_list, gold_pos_list in zip(token_lists, gold_pos_lists):
+            # predict token pos
+            token_count += len(token_list)
+            _, pos_list = viterbi(self.init_prob, self.transition_prob, self.emission_prob, token_list, oov_policy)
+
+            # compare predict pos and gold pos
+            for i in range(len(token_list)):
+                gold_pos = gold_pos_list[i]
+                predict_pos = pos_list[i]
+                if predict_pos == gold_pos:
+                    accurate_pos_count += 1
 
         # calculate accuracy
         accuracy = accurate_pos_count / token_count
 
         return accuracy
 
-    # Extra: show the speed vs. sentence length curve
-    def predict_time(self, evaluate_file_path_list):
+    # predict with the batched viterbi, one array pass per length bucket instead of one loop per sentence
+    def predict_batch(self, evaluate_file_path, bucket_width=1, oov_policy=None):
+        token_lists, gold_pos_lists = self.read_sentences(evaluate_file_path)
+        results = self.to_dense().viterbi_batch(token_lists, bucket_width, oov_policy=oov_policy)
+
+        token_count = 0
+        accurate_pos_count = 0
+        for gold_pos_list, (_, pos_list) in zip(gold_pos_lists, results):
+            token_count += len(gold_pos_list)
+            accurate_pos_count += sum(1 for gold_pos, predict_pos in zip(gold_pos_list, pos_list)
+                                      if predict_pos == gold_pos)
+
+        # calculate accuracy
+        accuracy = accurate_pos_count / token_count
+
+        return accuracy
 
-        sentence_time_cost = [0] * 150
-        sentence_length_count = [0] * 150
+    # predict several files at once, the sentences are sharded over a process pool
+    def predict_parallel(self, evaluate_file_path_list, max_workers=None, oov_policy=None):
+        results = evaluate_parallel(self.to_dense(), evaluate_file_path_list, max_workers, oov_policy=oov_policy,
+                                    use_cache=self.use_cache, cache_dir=self.cache_dir)
 
-        for evaluate_file_path in evaluate_file_path_list:
-            # open evaluation corpus file and predict pos
-            with open(evaluate_file_path, 'r', encoding='utf-8') as file:
-                reader = parse_incr(file)
-                for sentence in reader:
-                    # predict token pos
-                    token_list = [token['form'] for token in sentence]
-                    sentence_length = len(sentence)
+        return [accuracy for accuracy, _ in results]
 
+    # Extra: show the speed vs. sentence length curve
+    def predict_time(self, evaluate_file_path_list, bucket_bounds=None, json_path=None):
+        """
+        Time the dict viterbi on every sentence with the global PROFILER, PROFILER.report() holds the phase timings,
+        latency percentiles per length bucket and tokens/s afterwards.
+        :param evaluate_file_path_list: List of CoNLL-U files
+        :param bucket_bounds: Length buckets of the latency histogram, see Profiler
+        :param json_path: Optional path to export the report as json
+        :return: List indexed by sentence length of the mean time cost in ms, None for lengths without sentences
+        """
+        PROFILER.reset(enabled=True, bucket_bounds=bucket_bounds)
+        try:
+            for evaluate_file_path in evaluate_file_path_list:
+                with PROFILER.phase("parsing"):
+                    token_lists, _ = self.read_sentences(evaluate_file_path)
+
+                for token_list in token_lists:
                     # time count
-                    strart_time = time.time()
-                    _, pos_list = viterbi(self.init_prob, self.transition_prob, self.emission_prob, token_list)
-                    finish_time = time.time()
+                    start_time = perf_counter_ns()
+                    viterbi(self.init_prob, self.transition_prob, self.emission_prob, token_list)
+                    PROFILER.record_sentence(len(token_list), perf_counter_ns() - start_time)
+        finally:
+            PROFILER.enabled = False
+
+        if json_path is not None:
+            PROFILER.save_json(json_path, decoder="viterbi", files=evaluate_file_path_list)
+
+        return PROFILER.mean_latency_by_length()
+
+    # speed vs. sentence length of the batched viterbi, the time of a bucket is shared by its sentences and the
+    # latency percentiles of the report are over buckets, not sentences
+    def predict_time_batch(self, evaluate_file_path_list, bucket_bounds=None, json_path=None):
+        dense_hmm = self.to_dense()
+
+        PROFILER.reset(enabled=True, bucket_bounds=bucket_bounds)
+        try:
+            token_lists = []
+            for evaluate_file_path in evaluate_file_path_list:
+                with PROFILER.phase("parsing"):
+                    token_lists += self.read_sentences(evaluate_file_path)[0]
 
-                    # save the time cost
-                    sentence_time_cost[sentence_length] += finish_time - strart_time
-                    sentence_length_count[sentence_length] += 1
+            # every bucket holds sentences of exactly one length
+            for _, observation_ids, lengths in dense_hmm.buckets(token_lists, bucket_width=1):
+                # time count
+                start_time = perf_counter_ns()
+                viterbi_log_batch(dense_hmm.log_init, dense_hmm.log_transition, dense_hmm.log_emission,
+                                  observation_ids, lengths)
+                PROFILER.record_batch(lengths.tolist(), perf_counter_ns() - start_time)
+        finally:
+            PROFILER.enabled = False
 
-        # calculate average time cost
-        time_length = [sentence_time_cost[sentence_length] * 1000 / sentence_length_count[sentence_length]
-                       if sentence_length_count[sentence_length] != 0 else None for sentence_length in range(150)]
+        if json_path is not None:
+            PROFILER.save_json(json_path, decoder="viterbi_log_batch", files=evaluate_file_path_list)
 
-        return time_length
+        return PROFILER.mean_latency_by_length()
 
 
 if __name__ == "__main__":
@@ -178,7 +365,7 @@ if __name__ == "__main__":
     DE_GSD_TEST = "./data/de_gsd-ud-test.conllu"
     DE_SGD_DEV = "./data/de_gsd-ud-dev.conllu"
 
-    corpusHandler = CorpusHandler(DE_GSD_TRAIN)
+    corpusHandler = CorpusHandler(DE_GSD_TRAIN, use_cache=True)
 
     test_accuracies = []
     dev_accuracies = []
@@ -189,8 +376,7 @@ if __name__ == "__main__":
     time1 = time.time()
     for init_sentence_num in range(500, 14500, size_increment):
         init_prob, transition_prob, emission_prob = corpusHandler.train_on_corpus(init_sentence_num)
-        test_accuracy = corpusHandler.predict(DE_GSD_TEST)
-        dev_accuracy = corpusHandler.predict(DE_SGD_DEV)
+        test_accuracy, dev_accuracy = corpusHandler.predict_parallel([DE_GSD_TEST, DE_SGD_DEV])
         print("test accruacy", test_accuracy)
         print("dev accruacy", dev_accuracy)
         test_accuracies.append(test_accuracy)
@@ -208,7 +394,7 @@ if __name__ == "__main__":
     print(time.time() - time1)
 
     # Extra: show the speed vs. sentence length curve
-    time_length = corpusHandler.predict_time([DE_GSD_TRAIN, DE_GSD_TEST, DE_SGD_DEV])
+    time_length = corpusHandler.predict_time_batch([DE_GSD_TRAIN, DE_GSD_TEST, DE_SGD_DEV])
     # get the index and value of non-None values
     x = [i for i, value in enumerate(time_length) if value is not None]
     y = [value for value in time_length if value is not None]
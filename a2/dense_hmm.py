@@ -0,0 +1,256 @@
+import numpy as np
+from binary_store import save_blocks, load_blocks, pack_strings, unpack_strings
+from viterbi import viterbi_log_scores, viterbi_log_batch_scores, viterbi_log_beam, viterbi_log_nbest, \
+    LOG_TIE_TOLERANCE
+from oov import oov_log_emission
+from profiler import PROFILER
+
+
+# saved model files are written with binary_store.py
+MODEL_MAGIC = b"DENSEHMM"
+MODEL_VERSION = 2
+
+
+# dense array representation of the HMM trained by CorpusHandler
+class DenseHMM:
+    states = None
+    state_to_id = None
+    word_to_id = None
+    unknown_id = None
+    log_init = None
+    log_transition = None
+    log_emission = None
+
+    def __init__(self, states, word_to_id, log_init, log_transition, log_emission):
+        """
+        :param states: List of state names, the position in the list is the state id
+        :param word_to_id: Dict mapping every known word to its column in log_emission
+        :param log_init: Array (S,) of log initial probabilities
+        :param log_transition: Array (S, S) of log transition probabilities
+        :param log_emission: Array (S, V + 1) of log emission probabilities, the last column is for unknown words
+        """
+        self.states = states
+        self.state_to_id = {state: i for i, state in enumerate(states)}
+        self.word_to_id = word_to_id
+        self.unknown_id = len(word_to_id)
+        self.log_init = log_init
+        self.log_transition = log_transition
+        self.log_emission = log_emission
+
+    @classmethod
+    def from_dicts(cls, init_prob: dict, transition_prob: dict, emission_prob: dict):
+        # the dict viterbi breaks ties by the largest state name (tuple comparison in max),
+        # np.argmax breaks ties by the first index, so store the states in descending order
+        states = sorted(init_prob, reverse=True)
+        state_to_id = {state: i for i, state in enumerate(states)}
+
+        # intern every word that is emitted by any state
+        word_to_id = dict()
+        for state in states:
+            for word in emission_prob.get(state, {}):
+                if word not in word_to_id:
+                    word_to_id[word] = len(word_to_id)
+
+        init = np.array([init_prob[state] for state in states], dtype=np.float64)
+
+        # states that never precede another state have no transition row, they can't be followed
+        transition = np.zeros((len(states), len(states)), dtype=np.float64)
+        for last_state, row in transition_prob.items():
+            for current_state, prob in row.items():
+                transition[state_to_id[last_state], state_to_id[current_state]] = prob
+
+        # the extra last column has probability 1 for every state, it is used for unknown words
+        emission = np.zeros((len(states), len(word_to_id) + 1), dtype=np.float64)
+        emission[:, -1] = 1
+        for state in states:
+            for word, prob in emission_prob.get(state, {}).items():
+                emission[state_to_id[state], word_to_id[word]] = prob
+
+        # log(0) = -inf is intended here
+        with np.errstate(divide='ignore'):
+            return cls(states, word_to_id, np.log(init), np.log(transition), np.log(emission))
+
+    def save(self, file_path):
+        """
+        Write the model to one binary file: the tag and vocabulary tables in the header and the float arrays as raw
+        little-endian data, so load can map them without parsing.
+        :param file_path: Path of the model file
+        """
+        blocks = {"vocabulary": pack_strings(self.word_to_id)}
+        for name in ["log_init", "log_transition", "log_emission"]:
+            blocks[name] = np.ascontiguousarray(getattr(self, name), dtype='<f8')
+
+        save_blocks(file_path, MODEL_MAGIC, MODEL_VERSION,
+                    {"states": self.states, "vocabulary_size": len(self.word_to_id)}, blocks)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Load a model written by save. The arrays are read-only numpy memmaps, so the OS shares one physical copy
+        of the emission matrix between all processes that load the same file.
+        :param file_path: Path of the model file
+        :return: DenseHMM
+        """
+        header, blocks = load_blocks(file_path, MODEL_MAGIC, MODEL_VERSION)
+        vocabulary = unpack_strings(blocks["vocabulary"], header["vocabulary_size"])
+        word_to_id = {word: i for i, word in enumerate(vocabulary)}
+
+        return cls(header["states"], word_to_id, blocks["log_init"], blocks["log_transition"], blocks["log_emission"])
+
+    def encode(self, input_sequence: list):
+        # map words to emission columns, unknown words to the last column
+        return np.array([self.word_to_id.get(word, self.unknown_id) for word in input_sequence], dtype=np.intp)
+
+    def emission_scores(self, input_sequences: list, observation_ids, lengths, oov_policy=None):
+        # gather the emission columns of a (B, T) id array into (B, T, S) scores,
+        # fancy indexing makes a copy, so the oov rows never touch log_emission
+        scores = self.log_emission.T[observation_ids]
+
+        if oov_policy is not None:
+            unknown = (observation_ids == self.unknown_id) & (np.arange(observation_ids.shape[1]) < lengths[:, None])
+            for row, i in zip(*np.nonzero(unknown)):
+                scores[row, i] = oov_log_emission(oov_policy, input_sequences[row][i], self.states)
+
+        return scores
+
+    def viterbi(self, input_sequence: list, oov_policy=None):
+        """
+        :param input_sequence: List of observations
+        :param oov_policy: Optional policy from oov.py giving emission probs for unknown words
+        :return: The maximum log likelihood and the best path sequence list
+        """
+
+        # check if the input sequence is empty
+        if len(input_sequence) < 1:
+            return None
+
+        with PROFILER.phase("lookup"):
+            emission_scores = self.emission_scores([input_sequence], self.encode(input_sequence)[None],
+                                                   np.array([len(input_sequence)]), oov_policy)
+        max_log_likelihood, best_path = viterbi_log_scores(self.log_init, self.log_transition, emission_scores[0])
+        return max_log_likelihood, [self.states[state_id] for state_id in best_path]
+
+    def viterbi_beam(self, input_sequence: list, beam_size=None, beam_threshold=None, oov_policy=None):
+        """
+        :param input_sequence: List of observations
+        :param beam_size: Number of states kept per position, None for no limit
+        :param beam_threshold: Keep only states whose log score is at most this below the best one, None for no limit
+        :param oov_policy: Optional policy from oov.py giving emission probs for unknown words
+        :return: The maximum log likelihood and the best path sequence list found within the beam
+        """
+        if len(input_sequence) < 1:
+            return None
+
+        with PROFILER.phase("lookup"):
+            emission_scores = self.emission_scores([input_sequence], self.encode(input_sequence)[None],
+                                                   np.array([len(input_sequence)]), oov_policy)
+        max_log_likelihood, best_path = viterbi_log_beam(self.log_init, self.log_transition, emission_scores[0],
+                                                         beam_size, beam_threshold)
+        return max_log_likelihood, [self.states[state_id] for state_id in best_path]
+
+    def viterbi_nbest(self, input_sequence: list, n, oov_policy=None):
+        """
+        :param input_sequence: List of observations
+        :param n: Number of tag sequences
+        :param oov_policy: Optional policy from oov.py giving emission probs for unknown words
+        :return: List of at most n (log likelihood, path sequence list), best first
+        """
+        if len(input_sequence) < 1:
+            return []
+
+        with PROFILER.phase("lookup"):
+            emission_scores = self.emission_scores([input_sequence], self.encode(input_sequence)[None],
+                                                   np.array([len(input_sequence)]), oov_policy)
+        return [(log_likelihood, [self.states[state_id] for state_id in path])
+                for log_likelihood, path in viterbi_log_nbest(self.log_init, self.log_transition,
+                                                              emission_scores[0], n)]
+
+    def viterbi_batch(self, input_sequences: list, bucket_width=1, max_batch_size=1024, oov_policy=None):
+        """
+        :param input_sequences: List of observation lists
+        :param bucket_width: Sequences whose lengths differ by less than this are padded into one bucket
+        :param max_batch_size: Maximum number of sequences decoded in one array pass
+        :param oov_policy: Optional policy from oov.py giving emission probs for unknown words
+        :return: List of (maximum log likelihood, best path sequence list) in input order, None for empty sequences
+        """
+        results = [None] * len(input_sequences)
+        for indexes, observation_ids, lengths in self.buckets(input_sequences, bucket_width, max_batch_size):
+            with PROFILER.phase("lookup"):
+                emission_scores = self.emission_scores([input_sequences[index] for index in indexes],
+                                                       observation_ids, lengths, oov_policy)
+            max_log_likelihoods, best_paths = viterbi_log_batch_scores(self.log_init, self.log_transition,
+                                                                       emission_scores, lengths)
+            for index, max_log_likelihood, best_path in zip(indexes, max_log_likelihoods, best_paths):
+                results[index] = float(max_log_likelihood), [self.states[state_id] for state_id in best_path]
+
+        return results
+
+    def buckets(self, input_sequences: list, bucket_width=1, max_batch_size=1024):
+        # group the sequences by length and yield (input indexes, padded word id array, lengths) per bucket
+        indexes_by_bucket = dict()
+        for index, input_sequence in enumerate(input_sequences):
+            # empty sequences can't be decoded
+            if len(input_sequence) > 0:
+                indexes_by_bucket.setdefault((len(input_sequence) - 1) // bucket_width, []).append(index)
+
+        for bucket in sorted(indexes_by_bucket):
+            bucket_indexes = indexes_by_bucket[bucket]
+            for start in range(0, len(bucket_indexes), max_batch_size):
+                indexes = bucket_indexes[start:start + max_batch_size]
+                lengths = np.array([len(input_sequences[index]) for index in indexes], dtype=np.intp)
+
+                # pad with the unknown word column, padded positions are masked in the decoder
+                with PROFILER.phase("lookup"):
+                    observation_ids = np.full((len(indexes), lengths.max()), self.unknown_id, dtype=np.intp)
+                    for row, index in enumerate(indexes):
+                        observation_ids[row, :lengths[row]] = self.encode(input_sequences[index])
+
+                yield indexes, observation_ids, lengths
+
+    def path_log_likelihood(self, input_sequence: list, path: list):
+        # log likelihood of one given state path, used to compare paths of different decoders
+        observation_ids = self.encode(input_sequence)
+        state_ids = np.array([self.state_to_id[state] for state in path], dtype=np.intp)
+        return float(self.log_init[state_ids[0]] + self.log_transition[state_ids[:-1], state_ids[1:]].sum() +
+                     self.log_emission[state_ids, observation_ids].sum())
+
+
+if __name__ == "__main__":
+    from conllu import parse_incr
+    from corpus_handler import CorpusHandler
+    from viterbi import viterbi
+
+    # define file path
+    DE_GSD_TRAIN = "./data/de_gsd-ud-train.conllu"
+    DE_GSD_TEST = "./data/de_gsd-ud-test.conllu"
+    DE_SGD_DEV = "./data/de_gsd-ud-dev.conllu"
+
+    corpusHandler = CorpusHandler(DE_GSD_TRAIN)
+    init_prob, transition_prob, emission_prob = corpusHandler.train_on_corpus(14000)
+    dense_hmm = DenseHMM.from_dicts(init_prob, transition_prob, emission_prob)
+
+    # compare the best paths of the dict viterbi and the dense viterbi
+    for evaluate_file_path in [DE_GSD_TEST, DE_SGD_DEV]:
+        sentence_count = 0
+        mismatch_count = 0
+        tie_count = 0
+        underflow_count = 0
+        with open(evaluate_file_path, 'r', encoding='utf-8') as file:
+            for sentence in parse_incr(file):
+                token_list = [token['form'] for token in sentence]
+                likelihood, pos_list = viterbi(init_prob, transition_prob, emission_prob, token_list)
+                log_likelihood, dense_pos_list = dense_hmm.viterbi(token_list)
+
+                sentence_count += 1
+                # the dict viterbi underflows to 0.0 on long sentences and every path ties
+                if likelihood == 0:
+                    underflow_count += 1
+                elif pos_list != dense_pos_list:
+                    # paths with mathematically equal likelihood are picked by float rounding in the dict viterbi
+                    if abs(dense_hmm.path_log_likelihood(token_list, pos_list) - log_likelihood) < LOG_TIE_TOLERANCE:
+                        tie_count += 1
+                    else:
+                        mismatch_count += 1
+
+        print(evaluate_file_path, "sentences", sentence_count, "mismatches", mismatch_count,
+              "equal likelihood paths", tie_count, "underflow (skipped)", underflow_count)
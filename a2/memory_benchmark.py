@@ -0,0 +1,60 @@
+import sys
+import tracemalloc
+from corpus_handler import CorpusHandler
+from oov import UniformOOV, SmoothedOOV, SuffixOOV
+
+
+# recursive size of the model tables in bytes (dicts, their keys and values)
+def deep_size(obj, seen=None):
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in obj)
+
+    return size
+
+
+def model_size(corpus_handler):
+    return deep_size([corpus_handler.init_prob, corpus_handler.transition_prob, corpus_handler.emission_prob])
+
+
+def emission_entry_count(corpus_handler):
+    return sum(len(words) for words in corpus_handler.emission_prob.values())
+
+
+if __name__ == "__main__":
+    # define file path
+    DE_GSD_TRAIN = "./data/de_gsd-ud-train.conllu"
+    DE_GSD_TEST = "./data/de_gsd-ud-test.conllu"
+    DE_SGD_DEV = "./data/de_gsd-ud-dev.conllu"
+
+    corpusHandler = CorpusHandler(DE_GSD_TRAIN)
+    corpusHandler.train_on_corpus(14000)
+
+    oov_policies = {
+        "none": None,
+        "uniform": UniformOOV(corpusHandler.init_prob),
+        "smoothed": SmoothedOOV(corpusHandler.pos_count, corpusHandler.emission_prob),
+        "suffix": SuffixOOV(corpusHandler.pos_count, corpusHandler.emission_count),
+    }
+
+    print("model size before decoding: %d bytes, %d emission entries" %
+          (model_size(corpusHandler), emission_entry_count(corpusHandler)))
+
+    # decode the full dev + test + train sets with each policy, the model tables must not grow
+    for name, oov_policy in oov_policies.items():
+        tracemalloc.start()
+        accuracies = [corpusHandler.predict(path, oov_policy) for path in [DE_SGD_DEV, DE_GSD_TEST, DE_GSD_TRAIN]]
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print("%-8s dev %.4f test %.4f train %.4f | model size after decoding: %d bytes, %d emission entries, "
+              "peak decoding memory %.1f MB" % (name, *accuracies, model_size(corpusHandler),
+                                                emission_entry_count(corpusHandler), peak / 2 ** 20))
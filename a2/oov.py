@@ -0,0 +1,87 @@
+import math
+
+
+# policies for the emission probs of out-of-vocabulary words (words that no state emitted in training)
+# viterbi asks policy.emission(word) for a dict state -> prob instead of writing the word into emission_prob,
+# so the trained tables stay read-only while decoding
+
+# every state emits the unknown word with prob 1, i.e. the word is ignored (the original viterbi behaviour)
+class UniformOOV:
+    states = None
+
+    def __init__(self, states):
+        self.states = list(states)
+
+    def emission(self, word):
+        return {state: 1 for state in self.states}
+
+
+# the Laplace smoothed prob of an unseen word, the same add-one smoothing as the emission probs in CorpusHandler.train
+class SmoothedOOV:
+    unseen_prob = None
+
+    def __init__(self, pos_count: dict, emission_prob: dict):
+        self.unseen_prob = {pos: 1 / (pos_count[pos] + len(emission_prob[pos])) for pos in pos_count}
+
+    def emission(self, word):
+        return dict(self.unseen_prob)
+
+
+# estimate the emission from the suffix of the word, learned from the rare words of the training corpus
+class SuffixOOV:
+    pos_count = None
+    prior = None
+    suffix_count = None
+    max_suffix_length = None
+
+    def __init__(self, pos_count: dict, emission_count: dict, max_suffix_length=4, max_word_count=10):
+        """
+        :param pos_count: Dict of the training count of each pos
+        :param emission_count: Dict of the training count of each pos-word pair
+        :param max_suffix_length: Longest suffix looked up for an unknown word
+        :param max_word_count: Only words occurring at most this often are used, they resemble unknown words best
+        """
+        self.pos_count = dict(pos_count)
+        self.max_suffix_length = max_suffix_length
+
+        # P(pos)
+        total = sum(pos_count.values())
+        self.prior = {pos: count / total for pos, count in pos_count.items()}
+
+        # total count of each word over all pos
+        word_count = dict()
+        for pos in emission_count:
+            for word, count in emission_count[pos].items():
+                word_count[word] = word_count.get(word, 0) + count
+
+        # count pos per suffix of the rare words
+        self.suffix_count = dict()
+        for pos in emission_count:
+            for word, count in emission_count[pos].items():
+                if word_count[word] > max_word_count:
+                    continue
+                for length in range(1, min(max_suffix_length, len(word)) + 1):
+                    pos_count_here = self.suffix_count.setdefault(word[-length:], dict())
+                    pos_count_here[pos] = pos_count_here.get(pos, 0) + count
+
+    def emission(self, word):
+        # use the longest known suffix
+        for length in range(min(self.max_suffix_length, len(word)), 0, -1):
+            pos_count_here = self.suffix_count.get(word[-length:])
+            if pos_count_here is None:
+                continue
+
+            # P(pos | suffix) smoothed towards P(pos) (m-estimate), P(word | pos) ~ P(pos | suffix) / P(pos) by
+            # Bayes' rule; add-one smoothing instead would hugely boost rare pos that never had the suffix
+            total = sum(pos_count_here.values())
+            return {pos: (pos_count_here.get(pos, 0) + self.prior[pos]) / (total + 1) / self.prior[pos]
+                    for pos in self.pos_count}
+
+        # no suffix is known, P(pos | suffix) = P(pos) gives the same prob for every pos
+        return {pos: 1 for pos in self.pos_count}
+
+
+# log of the emission probs of a policy in the given state order, zero probs become -inf
+def oov_log_emission(oov_policy, word, states):
+    emission = oov_policy.emission(word)
+    return [math.log(emission[state]) if emission[state] > 0 else -math.inf for state in states]
@@ -0,0 +1,163 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from conllu import parse
+from corpus_cache import CorpusCache
+
+# the model of a worker process, set once by init_worker instead of being pickled with every task
+worker_hmm = None
+worker_oov_policy = None
+worker_caches = dict()
+
+
+def init_worker(dense_hmm, oov_policy):
+    global worker_hmm, worker_oov_policy
+    worker_hmm = dense_hmm
+    worker_oov_policy = oov_policy
+
+
+# count per tag [correct, assigned by system, found in gold], the same counts as eval.py
+def precision_recall_counts(gold_pos_lists, pos_lists, precision_recall=None):
+    if precision_recall is None:
+        precision_recall = {}
+
+    for gold_pos_list, pos_list in zip(gold_pos_lists, pos_lists):
+        for tag_gold, tag_system in zip(gold_pos_list, pos_list):
+            if precision_recall.get(tag_system) is None: precision_recall[tag_system] = [0, 0, 0]
+            if precision_recall.get(tag_gold) is None: precision_recall[tag_gold] = [0, 0, 0]
+
+            precision_recall[tag_system][1] += 1  # tag was assigned by system
+            precision_recall[tag_gold][2] += 1  # tag was found in gold standard data
+
+            # observe and count correct tags
+            if tag_system == tag_gold:
+                precision_recall[tag_gold][0] += 1  # tag assignment was correct
+
+    return precision_recall
+
+
+def merge_counts(precision_recall, other):
+    for tag, counts in other.items():
+        if precision_recall.get(tag) is None: precision_recall[tag] = [0, 0, 0]
+        for i in range(3):
+            precision_recall[tag][i] += counts[i]
+
+    return precision_recall
+
+
+def accuracy_from_counts(precision_recall):
+    correct = sum(counts[0] for counts in precision_recall.values())
+    overall = sum(counts[1] for counts in precision_recall.values())
+    return correct / overall
+
+
+# print precision, recall and F1 score per tag like eval.py
+def print_report(precision_recall):
+    print("\nPrecision, recall, and F1 score:\n")
+    for tag, counts in precision_recall.items():
+        if not 0 in counts:
+            precision = counts[0] / counts[1]
+            recall = counts[0] / counts[2]
+            f1_score = (2 * precision * recall) / (precision + recall)
+            print("%5s %.4f %.4f %.4f" % (tag, precision, recall, f1_score))
+
+    print("\nAccuracy: %.4f\n" % accuracy_from_counts(precision_recall))
+
+
+# split the raw text of a CoNLL-U file into shards of shard_size sentences, the workers parse them
+def split_shards(file_path, shard_size):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        blocks = [block for block in file.read().split("\n\n") if block.strip()]
+
+    for start in range(0, len(blocks), shard_size):
+        yield "\n\n".join(blocks[start:start + shard_size]) + "\n\n"
+
+
+# tag one shard in a worker and return its counts
+def evaluate_shard(file_index, text):
+    token_lists = []
+    gold_pos_lists = []
+    for sentence in parse(text):
+        token_lists.append([token['form'] for token in sentence])
+        gold_pos_lists.append([token['upos'] for token in sentence])
+
+    return file_index, tag_and_count(token_lists, gold_pos_lists)
+
+
+# tag the sentences [start, stop) of a CorpusCache in a worker and return their counts
+def evaluate_cached_shard(file_index, file_path, cache_dir, start, stop):
+    # every worker maps each cache once
+    if file_path not in worker_caches:
+        worker_caches[file_path] = CorpusCache.load(file_path, cache_dir)
+
+    return file_index, tag_and_count(*worker_caches[file_path].token_lists(start, stop))
+
+
+def tag_and_count(token_lists, gold_pos_lists):
+    results = worker_hmm.viterbi_batch(token_lists, oov_policy=worker_oov_policy)
+    pos_lists = [pos_list for _, pos_list in results]
+
+    return precision_recall_counts(gold_pos_lists, pos_lists)
+
+
+def evaluate_parallel(dense_hmm, evaluate_file_path_list, max_workers=None, shard_size=100, oov_policy=None,
+                      use_cache=False, cache_dir=None):
+    """
+    :param dense_hmm: Trained DenseHMM, sent to every worker once
+    :param evaluate_file_path_list: List of CoNLL-U files, their sentences are sharded over the workers
+    :param max_workers: Number of worker processes, os.cpu_count() by default
+    :param shard_size: Number of sentences per task
+    :param oov_policy: Optional policy from oov.py giving emission probs for unknown words
+    :param use_cache: Shard the sentences of each file's CorpusCache instead of parsing the CoNLL-U text
+    :param cache_dir: Directory of the cache files, see CorpusCache.load
+    :return: List of (accuracy, precision_recall counts per tag) for each file
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count()
+
+    precision_recall_list = [{} for _ in evaluate_file_path_list]
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                             initargs=(dense_hmm, oov_policy)) as executor:
+        futures = []
+        for file_index, file_path in enumerate(evaluate_file_path_list):
+            if use_cache:
+                # build the cache once here, the workers only map it
+                sentence_num = len(CorpusCache.load(file_path, cache_dir))
+                for start in range(0, sentence_num, shard_size):
+                    futures.append(executor.submit(evaluate_cached_shard, file_index, file_path, cache_dir,
+                                                   start, start + shard_size))
+            else:
+                for text in split_shards(file_path, shard_size):
+                    futures.append(executor.submit(evaluate_shard, file_index, text))
+
+        # merge the counts of every shard into the counts of its file
+        for future in futures:
+            file_index, precision_recall = future.result()
+            merge_counts(precision_recall_list[file_index], precision_recall)
+
+    return [(accuracy_from_counts(precision_recall), precision_recall) for precision_recall in precision_recall_list]
+
+
+if __name__ == "__main__":
+    import time
+    from corpus_handler import CorpusHandler
+
+    # define file path
+    DE_GSD_TRAIN = "./data/de_gsd-ud-train.conllu"
+    DE_GSD_TEST = "./data/de_gsd-ud-test.conllu"
+    DE_SGD_DEV = "./data/de_gsd-ud-dev.conllu"
+
+    corpusHandler = CorpusHandler(DE_GSD_TRAIN)
+    corpusHandler.train_on_corpus(14000)
+
+    # serial accuracies for comparison
+    time1 = time.time()
+    serial_accuracies = [corpusHandler.predict_batch(path) for path in [DE_GSD_TEST, DE_SGD_DEV]]
+    print("serial", serial_accuracies, time.time() - time1)
+
+    for workers in [1, 2, 4, 8]:
+        time1 = time.time()
+        results = evaluate_parallel(corpusHandler.to_dense(), [DE_GSD_TEST, DE_SGD_DEV], max_workers=workers)
+        print(workers, "workers", [accuracy for accuracy, _ in results], time.time() - time1)
+
+    print_report(results[0][1])
@@ -0,0 +1,160 @@
+import json
+import math
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from time import perf_counter_ns
+
+# shared no-op context manager, a disabled profiler only costs one method call per phase
+NULL_PHASE = nullcontext()
+
+
+# times one phase and adds it to the profiler on exit
+class Phase:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add_phase(self.name, perf_counter_ns() - self.start)
+        return False
+
+
+# nearest-rank percentile of a sorted list
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def latency_summary(latencies_ns):
+    latencies_ns = sorted(latencies_ns)
+    summary = {"count": len(latencies_ns)}
+    if latencies_ns:
+        summary["mean_ms"] = sum(latencies_ns) / len(latencies_ns) / 1e6
+        for p in [50, 95, 99]:
+            summary["p%d_ms" % p] = percentile(latencies_ns, p) / 1e6
+        summary["max_ms"] = latencies_ns[-1] / 1e6
+
+    return summary
+
+
+# records per-phase timings (parsing, lookup, recursion, backtrace) and per-sentence latencies
+class Profiler:
+    enabled = False
+    bucket_bounds = None
+    phase_ns = None
+    phase_calls = None
+    latencies_ns = None
+    length_time_ns = None
+    length_count = None
+    token_count = 0
+    total_ns = 0
+
+    def __init__(self, enabled=True, bucket_bounds=None):
+        """
+        :param enabled: A disabled profiler records nothing and its phases are no-ops
+        :param bucket_bounds: Sorted upper bounds (inclusive) of the sentence length buckets of the latency
+            histogram, e.g. [10, 20, 40, 80], longer sentences go to one open bucket; None for one bucket per length
+        """
+        self.reset(enabled, bucket_bounds)
+
+    def reset(self, enabled=True, bucket_bounds=None):
+        self.enabled = enabled
+        self.bucket_bounds = sorted(bucket_bounds) if bucket_bounds is not None else None
+        self.phase_ns = dict()
+        self.phase_calls = dict()
+        self.latencies_ns = dict()
+        self.length_time_ns = dict()
+        self.length_count = dict()
+        self.token_count = 0
+        self.total_ns = 0
+
+    def phase(self, name):
+        # use as "with profiler.phase(name):"
+        if not self.enabled:
+            return NULL_PHASE
+        return Phase(self, name)
+
+    def add_phase(self, name, elapsed_ns):
+        self.phase_ns[name] = self.phase_ns.get(name, 0) + elapsed_ns
+        self.phase_calls[name] = self.phase_calls.get(name, 0) + 1
+
+    def bucket_of(self, length):
+        if self.bucket_bounds is None:
+            return str(length)
+
+        index = bisect_left(self.bucket_bounds, length)
+        if index == len(self.bucket_bounds):
+            return ">%d" % self.bucket_bounds[-1]
+        low = self.bucket_bounds[index - 1] + 1 if index > 0 else 1
+        return "%d-%d" % (low, self.bucket_bounds[index])
+
+    def record_sentence(self, length, latency_ns):
+        if not self.enabled:
+            return
+
+        self.latencies_ns.setdefault(self.bucket_of(length), []).append(latency_ns)
+        self.length_time_ns[length] = self.length_time_ns.get(length, 0) + latency_ns
+        self.length_count[length] = self.length_count.get(length, 0) + 1
+        self.token_count += length
+        self.total_ns += latency_ns
+
+    def record_batch(self, lengths, latency_ns):
+        """
+        One batch decoded in latency_ns. The mean latency per length and tokens/s count every sentence, the latency
+        histogram gets one sample per batch (the time per sentence of the batch), its percentiles are over batches.
+        :param lengths: Sentence lengths of the batch, all in one length bucket
+        :param latency_ns: Time of the whole batch
+        """
+        if not self.enabled:
+            return
+
+        per_sentence_ns = latency_ns / len(lengths)
+        self.latencies_ns.setdefault(self.bucket_of(max(lengths)), []).append(per_sentence_ns)
+        for length in lengths:
+            self.length_time_ns[length] = self.length_time_ns.get(length, 0) + per_sentence_ns
+            self.length_count[length] = self.length_count.get(length, 0) + 1
+            self.token_count += length
+        self.total_ns += latency_ns
+
+    def mean_latency_by_length(self):
+        # list indexed by sentence length of the mean latency in ms, None for lengths without sentences
+        max_length = max(self.length_count) + 1 if self.length_count else 0
+        return [self.length_time_ns[length] / 1e6 / self.length_count[length] if length in self.length_count else None
+                for length in range(max_length)]
+
+    def report(self):
+        all_latencies_ns = [latency for latencies in self.latencies_ns.values() for latency in latencies]
+        total_ns = self.total_ns
+
+        # buckets in length order
+        def bucket_key(bucket):
+            return int(bucket.lstrip(">").split("-")[0]) + (0.5 if bucket.startswith(">") else 0)
+
+        return {
+            "phases": {name: {"calls": self.phase_calls[name], "total_ms": self.phase_ns[name] / 1e6}
+                       for name in self.phase_ns},
+            "latency": latency_summary(all_latencies_ns),
+            "latency_by_length": {bucket: latency_summary(self.latencies_ns[bucket])
+                                  for bucket in sorted(self.latencies_ns, key=bucket_key)},
+            "tokens": self.token_count,
+            "tokens_per_s": self.token_count / (total_ns / 1e9) if total_ns > 0 else None,
+        }
+
+    def save_json(self, file_path, **metadata):
+        # metadata (e.g. code version, decoder name) is stored next to the report to compare runs
+        with open(file_path, 'w', encoding='utf-8') as file:
+            json.dump(dict(metadata, created=time.strftime("%Y-%m-%d %H:%M:%S"), report=self.report()), file,
+                      indent=2)
+
+
+# the profiler used by the decoders, disabled unless a caller enables it with PROFILER.reset(enabled=True)
+PROFILER = Profiler(enabled=False)
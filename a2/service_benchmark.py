@@ -0,0 +1,165 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from time import perf_counter_ns
+from profiler import latency_summary
+from tagging_service import load_model
+
+
+# one keep-alive HTTP connection to the tagging service
+class ServiceClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=8080, unix_path=None):
+        if unix_path is not None:
+            return cls(*await asyncio.open_unix_connection(unix_path))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, method, path, payload=None):
+        # (status, json response)
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b""
+        self.writer.write(b"%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                          b"Content-Length: %d\r\n\r\n" % (method.encode(), path.encode(), len(body)) + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        content_length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            if name.strip().lower() == "content-length":
+                content_length = int(value)
+        return status, json.loads(await self.reader.readexactly(content_length))
+
+    async def tag(self, tokens):
+        return await self.request("POST", "/tag", {"tokens": tokens})
+
+    async def stats(self):
+        return (await self.request("GET", "/stats"))[1]
+
+    def close(self):
+        self.writer.close()
+
+
+async def run_load(token_lists, request_num, concurrency, host="127.0.0.1", port=8080, unix_path=None):
+    """
+    Closed-loop load: concurrency clients, each sends its next sentence as soon as the last answer arrived.
+    :param token_lists: Sentences, sent round robin
+    :param request_num: Total number of requests
+    :param concurrency: Number of clients (connections)
+    :return: Dict of requests/s, latency percentiles, rejected requests and the service counters
+    """
+    latencies_ns = []
+    rejected = 0
+    next_request = 0
+
+    # the service counters are totals since its start
+    client = await ServiceClient.connect(host, port, unix_path)
+    stats_before = await client.stats()
+    client.close()
+
+    async def client_loop():
+        nonlocal next_request, rejected
+        client = await ServiceClient.connect(host, port, unix_path)
+        try:
+            while next_request < request_num:
+                tokens = token_lists[next_request % len(token_lists)]
+                next_request += 1
+                start_time = perf_counter_ns()
+                status, _ = await client.tag(tokens)
+                if status == 503:
+                    rejected += 1
+                else:
+                    latencies_ns.append(perf_counter_ns() - start_time)
+        finally:
+            client.close()
+
+    time1 = time.perf_counter()
+    await asyncio.gather(*[client_loop() for _ in range(concurrency)])
+    seconds = time.perf_counter() - time1
+
+    client = await ServiceClient.connect(host, port, unix_path)
+    stats_after = await client.stats()
+    client.close()
+
+    batches = stats_after["batches"] - stats_before["batches"]
+    return {
+        "requests_per_s": len(latencies_ns) / seconds,
+        "latency": latency_summary(latencies_ns),
+        "rejected": rejected,
+        "mean_batch_size": (stats_after["requests"] - stats_before["requests"]) / batches if batches else None,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# start tagging_service.py in a subprocess and wait until it answers
+def start_service(model_path, port, options):
+    process = subprocess.Popen([sys.executable, "tagging_service.py", "--model", model_path, "--port", str(port)] +
+                               options, stdout=subprocess.DEVNULL)
+
+    async def wait_until_up():
+        for _ in range(200):
+            try:
+                client = await ServiceClient.connect(port=port)
+                await client.request("GET", "/health")
+                client.close()
+                return
+            except OSError:
+                await asyncio.sleep(0.05)
+        raise TimeoutError("the service didn't start")
+
+    asyncio.run(wait_until_up())
+    return process
+
+
+if __name__ == "__main__":
+    from corpus_handler import CorpusHandler
+
+    # define file path
+    DE_GSD_TRAIN = "./data/de_gsd-ud-train.conllu"
+    DE_GSD_TEST = "./data/de_gsd-ud-test.conllu"
+    DE_SGD_DEV = "./data/de_gsd-ud-dev.conllu"
+
+    # the train file is not always bundled, the dev file stands in for it
+    model_path = os.path.join(tempfile.mkdtemp(), "de_gsd.hmm")
+    load_model(model_path, DE_GSD_TRAIN if os.path.exists(DE_GSD_TRAIN) else DE_SGD_DEV)
+    token_lists, _ = CorpusHandler(DE_GSD_TEST).read_sentences(DE_GSD_TEST)
+
+    request_num = 2000
+    setups = {
+        "naive": ["--naive"],
+        "batched 1 process": ["--workers", "1"],
+        "batched 1 thread": ["--workers", "1", "--pool", "thread"],
+        "batched 2 processes": ["--workers", "2"],
+    }
+
+    print("%-20s %11s %8s %8s %8s %10s %9s" % ("service", "concurrency", "req/s", "p50 ms", "p99 ms", "batch size",
+                                               "rejected"))
+    for name, options in setups.items():
+        port = free_port()
+        process = start_service(model_path, port, options)
+        try:
+            for concurrency in [1, 16, 64]:
+                result = asyncio.run(run_load(token_lists, request_num, concurrency, port=port))
+                print("%-20s %11d %8.0f %8.2f %8.2f %10s %9d" % (
+                    name, concurrency, result["requests_per_s"], result["latency"]["p50_ms"],
+                    result["latency"]["p99_ms"], "-" if result["mean_batch_size"] is None else
+                    "%.1f" % result["mean_batch_size"], result["rejected"]))
+        finally:
+            process.terminate()
+            process.wait()
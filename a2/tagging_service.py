@@ -0,0 +1,358 @@
+import asyncio
+import json
+import os
+import signal
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dense_hmm import DenseHMM
+from profiler import latency_summary
+
+# the model of a worker, loaded once by init_worker from the memory-mapped model file
+worker_hmm = None
+
+HTTP_REASONS = {200: b"OK", 400: b"Bad Request", 404: b"Not Found", 500: b"Internal Server Error",
+                503: b"Service Unavailable"}
+
+
+def init_worker(model_path):
+    global worker_hmm
+    worker_hmm = DenseHMM.load(model_path)
+
+
+def tag_batch(token_lists, bucket_width):
+    # runs in a worker: one viterbi_batch call for the whole micro-batch
+    return worker_hmm.viterbi_batch(token_lists, bucket_width)
+
+
+# live counters of the service, the latencies of the last window_size requests and the completions per second of the
+# last throughput_window seconds are kept
+class ServiceStats:
+    def __init__(self, window_size=10000, throughput_window=10):
+        """
+        :param window_size: Number of recent requests in the latency percentiles
+        :param throughput_window: Whole seconds over which the current requests/s are counted
+        """
+        self.started = time.monotonic()
+        self.throughput_window = throughput_window
+        self.requests = 0
+        self.rejected = 0
+        self.failed = 0
+        self.tokens = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.latencies_ns = deque(maxlen=window_size)
+        # [second, completed requests] per second, independent of window_size so any rate can be counted
+        self.completed_per_second = deque()
+
+    def record_request(self, token_num, latency_ns):
+        self.requests += 1
+        self.tokens += token_num
+        self.latencies_ns.append(latency_ns)
+
+        second = int(time.monotonic())
+        if self.completed_per_second and self.completed_per_second[-1][0] == second:
+            self.completed_per_second[-1][1] += 1
+        else:
+            self.completed_per_second.append([second, 1])
+            self.drop_old_seconds(second)
+
+    def drop_old_seconds(self, second):
+        while self.completed_per_second and self.completed_per_second[0][0] <= second - self.throughput_window:
+            self.completed_per_second.popleft()
+
+    def record_batch(self, size):
+        self.batches += 1
+        self.batched_requests += size
+
+    def report(self, queue_depth=0, pending_batches=0):
+        now = time.monotonic()
+        self.drop_old_seconds(int(now))
+        # the seconds kept are the current, partly elapsed one and the throughput_window - 1 before it
+        window = min(self.throughput_window - 1 + now - int(now), now - self.started)
+        recent = sum(count for _, count in self.completed_per_second)
+        return {
+            "uptime_s": now - self.started,
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "tokens": self.tokens,
+            "requests_per_s": recent / window if window > 0 else None,
+            "batches": self.batches,
+            "mean_batch_size": self.batched_requests / self.batches if self.batches else None,
+            "queue_depth": queue_depth,
+            "pending_batches": pending_batches,
+            "latency": latency_summary(self.latencies_ns),
+        }
+
+
+# one viterbi call per request in the event loop, the naive path the micro-batcher is compared with
+class DirectTagger:
+    def __init__(self, dense_hmm: DenseHMM):
+        self.dense_hmm = dense_hmm
+
+    async def submit(self, tokens):
+        return self.dense_hmm.viterbi(tokens)
+
+    def depth(self):
+        return 0, 0
+
+    async def close(self):
+        pass
+
+
+class MicroBatcher:
+    """
+    Collects the requests that arrive within max_delay of the first waiting one into a micro-batch (at most
+    max_batch_size sentences) and decodes it with one viterbi_batch call in a worker pool. While no batch is being
+    decoded the first request is sent at once, so a single client doesn't wait for max_delay. The request queue holds at
+    most queue_size sentences and at most max_pending_batches batches are in the pool, so a slow pool fills the queue
+    and submit raises asyncio.QueueFull instead of buffering without limit.
+    """
+
+    def __init__(self, executor, max_batch_size=64, max_delay=0.002, bucket_width=8, queue_size=1024,
+                 max_pending_batches=4, stats: ServiceStats = None):
+        """
+        :param executor: Process or thread pool whose workers were initialized with init_worker
+        :param max_batch_size: Most sentences per batch
+        :param max_delay: Seconds a batch waits for more requests after its first one
+        :param bucket_width: See DenseHMM.viterbi_batch, a micro-batch has few sentences of the same length, so
+            sentences of similar length are padded into one array pass
+        :param queue_size: Most sentences waiting for a batch
+        :param max_pending_batches: Most batches in the pool at the same time, two per worker keep every worker busy
+        :param stats: ServiceStats that counts the batches
+        """
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.bucket_width = bucket_width
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.max_pending_batches = max_pending_batches
+        self.slots = asyncio.Semaphore(max_pending_batches)
+        self.pending_batches = 0
+        self.stats = stats
+        self.task = None
+        # the event loop only keeps weak references to tasks
+        self.decode_tasks = set()
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def submit(self, tokens):
+        # the result of viterbi_batch for one sentence, raises asyncio.QueueFull if the queue is full
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((tokens, future))
+        return await future
+
+    def depth(self):
+        return self.queue.qsize(), self.pending_batches
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0 or self.pending_batches == 0:
+                    break
+                await asyncio.sleep(remaining)
+
+            # wait for a free slot in the pool, meanwhile new requests wait in the queue
+            await self.slots.acquire()
+            self.pending_batches += 1
+            task = loop.create_task(self.decode(batch))
+            self.decode_tasks.add(task)
+            task.add_done_callback(self.decode_tasks.discard)
+
+    async def decode(self, batch):
+        try:
+            if self.stats is not None:
+                self.stats.record_batch(len(batch))
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, tag_batch,
+                                                                       [tokens for tokens, _ in batch],
+                                                                       self.bucket_width)
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+        else:
+            for (_, future), result in zip(batch, results):
+                # the client may have disconnected
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.pending_batches -= 1
+            self.slots.release()
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class TaggingService:
+    """
+    Minimal HTTP/1.1 server (keep-alive, JSON bodies) in front of a tagger:
+        POST /tag     {"tokens": ["Der", "Hauptgang", ...]} -> {"tags": [...], "log_likelihood": ...}
+        GET  /stats   live counters, see ServiceStats.report
+        GET  /health  {"status": "ok"}
+    A full request queue is answered with 503.
+    """
+
+    def __init__(self, tagger, stats: ServiceStats):
+        self.tagger = tagger
+        self.stats = stats
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path = request_line.decode('latin-1').split()[:2]
+
+                headers = dict()
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self.route(method, path, body)
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" %
+                             (status, HTTP_REASONS[status], len(data)) + data)
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/stats":
+            return 200, self.stats.report(*self.tagger.depth())
+        if method != "POST" or path != "/tag":
+            return 404, {"error": "unknown endpoint %s %s" % (method, path)}
+
+        try:
+            tokens = json.loads(body)["tokens"]
+        except (ValueError, KeyError, TypeError):
+            return 400, {"error": 'expected a json body {"tokens": [...]}'}
+        if not isinstance(tokens, list) or not all(isinstance(token, str) for token in tokens):
+            return 400, {"error": "tokens must be a list of strings"}
+
+        start_time = time.perf_counter_ns()
+        try:
+            result = await self.tagger.submit(tokens)
+        except asyncio.QueueFull:
+            self.stats.rejected += 1
+            return 503, {"error": "request queue is full"}
+        except Exception as error:
+            self.stats.failed += 1
+            return 500, {"error": repr(error)}
+        self.stats.record_request(len(tokens), time.perf_counter_ns() - start_time)
+
+        # viterbi returns None for an empty sentence
+        if result is None:
+            return 200, {"tags": [], "log_likelihood": None}
+        log_likelihood, pos_list = result
+        return 200, {"tags": pos_list, "log_likelihood": float(log_likelihood)}
+
+
+def load_model(model_path, train_path=None, sentence_num=14000):
+    # train a CorpusHandler and write its model file if there is none yet, the service only maps the file
+    if not os.path.exists(model_path):
+        from corpus_handler import CorpusHandler
+        if train_path is None:
+            raise FileNotFoundError("no model file %s and no training corpus given" % model_path)
+        corpus_handler = CorpusHandler(train_path)
+        corpus_handler.train_on_corpus(sentence_num)
+        corpus_handler.save(model_path)
+
+    return DenseHMM.load(model_path)
+
+
+async def serve(model_path, host="127.0.0.1", port=8080, unix_path=None, naive=False, workers=2, pool="process",
+                max_batch_size=64, max_delay=0.002, bucket_width=8, queue_size=1024, max_pending_batches=None):
+    """
+    Run the tagging service until it is cancelled.
+    :param model_path: Model file written by CorpusHandler.save
+    :param host: Host of the TCP server, only used without unix_path
+    :param port: Port of the TCP server, only used without unix_path
+    :param unix_path: Serve on this Unix socket instead of TCP
+    :param naive: One viterbi call per request in the event loop instead of micro-batches in a worker pool
+    :param workers: Number of pool workers
+    :param pool: "process" (no GIL contention, the model file is mapped by every worker) or "thread"
+    :param max_batch_size: See MicroBatcher
+    :param max_delay: See MicroBatcher
+    :param bucket_width: See MicroBatcher
+    :param queue_size: See MicroBatcher
+    :param max_pending_batches: See MicroBatcher, two per worker by default
+    """
+    stats = ServiceStats()
+    if naive:
+        tagger = DirectTagger(DenseHMM.load(model_path))
+    else:
+        executor_class = ProcessPoolExecutor if pool == "process" else ThreadPoolExecutor
+        executor = executor_class(max_workers=workers, initializer=init_worker, initargs=(model_path,))
+        if max_pending_batches is None:
+            max_pending_batches = 2 * workers
+        tagger = MicroBatcher(executor, max_batch_size, max_delay, bucket_width, queue_size, max_pending_batches,
+                              stats)
+        tagger.start()
+
+    # SIGTERM stops the server like Ctrl+C, so the pool workers are shut down with it
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    service = TaggingService(tagger, stats)
+    if unix_path is not None:
+        server = await asyncio.start_unix_server(service.handle_connection, path=unix_path)
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+    print("serving on %s (%s)" % (unix_path or "http://%s:%d" % (host, port), "naive" if naive else
+                                  "micro-batches of %d, %.1f ms, %d %s workers" %
+                                  (max_batch_size, max_delay * 1000, workers, pool)), flush=True)
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await tagger.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="HMM tagging service with micro-batched viterbi decoding.")
+    parser.add_argument("--model", default="./de_gsd.hmm", help="model file written by CorpusHandler.save")
+    parser.add_argument("--train", help="CoNLL-U file to train on if the model file doesn't exist")
+    parser.add_argument("--sentences", type=int, default=14000, help="training sentences")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix", help="serve on this Unix socket path instead of TCP")
+    parser.add_argument("--naive", action="store_true", help="one viterbi call per request, no batching")
+    parser.add_argument("--workers", type=int, default=2, help="worker pool size")
+    parser.add_argument("--pool", choices=["process", "thread"], default="process")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-delay-ms", type=float, default=2.0, help="wait for more requests after the first")
+    parser.add_argument("--bucket-width", type=int, default=8, help="length bucket width of viterbi_batch")
+    parser.add_argument("--queue-size", type=int, default=1024, help="requests waiting before 503 is returned")
+    args = parser.parse_args()
+
+    load_model(args.model, args.train, args.sentences)
+    try:
+        asyncio.run(serve(args.model, args.host, args.port, args.unix, args.naive, args.workers, args.pool,
+                          args.max_batch_size, args.max_delay_ms / 1000, args.bucket_width, args.queue_size))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -1,10 +1,46 @@
+import math
+import numpy as np
+from profiler import PROFILER
+
+
+# emission probs of one observation for every state, the model tables are only read
+def observation_emission(init_prob: dict, emission_prob: dict, obs, oov_policy=None):
+    # check if the word exists
+    if any(obs in emission_prob[state] for state in init_prob):
+        return {state: emission_prob[state].get(obs, 0) for state in init_prob}
+
+    # if the word doesn't exist then ignore its emission prob, unless an oov policy estimates it
+    if oov_policy is None:
+        return {state: 1 for state in init_prob}
+
+    return oov_policy.emission(obs)
+
+
+# states of v kept in the beam: the beam_size best states and/or the states within beam_threshold (log prob) of the best
+def beam_states_dict(v: dict, beam_size=None, beam_threshold=None):
+    states = list(v)
+
+    best = max(v.values())
+    # if every prob underflowed to 0 all states tie, keep them all
+    if beam_threshold is not None and best > 0:
+        states = [state for state in states if v[state] >= best * math.exp(-beam_threshold)]
+    if beam_size is not None and len(states) > beam_size:
+        states = sorted(states, key=lambda state: (v[state], state), reverse=True)[:beam_size]
+
+    return states
+
+
 # viterbi algorithm
-def viterbi(init_prob: dict, transition_prob: dict, emission_prob: dict, input_sequence: list):
+def viterbi(init_prob: dict, transition_prob: dict, emission_prob: dict, input_sequence: list, oov_policy=None,
+            beam_size=None, beam_threshold=None):
     """
     :param init_prob: Dict of initial probabilities for each state (contains every state)
     :param transition_prob: Dict of transition probabilities between states
     :param emission_prob: Dict of emission probabilities for each state-observation pair
     :param input_sequence: List of observations
+    :param oov_policy: Optional policy from oov.py giving emission probs for unknown words
+    :param beam_size: Only expand the beam_size best states of each position, None for exhaustive search
+    :param beam_threshold: Only expand states whose log prob is at most this below the best one, None for no limit
     :return: The maximum likelihood and the best path sequence list
     """
 
@@ -16,70 +52,293 @@ def viterbi(init_prob: dict, transition_prob: dict, emission_prob: dict, input_s
     back_pointer_list = []
     v_list = []
 
-    # calculate init probs
-    v = dict()
+    # the emission probs are looked up without writing unseen words into emission_prob
+    with PROFILER.phase("lookup"):
+        emissions = [observation_emission(init_prob, emission_prob, obs, oov_policy) for obs in input_sequence]
 
-    # check if the word exists
-    occur_flag = False
-    for state in init_prob:
-        if input_sequence[0] not in emission_prob[state]:
-            v[state] = 0
-        else:
-            occur_flag = True
-            v[state] = init_prob[state] * emission_prob[state][input_sequence[0]]
-
-    # if the word doesn't exist then ignore its emission prob
-    if not occur_flag:
-        for state in v:
-            v[state] = init_prob[state]
+    # calculate init probs
+    emission = emissions[0]
+    v = {state: init_prob[state] * emission[state] for state in init_prob}
 
     # # store the first v
     v_list.append(v)
+    prune = beam_size is not None or beam_threshold is not None
 
     # iteratively calculate the other v of the sequence
-    for i in range(1, len(input_sequence)):
-        v = dict()
-        last_v = v_list[-1]
-        obs = input_sequence[i]
-        back_pointer = {}
-
-        # check word
-        occur_flag = False
-        for current_state in init_prob:
-            if obs not in emission_prob[current_state]:
-                emission_prob[current_state][obs] = 0
-            else:
-                occur_flag = True
-
-        # set emission_prob = 1 for all states if the word is unknown
-        if not occur_flag:
-            for current_state in init_prob:
-                emission_prob[current_state][obs] = 1
+    with PROFILER.phase("recursion"):
+        for i in range(1, len(input_sequence)):
+            v = dict()
+            last_v = v_list[-1]
+            back_pointer = {}
+            emission = emissions[i]
 
-        for current_state in init_prob:
-            v[current_state], back_pointer[current_state] = max(
-                (last_v[last_state] * transition_prob[last_state][current_state] *
-                 emission_prob[current_state][obs], last_state) for last_state in
-                init_prob)
+            # only the states in the beam are expanded
+            last_states = beam_states_dict(last_v, beam_size, beam_threshold) if prune else init_prob
 
-        # store current v and back pointer
-        v_list.append(v)
-        back_pointer_list.append(back_pointer)
+            for current_state in init_prob:
+                v[current_state], back_pointer[current_state] = max(
+                    (last_v[last_state] * transition_prob[last_state][current_state] *
+                     emission[current_state], last_state) for last_state in
+                    last_states)
 
-    # reconstruct the best path sequence
-    best_path = []
-    max_likelihood, last_state = max((v_list[-1][state], state) for state in init_prob)
-    best_path.append(last_state)
+            # store current v and back pointer
+            v_list.append(v)
+            back_pointer_list.append(back_pointer)
 
-    for i in range(len(input_sequence) - 2, -1, -1):
-        last_state = back_pointer_list[i][last_state]
+    # reconstruct the best path sequence
+    with PROFILER.phase("backtrace"):
+        best_path = []
+        max_likelihood, last_state = max((v_list[-1][state], state) for state in init_prob)
         best_path.append(last_state)
 
-    best_path.reverse()
+        for i in range(len(input_sequence) - 2, -1, -1):
+            last_state = back_pointer_list[i][last_state]
+            best_path.append(last_state)
+
+        best_path.reverse()
 
     return max_likelihood, best_path
 
 
+# log scores closer than this are ties, sums of logs don't reproduce exact ties of products
+LOG_TIE_TOLERANCE = 1e-9
+
+
+# vectorized viterbi algorithm in log space
+def viterbi_log(log_init, log_transition, log_emission, observation_ids):
+    """
+    :param log_init: Array (S,) of log initial probabilities for each state
+    :param log_transition: Array (S, S) of log transition probabilities, rows are the last state
+    :param log_emission: Array (S, V) of log emission probabilities, columns are the word ids
+    :param observation_ids: Sequence of word ids (column indexes of log_emission)
+    :return: The maximum log likelihood and the best path as a list of state ids
+    """
+
+    # check if the input sequence is empty
+    if len(observation_ids) < 1:
+        return None
+
+    return viterbi_log_scores(log_init, log_transition, log_emission[:, np.asarray(observation_ids)].T)
+
+
+# vectorized viterbi algorithm in log space on emission scores gathered per position
+def viterbi_log_scores(log_init, log_transition, emission_scores):
+    """
+    :param log_init: Array (S,) of log initial probabilities for each state
+    :param log_transition: Array (S, S) of log transition probabilities, rows are the last state
+    :param emission_scores: Array (T, S) of log emission probabilities of each observation for each state
+    :return: The maximum log likelihood and the best path as a list of state ids
+    """
+
+    sequence_length, state_num = emission_scores.shape
+
+    # back pointers for every position after the first one
+    back_pointers = np.empty((sequence_length - 1, state_num), dtype=np.intp)
+
+    # calculate init log probs
+    v = log_init + emission_scores[0]
+
+    # iteratively calculate the other v of the sequence
+    with PROFILER.phase("recursion"):
+        for i in range(1, sequence_length):
+            # scores[last_state, current_state] for every state pair at once
+            scores = v[:, None] + log_transition
+            # pick the first state among the (near) ties, like max() over (prob, state) tuples in viterbi
+            back_pointers[i - 1] = (scores >= scores.max(axis=0) - LOG_TIE_TOLERANCE).argmax(axis=0)
+            v = scores[back_pointers[i - 1], np.arange(state_num)] + emission_scores[i]
+
+    # reconstruct the best path sequence
+    with PROFILER.phase("backtrace"):
+        last_state = int((v >= v.max() - LOG_TIE_TOLERANCE).argmax())
+        max_log_likelihood = float(v[last_state])
+        best_path = [last_state]
+
+        for i in range(sequence_length - 2, -1, -1):
+            last_state = int(back_pointers[i][last_state])
+            best_path.append(last_state)
+
+        best_path.reverse()
+
+    return max_log_likelihood, best_path
+
+
+# vectorized viterbi algorithm in log space for a batch of padded sequences
+def viterbi_log_batch(log_init, log_transition, log_emission, observation_ids, lengths):
+    """
+    :param log_init: Array (S,) of log initial probabilities for each state
+    :param log_transition: Array (S, S) of log transition probabilities, rows are the last state
+    :param log_emission: Array (S, V) of log emission probabilities, columns are the word ids
+    :param observation_ids: Array (B, T) of word ids, positions after the length of a sequence are padding
+    :param lengths: Array (B,) of sequence lengths, every length has to be at least 1
+    :return: Array (B,) of maximum log likelihoods and the best paths as a list of state id lists
+    """
+
+    # emission_scores has shape (B, T, S)
+    emission_scores = log_emission.T[np.asarray(observation_ids)]
+
+    return viterbi_log_batch_scores(log_init, log_transition, emission_scores, lengths)
+
+
+# batched vectorized viterbi algorithm in log space on emission scores gathered per position
+def viterbi_log_batch_scores(log_init, log_transition, emission_scores, lengths):
+    """
+    :param log_init: Array (S,) of log initial probabilities for each state
+    :param log_transition: Array (S, S) of log transition probabilities, rows are the last state
+    :param emission_scores: Array (B, T, S) of log emission probabilities, positions after the length are padding
+    :param lengths: Array (B,) of sequence lengths, every length has to be at least 1
+    :return: Array (B,) of maximum log likelihoods and the best paths as a list of state id lists
+    """
+
+    lengths = np.asarray(lengths)
+    batch_size, max_length, state_num = emission_scores.shape
+    state_ids = np.arange(state_num)
+
+    # padded steps point back to the same state, so the backtrace passes through them unchanged
+    back_pointers = np.broadcast_to(state_ids, (max_length - 1, batch_size, state_num)).copy()
+
+    # calculate init log probs, v has shape (B, S)
+    v = log_init + emission_scores[:, 0]
+
+    with PROFILER.phase("recursion"):
+        for i in range(1, max_length):
+            # only sequences which are still running take this step
+            mask = i < lengths
+
+            # scores[b, last_state, current_state] for every sequence and state pair at once
+            scores = v[:, :, None] + log_transition
+            best = (scores >= scores.max(axis=1, keepdims=True) - LOG_TIE_TOLERANCE).argmax(axis=1)
+            new_v = np.take_along_axis(scores, best[:, None, :], axis=1)[:, 0, :] + emission_scores[:, i]
+
+            back_pointers[i - 1][mask] = best[mask]
+            v = np.where(mask[:, None], new_v, v)
+
+    # reconstruct the best path sequences backwards for the whole batch
+    with PROFILER.phase("backtrace"):
+        last_states = (v >= v.max(axis=1, keepdims=True) - LOG_TIE_TOLERANCE).argmax(axis=1)
+        max_log_likelihoods = v[np.arange(batch_size), last_states]
+
+        paths = np.empty((batch_size, max_length), dtype=np.intp)
+        paths[:, -1] = last_states
+        for i in range(max_length - 2, -1, -1):
+            paths[:, i] = back_pointers[i][np.arange(batch_size), paths[:, i + 1]]
+
+        # the padded tail only repeats the last state, cut it off
+        best_paths = [paths[b, :lengths[b]].tolist() for b in range(batch_size)]
+
+    return max_log_likelihoods, best_paths
+
+
+# states kept in the beam: the beam_size best states and/or the states within beam_threshold of the best one
+def beam_states(v, beam_size=None, beam_threshold=None):
+    candidates = np.flatnonzero(v > -np.inf)
+    # no path reaches any state, keep all so the result equals the exhaustive search
+    if len(candidates) == 0:
+        return np.arange(len(v))
+
+    if beam_threshold is not None:
+        candidates = candidates[v[candidates] >= v[candidates].max() - beam_threshold]
+    if beam_size is not None and len(candidates) > beam_size:
+        candidates = np.sort(candidates[np.argpartition(-v[candidates], beam_size - 1)[:beam_size]])
+
+    # candidates keep the state order, ties are broken by the first state like in the exhaustive search
+    return candidates
+
+
+# viterbi algorithm in log space which only expands the states in the beam at every position
+def viterbi_log_beam(log_init, log_transition, emission_scores, beam_size=None, beam_threshold=None):
+    """
+    :param log_init: Array (S,) of log initial probabilities for each state
+    :param log_transition: Array (S, S) of log transition probabilities, rows are the last state
+    :param emission_scores: Array (T, S) of log emission probabilities of each observation for each state
+    :param beam_size: Number of states kept per position, None for no limit
+    :param beam_threshold: Keep only states whose log score is at most this below the best one, None for no limit
+    :return: The maximum log likelihood and the best path as a list of state ids (the best path within the beam)
+    """
+
+    sequence_length, state_num = emission_scores.shape
+    back_pointers = np.empty((sequence_length - 1, state_num), dtype=np.intp)
+
+    v = log_init + emission_scores[0]
+    active = beam_states(v, beam_size, beam_threshold)
+
+    with PROFILER.phase("recursion"):
+        for i in range(1, sequence_length):
+            # only the rows of the states in the beam, scores has shape (beam, S)
+            scores = v[active][:, None] + log_transition[active]
+            best = (scores >= scores.max(axis=0) - LOG_TIE_TOLERANCE).argmax(axis=0)
+            back_pointers[i - 1] = active[best]
+            v = scores[best, np.arange(state_num)] + emission_scores[i]
+            active = beam_states(v, beam_size, beam_threshold)
+
+    with PROFILER.phase("backtrace"):
+        last_state = int(active[(v[active] >= v[active].max() - LOG_TIE_TOLERANCE).argmax()])
+        max_log_likelihood = float(v[last_state])
+        best_path = [last_state]
+
+        for i in range(sequence_length - 2, -1, -1):
+            last_state = int(back_pointers[i][last_state])
+            best_path.append(last_state)
+
+        best_path.reverse()
+
+    return max_log_likelihood, best_path
+
+
+# n-best viterbi in log space, every state keeps its n best partial paths in one lattice pass
+def viterbi_log_nbest(log_init, log_transition, emission_scores, n):
+    """
+    :param log_init: Array (S,) of log initial probabilities for each state
+    :param log_transition: Array (S, S) of log transition probabilities, rows are the last state
+    :param emission_scores: Array (T, S) of log emission probabilities of each observation for each state
+    :param n: Number of paths
+    :return: List of at most n (log likelihood, path as a list of state ids), best first
+    """
+
+    sequence_length, state_num = emission_scores.shape
+
+    # v[state, rank] is the log score of the rank-th best path ending in state, -inf if there are fewer paths
+    v = np.full((state_num, n), -np.inf)
+    v[:, 0] = log_init + emission_scores[0]
+
+    # back pointers to (last state, rank of the path in the last state)
+    back_states = np.empty((sequence_length - 1, state_num, n), dtype=np.intp)
+    back_ranks = np.empty((sequence_length - 1, state_num, n), dtype=np.intp)
+
+    with PROFILER.phase("recursion"):
+        for i in range(1, sequence_length):
+            # candidates[last_state * n + rank, current_state]
+            candidates = (v[:, :, None] + log_transition[:, None, :]).reshape(state_num * n, state_num)
+
+            # the n best candidates for every current state, sorted best first
+            top = np.argpartition(-candidates, n - 1, axis=0)[:n]
+            top_scores = np.take_along_axis(candidates, top, axis=0)
+            order = np.argsort(-top_scores, axis=0, kind='stable')
+            top = np.take_along_axis(top, order, axis=0)
+            top_scores = np.take_along_axis(top_scores, order, axis=0)
+
+            v = top_scores.T + emission_scores[i][:, None]
+            back_states[i - 1] = (top // n).T
+            back_ranks[i - 1] = (top % n).T
+
+    with PROFILER.phase("backtrace"):
+        flat_scores = v.reshape(-1)
+        results = []
+        for index in np.argsort(-flat_scores, kind='stable')[:n]:
+            if flat_scores[index] == -np.inf:
+                break
+
+            state, rank = divmod(int(index), n)
+            path = [state]
+            for i in range(sequence_length - 2, -1, -1):
+                state, rank = int(back_states[i, state, rank]), int(back_ranks[i, state, rank])
+                path.append(state)
+
+            path.reverse()
+            results.append((float(flat_scores[index]), path))
+
+    return results
+
+
 if __name__ == "__main__":
     # test viterbi alg
     test_init_prob = {"H": 0.8, "C": 0.2}
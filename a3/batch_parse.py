@@ -0,0 +1,126 @@
+# parse a batch of sentences in worker processes that share one compiled grammar
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from nltk.tree import Tree
+from compiled_grammar import CKY_recognize_compiled
+from parse_forest import CKY_parse_forest
+from pcfg_cky import CKY_parse_viterbi
+
+
+# ImmutableTree can't be unpickled, the best tree is sent back to the parent as a Tree
+def viterbi_picklable(sentence, compiled):
+    log_prob, tree = CKY_parse_viterbi(sentence, compiled)
+    return log_prob, Tree.convert(tree) if tree is not None else None
+
+
+# what a worker computes for a sentence, by name so tasks stay small
+PARSE_MODES = {
+    "recognize": CKY_recognize_compiled,
+    "count": lambda sentence, compiled: CKY_parse_forest(sentence, compiled).count(),
+    "viterbi": viterbi_picklable,
+}
+
+# the grammar of a worker process, set once by init_worker instead of being pickled with every task
+# (with the fork start method the workers inherit it without any pickling)
+worker_compiled = None
+
+
+class ParseTimeout(Exception):
+    pass
+
+
+def init_worker(compiled):
+    global worker_compiled
+    worker_compiled = compiled
+
+
+def raise_timeout(signum, frame):
+    raise ParseTimeout()
+
+
+def parse_sentence(index, sentence, mode, timeout):
+    # the timer interrupts the parser between two numpy calls, the worker is free for the next sentence afterwards
+    time1 = time.perf_counter()
+    result = None
+    try:
+        # armed inside the try, so an alarm right after the arming is caught as well
+        if timeout is not None:
+            signal.signal(signal.SIGALRM, raise_timeout)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        result = PARSE_MODES[mode](sentence, worker_compiled)
+        if timeout is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    except ParseTimeout:
+        # also an alarm between the return of the parser and the disarming, its result is kept then
+        pass
+    finally:
+        # also when the parser raised something else, that exception fails the batch
+        if timeout is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+    return index, result, time.perf_counter() - time1
+
+
+def parse_batch(sentences, compiled, mode="recognize", max_workers=None, timeout=None):
+    """
+    Generator over the parse results of the sentences, in input order. The sentences are submitted longest first so
+    the long ones don't end up alone at the end, and every result is yielded as soon as all results before it are done.
+    :param sentences: List of word lists
+    :param compiled: CompiledGrammar (CompiledPCFG for mode "viterbi"), sent to every worker once
+    :param mode: Key of PARSE_MODES
+    :param max_workers: Number of worker processes, os.cpu_count() by default
+    :param timeout: Seconds per sentence (Unix only), None for no limit
+    :return: Yields (result, seconds) per sentence, result is None if the sentence timed out
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count()
+
+    order = sorted(range(len(sentences)), key=lambda index: len(sentences[index]), reverse=True)
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(compiled,)) as executor:
+        pending = {executor.submit(parse_sentence, index, sentences[index], mode, timeout) for index in order}
+        done_results = dict()
+        next_index = 0
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, result, seconds = future.result()
+                done_results[index] = (result, seconds)
+
+            # stream the results that are now complete from the front
+            while next_index in done_results:
+                yield done_results.pop(next_index)
+                next_index += 1
+
+
+if __name__ == "__main__":
+    import nltk
+    from compiled_grammar import CompiledGrammar
+
+    # define the path
+    GRAMMAR_PATH = "./atis/atis-grammar-cnf.cfg"
+    SENTENCES_PATH = "./atis/atis-test-sentences.txt"
+
+    grammar = nltk.data.load(GRAMMAR_PATH)  # load the grammar
+    raw_sentences = nltk.data.load(SENTENCES_PATH)  # load raw sentences
+    test_sentences = [sentence for sentence, _ in nltk.parse.util.extract_test_sentences(raw_sentences)]
+
+    compiled_grammar = CompiledGrammar(grammar)
+
+    time1 = time.time()
+    serial_counts = [CKY_parse_forest(sentence, compiled_grammar).count() for sentence in test_sentences]
+    print("serial %.3f s" % (time.time() - time1))
+
+    for workers in [1, 2, 4, 8]:
+        time1 = time.time()
+        results = list(parse_batch(test_sentences, compiled_grammar, "count", max_workers=workers, timeout=10.0))
+        timeouts = sum(result is None for result, _ in results)
+        assert [result for result, _ in results if result is not None] == \
+               [count for count, (result, _) in zip(serial_counts, results) if result is not None]
+        print("%d workers %.3f s, %d timeouts" % (workers, time.time() - time1, timeouts))
+
+    for sentence, (count, seconds) in zip(test_sentences, results):
+        print(sentence, '\t', count, '\t%.3f s' % seconds)
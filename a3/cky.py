@@ -0,0 +1,167 @@
+# CKY recognizer and parser used by CKY_parsing.ipynb, the scripts and the benchmarks
+import nltk
+from nltk.tree import ImmutableTree
+
+
+def CKY_recognize(sentence, grammar: nltk.grammar.CFG):
+    # initialize the chart
+    n = len(sentence)
+    chart = [[set() for _ in range(n)] for _ in range(n)]
+
+    # fill in the diagonal of the chart
+    for i in range(n):
+        # get the production whose rhs is the word i
+        for production in grammar.productions(rhs=sentence[i]):
+            # add the lhs of the production to the cell
+            chart[i][i].add(production.lhs())
+
+    # main body of the CKY algorithm
+    # traverse the chart for each width b
+    for b in range(2, n + 1):
+        # for each start position i
+        for i in range(0, n - b + 1):
+            # for each left width k
+            for k in range(0, b - 1):
+                # for each non-terminal B and C
+                # if there is a production B -> C in the grammar
+                # add [B, C] to the cell
+                for B in chart[i][i + k]:
+                    for C in chart[i + k + 1][i + b - 1]:
+                        # nltk grammar productions only accept one item in the rhs
+                        for production in grammar.productions(rhs=B):
+                            if production.rhs() == (B, C):
+                                chart[i][i + b - 1].add(production.lhs())
+
+    # if the start symbol is in chart[0][n-1], the sentence can be parsed
+    if grammar.start() in chart[0][n - 1]:
+        return True
+
+    return False
+
+
+# Extra: Optimized running efficiency
+def CKY_recognize_optimized(sentence, grammar: nltk.grammar.CFG):
+    # initialize the chart
+    n = len(sentence)
+    chart = [[set() for _ in range(n)] for _ in range(n)]
+
+    # Use production cache: map RHS -> LHS
+    # Binary rules (e.g., A -> B C)
+    binary_rules = dict()
+
+    # add all binary rules to the cache
+    for production in grammar.productions():
+        if len(production.rhs()) == 2:
+            if production.rhs() not in binary_rules:
+                binary_rules[production.rhs()] = []
+                binary_rules[production.rhs()].append(production.lhs())
+            else:
+                binary_rules[production.rhs()].append(production.lhs())
+
+    # fill in the diagonal of the chart
+    for i in range(n):
+        # get the production whose rhs is the word i
+        for production in grammar.productions(rhs=sentence[i]):
+            # add the lhs of the production to the cell
+            chart[i][i].add(production.lhs())
+
+    # main body of the CKY algorithm
+    # traverse the chart for each width b
+    for b in range(2, n + 1):
+        # for each start position i
+        for i in range(0, n - b + 1):
+            # for each left width k
+            for k in range(0, b - 1):
+                # for each non-terminal B and C
+                # if there is a production B -> C in the grammar
+                # add [B, C] to the cell
+                for B in chart[i][i + k]:
+                    for C in chart[i + k + 1][i + b - 1]:
+                        # look up the cache for the lhs
+                        for lhs in binary_rules.get((B, C), []):
+                            chart[i][i + b - 1].add(lhs)
+
+    # if the start symbol is in chart[0][n-1], the sentence can be parsed
+    if grammar.start() in chart[0][n - 1]:
+        return True
+
+    return False
+
+
+# CKY parser
+def CKY_parse(sentence, grammar: nltk.grammar.CFG):
+    n = len(sentence)
+    chart = [[set() for _ in range(n)] for _ in range(n)]
+    # use dicts as back pointers
+    back_pointers = [[{} for _ in range(n)] for _ in range(n)]
+
+    binary_rules = dict()
+
+    for production in grammar.productions():
+        if len(production.rhs()) == 2:
+            if production.rhs() not in binary_rules:
+                binary_rules[production.rhs()] = []
+                binary_rules[production.rhs()].append(production.lhs())
+            else:
+                binary_rules[production.rhs()].append(production.lhs())
+
+    for i in range(n):
+        for production in grammar.productions(rhs=sentence[i]):
+            chart[i][i].add(production.lhs())
+            back_pointers[i][i][production.lhs()] = [sentence[i]]
+
+    # main body of the CKY algorithm
+    for b in range(2, n + 1):
+        for i in range(0, n - b + 1):
+            for k in range(0, b - 1):
+                for B in chart[i][i + k]:
+                    for C in chart[i + k + 1][i + b - 1]:
+                        for lhs in binary_rules.get((B, C), []):
+                            chart[i][i + b - 1].add(lhs)
+
+                            # add back pointers
+                            if lhs not in back_pointers[i][i + b - 1]:
+                                back_pointers[i][i + b - 1][lhs] = []
+                            back_pointers[i][i + b - 1][lhs].append((B, C, i + k))
+
+    # return back pointers
+    if grammar.start() in chart[0][n - 1]:
+        return True, back_pointers
+
+    return False, None
+
+
+# extract the trees from the back pointers
+def extract_trees(back_pointers, i, j, start_symbol):
+    if i == j:
+        return {ImmutableTree(start_symbol, [back_pointers[i][j][start_symbol][0]])}
+
+    trees = set()
+
+    for B, C, k in back_pointers[i][j][start_symbol]:
+        left_trees = extract_trees(back_pointers, i, k, B)
+        right_trees = extract_trees(back_pointers, k + 1, j, C)
+
+        # combine the left and right subtrees
+        for left in left_trees:
+            for right in right_trees:
+                trees.add(ImmutableTree(start_symbol, [left, right]))
+
+    return trees
+
+
+# Extra: Figure out how to compute the number of parse trees with backpointers
+def count_trees(back_pointers, i, j, start_symbol):
+    if i == j:
+        return 1
+
+    count = 0
+
+    for B, C, k in back_pointers[i][j][start_symbol]:
+        left_count = count_trees(back_pointers, i, k, B)
+        right_count = count_trees(back_pointers, k + 1, j, C)
+
+        # just multiply the left trees number and right trees number
+        count += left_count * right_count
+
+    return count
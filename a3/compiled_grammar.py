@@ -0,0 +1,179 @@
+# CNF grammar compiled once into integer arrays, and the CKY recognizer/parser over boolean array chart cells
+import nltk
+import numpy as np
+from nltk.grammar import Nonterminal
+
+
+class CompiledGrammar:
+    """
+    Integer index of a CNF grammar. Nonterminals get ids in order of appearance, the lexical index maps a word to the
+    ids of its preterminals, and the binary rules A -> B C are stored as arrays sorted by the left child B, the rules
+    with left child B are rule_*[left_offsets[B]:left_offsets[B + 1]]. rule_productions and lexical_productions hold
+    the nltk productions in the same order as the arrays.
+    """
+
+    def __init__(self, grammar: nltk.grammar.CFG):
+        self.grammar = grammar
+        self.nonterminals = []
+        self.nonterminal_to_id = dict()
+        self.start = self.nonterminal_id(grammar.start())
+
+        lexical = dict()
+        self.lexical_productions = dict()
+        binary = []
+        for production in grammar.productions():
+            lhs = self.nonterminal_id(production.lhs())
+            rhs = production.rhs()
+            if len(rhs) == 2 and all(isinstance(symbol, Nonterminal) for symbol in rhs):
+                binary.append((self.nonterminal_id(rhs[0]), self.nonterminal_id(rhs[1]), lhs, production))
+            elif len(rhs) > 0 and not isinstance(rhs[0], Nonterminal):
+                # the same productions as grammar.productions(rhs=word) in CKY_parse
+                lexical.setdefault(rhs[0], []).append(lhs)
+                self.lexical_productions.setdefault(rhs[0], []).append(production)
+
+        self.lexical = {word: np.array(lhs_ids, dtype=np.int32) for word, lhs_ids in lexical.items()}
+
+        # rules sorted by left child, stable so rules keep their grammar order within a left child
+        binary.sort(key=lambda rule: rule[0])
+        self.rule_productions = [rule[3] for rule in binary]
+        rules = np.array([rule[:3] for rule in binary], dtype=np.int32).reshape(-1, 3)
+        self.rule_left, self.rule_right, self.rule_lhs = rules[:, 0].copy(), rules[:, 1].copy(), rules[:, 2].copy()
+        self.left_offsets = np.searchsorted(self.rule_left, np.arange(len(self.nonterminals) + 1)).astype(np.int64)
+
+    def nonterminal_id(self, nonterminal):
+        if nonterminal not in self.nonterminal_to_id:
+            self.nonterminal_to_id[nonterminal] = len(self.nonterminals)
+            self.nonterminals.append(nonterminal)
+        return self.nonterminal_to_id[nonterminal]
+
+    def __len__(self):
+        return len(self.nonterminals)
+
+    def lexical_cell(self, word):
+        cell = np.zeros(len(self.nonterminals), dtype=bool)
+        cell[self.lexical.get(word, [])] = True
+        return cell
+
+    def combine(self, left_cells, right_cells):
+        """
+        Apply the binary rules to all split points of a span at once.
+        :param left_cells: Boolean array (splits, nonterminals), the cell left of each split point
+        :param right_cells: Boolean array (splits, nonterminals), the cell right of each split point
+        :return: Arrays of the split index and the rule index of every rule A -> B C with B in the left cell and C in
+            the right cell of the split
+        """
+        splits, lefts = np.nonzero(left_cells)
+        starts = self.left_offsets[lefts]
+        lengths = self.left_offsets[lefts + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        # the rule ranges of all (split, B) pairs laid out one after the other
+        owner = np.repeat(np.arange(len(lefts)), lengths)
+        rules = starts[owner] + np.arange(total) - (np.cumsum(lengths) - lengths)[owner]
+        splits = splits[owner]
+
+        active = right_cells[splits, self.rule_right[rules]]
+        return splits[active], rules[active]
+
+
+def fill_chart(sentence, compiled: CompiledGrammar, on_span=None):
+    # boolean chart (n, n, nonterminals), chart[i, j] is the cell of the words i..j
+    n = len(sentence)
+    chart = np.zeros((n, n, len(compiled)), dtype=bool)
+
+    for i in range(n):
+        chart[i, i] = compiled.lexical_cell(sentence[i])
+
+    for b in range(2, n + 1):
+        for i in range(0, n - b + 1):
+            j = i + b - 1
+            # left cells chart[i, i..j-1] and right cells chart[i+1..j, j] of the splits k = i..j-1
+            splits, rules = compiled.combine(chart[i, i:j], chart[i + 1:j + 1, j])
+            chart[i, j, compiled.rule_lhs[rules]] = True
+            if on_span is not None:
+                on_span(i, j, splits, rules)
+
+    return chart
+
+
+def CKY_recognize_compiled(sentence, compiled: CompiledGrammar):
+    if len(sentence) == 0:
+        return False
+    # a word without preterminal can't be covered by any tree
+    if any(word not in compiled.lexical for word in sentence):
+        return False
+
+    return bool(fill_chart(sentence, compiled)[0, len(sentence) - 1, compiled.start])
+
+
+# same result as CKY_parse, the back pointers work with extract_trees and count_trees
+def CKY_parse_compiled(sentence, compiled: CompiledGrammar):
+    n = len(sentence)
+    if n == 0 or any(word not in compiled.lexical for word in sentence):
+        return False, None
+
+    nonterminals = compiled.nonterminals
+    back_pointers = [[{} for _ in range(n)] for _ in range(n)]
+
+    for i in range(n):
+        for lhs in compiled.lexical[sentence[i]].tolist():
+            back_pointers[i][i][nonterminals[lhs]] = [sentence[i]]
+
+    def add_back_pointers(i, j, splits, rules):
+        cell = back_pointers[i][j]
+        for k, lhs, left, right in zip(splits.tolist(), compiled.rule_lhs[rules].tolist(),
+                                       compiled.rule_left[rules].tolist(), compiled.rule_right[rules].tolist()):
+            cell.setdefault(nonterminals[lhs], []).append((nonterminals[left], nonterminals[right], i + k))
+
+    chart = fill_chart(sentence, compiled, add_back_pointers)
+
+    if chart[0, n - 1, compiled.start]:
+        return True, back_pointers
+
+    return False, None
+
+
+if __name__ == "__main__":
+    import time
+    from cky import CKY_recognize_optimized, count_trees
+
+    # define the path
+    GRAMMAR_PATH = "./atis/atis-grammar-cnf.cfg"
+    SENTENCES_PATH = "./atis/atis-test-sentences.txt"
+
+    grammar = nltk.data.load(GRAMMAR_PATH)  # load the grammar
+    raw_sentences = nltk.data.load(SENTENCES_PATH)  # load raw sentences
+    test_sentences = nltk.parse.util.extract_test_sentences(raw_sentences)  # extract test sentences
+
+    time1 = time.time()
+    compiled_grammar = CompiledGrammar(grammar)
+    print("compiled %d nonterminals, %d binary rules, %d words in %.3f s" %
+          (len(compiled_grammar), len(compiled_grammar.rule_lhs), len(compiled_grammar.lexical), time.time() - time1))
+
+    time1 = time.time()
+    expected = [CKY_recognize_optimized(sentence[0], grammar) for sentence in test_sentences]
+    time2 = time.time()
+    recognized = [CKY_recognize_compiled(sentence[0], compiled_grammar) for sentence in test_sentences]
+    time3 = time.time()
+    assert recognized == expected
+    print("CKY_recognize_optimized %.3f s, CKY_recognize_compiled %.3f s" % (time2 - time1, time3 - time2))
+
+    # compare the number of trees with the nltk parser
+    parser = nltk.parse.BottomUpChartParser(grammar)
+    for sentence in test_sentences:
+        success, back_pointers = CKY_parse_compiled(sentence[0], compiled_grammar)
+        try:
+            tree_num = len(list(parser.parse(sentence[0])))
+        except Exception:
+            tree_num = 0
+
+        tree_count = count_trees(back_pointers, 0, len(sentence[0]) - 1, grammar.start()) if success else 0
+        if tree_count != tree_num:
+            print("Error: ", sentence[0], tree_count, tree_num)
+            exit()
+
+        print(sentence[0], '\t', tree_count)
+
+    print("All tests passed!")
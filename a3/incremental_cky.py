@@ -0,0 +1,120 @@
+# left-to-right CKY that fills the chart one column per word and reuses the columns of cached sentence prefixes
+import time
+from collections import OrderedDict
+import numpy as np
+from compiled_grammar import CompiledGrammar
+
+
+def fill_column(chart, sentence, j, compiled: CompiledGrammar):
+    # column j holds the cells chart[i, j] of all spans ending at word j, it only needs the columns before it
+    chart[j, j] = compiled.lexical_cell(sentence[j])
+    for i in range(j - 1, -1, -1):
+        splits, rules = compiled.combine(chart[i, i:j], chart[i + 1:j + 1, j])
+        chart[i, j, compiled.rule_lhs[rules]] = True
+
+
+class IncrementalCKY:
+    """
+    CKY recognizer with an LRU cache of chart columns keyed on token prefixes. A sentence starts from the columns of its
+    longest cached prefix and only computes the columns after it; the prefixes it computes are added to the cache.
+    The cache holds at most cache_size prefixes, the column arrays are shared between the prefixes of a sentence.
+    """
+
+    def __init__(self, compiled: CompiledGrammar, cache_size=10000):
+        self.compiled = compiled
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.sentences = 0
+        self.hits = 0
+        self.columns_reused = 0
+        self.columns_computed = 0
+        self.time_saved = 0.0
+
+    def chart(self, sentence):
+        # boolean chart (n, n, nonterminals) of the sentence, see fill_chart
+        n = len(sentence)
+        chart = np.zeros((n, n, len(self.compiled)), dtype=bool)
+        self.sentences += 1
+
+        # longest cached prefix
+        start = 0
+        columns = []
+        seconds = 0.0
+        for m in range(n, 0, -1):
+            entry = self.cache.get(tuple(sentence[:m]))
+            if entry is not None:
+                self.cache.move_to_end(tuple(sentence[:m]))
+                columns, seconds = list(entry[0]), entry[1]
+                for j, column in enumerate(columns):
+                    chart[:j + 1, j] = column
+                start = m
+                self.hits += 1
+                self.columns_reused += m
+                # the time the cached columns took when they were computed
+                self.time_saved += seconds
+                break
+
+        for j in range(start, n):
+            time1 = time.perf_counter()
+            fill_column(chart, sentence, j, self.compiled)
+            seconds += time.perf_counter() - time1
+            self.columns_computed += 1
+
+            # the column never changes again, cache it with every new prefix
+            columns.append(chart[:j + 1, j].copy())
+            self.cache[tuple(sentence[:j + 1])] = (tuple(columns), seconds)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return chart
+
+    def recognize(self, sentence):
+        if len(sentence) == 0:
+            return False
+        return bool(self.chart(sentence)[0, len(sentence) - 1, self.compiled.start])
+
+    def report(self):
+        return {
+            "sentences": self.sentences,
+            "hit_rate": self.hits / self.sentences if self.sentences else None,
+            "column_reuse_rate": self.columns_reused / max(self.columns_reused + self.columns_computed, 1),
+            "time_saved_s": self.time_saved,
+            "cached_prefixes": len(self.cache),
+        }
+
+
+if __name__ == "__main__":
+    import nltk
+    from compiled_grammar import CKY_recognize_compiled
+
+    # define the path
+    GRAMMAR_PATH = "./atis/atis-grammar-cnf.cfg"
+    SENTENCES_PATH = "./atis/atis-test-sentences.txt"
+
+    grammar = nltk.data.load(GRAMMAR_PATH)  # load the grammar
+    raw_sentences = nltk.data.load(SENTENCES_PATH)  # load raw sentences
+    test_sentences = [sentence for sentence, _ in nltk.parse.util.extract_test_sentences(raw_sentences)]
+
+    compiled_grammar = CompiledGrammar(grammar)
+
+    time1 = time.time()
+    expected = [CKY_recognize_compiled(sentence, compiled_grammar) for sentence in test_sentences]
+    time2 = time.time()
+
+    incremental = IncrementalCKY(compiled_grammar)
+    recognized = [incremental.recognize(sentence) for sentence in test_sentences]
+    time3 = time.time()
+    assert recognized == expected
+
+    print("CKY_recognize_compiled %.3f s, IncrementalCKY %.3f s" % (time2 - time1, time3 - time2))
+    print(incremental.report())
+
+    # the test set a second time, every sentence is a full hit
+    incremental.reset_counters()
+    time1 = time.time()
+    for sentence in test_sentences:
+        incremental.recognize(sentence)
+    print("second pass %.3f s" % (time.time() - time1), incremental.report())
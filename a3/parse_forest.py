@@ -0,0 +1,138 @@
+# shared packed parse forest of a CKY chart, trees are counted with memoization and built one at a time on demand
+from bisect import bisect_right
+from nltk.tree import ImmutableTree
+from compiled_grammar import CompiledGrammar, fill_chart
+
+
+class ParseForest:
+    """
+    All parse trees of a sentence, packed: every item (i, j, A) (nonterminal A over the words i..j) is stored once
+    with its list of alternatives (k, B, C), i.e. A -> B C with B over i..k and C over k+1..j, and shared by all trees
+    that contain it. Tree counts are memoized per item, nth_tree(index) builds one tree by walking down the items with
+    the counts, so enumerating the trees needs memory for one tree only.
+    """
+
+    def __init__(self, sentence, compiled: CompiledGrammar, alternatives):
+        """
+        :param sentence: List of words
+        :param compiled: The CompiledGrammar the forest was parsed with
+        :param alternatives: Dict (i, j) -> dict nonterminal id -> list of (k, B id, C id) for the spans of width > 1
+        """
+        self.sentence = sentence
+        self.compiled = compiled
+        self.alternatives = alternatives
+        self.root = (0, len(sentence) - 1, compiled.start)
+        self.counts = dict()
+        self.cumulative_counts = dict()
+
+    def __contains__(self, item):
+        i, j, nonterminal = item
+        if i == j:
+            return nonterminal in self.compiled.lexical.get(self.sentence[i], ())
+        return nonterminal in self.alternatives.get((i, j), ())
+
+    def success(self):
+        return len(self.sentence) > 0 and self.root in self
+
+    def count(self, item=None):
+        """
+        Number of trees of an item, the whole sentence by default. Every item is counted once.
+        """
+        item = self.root if item is None else item
+        if item not in self:
+            return 0
+        return self._count(*item)
+
+    def _count(self, i, j, nonterminal):
+        if i == j:
+            return 1
+        count = self.counts.get((i, j, nonterminal))
+        if count is None:
+            # running sums over the alternatives, nth_tree finds the alternative of an index by bisection
+            cumulative = []
+            count = 0
+            for k, left, right in self.alternatives[(i, j)][nonterminal]:
+                count += self._count(i, k, left) * self._count(k + 1, j, right)
+                cumulative.append(count)
+            self.counts[(i, j, nonterminal)] = count
+            self.cumulative_counts[(i, j, nonterminal)] = cumulative
+        return count
+
+    def nth_tree(self, index, item=None):
+        """
+        Tree number index (0 <= index < count(item)) of an item, the order is the same as in trees().
+        """
+        item = self.root if item is None else item
+        if not 0 <= index < self.count(item):
+            raise IndexError("tree index %d out of range" % index)
+        return self._tree(*item, index)
+
+    def _tree(self, i, j, nonterminal, index):
+        label = self.compiled.nonterminals[nonterminal]
+        if i == j:
+            return ImmutableTree(label, [self.sentence[i]])
+
+        cumulative = self.cumulative_counts[(i, j, nonterminal)]
+        alternative = bisect_right(cumulative, index)
+        if alternative > 0:
+            index -= cumulative[alternative - 1]
+
+        # index = left index * right count + right index
+        k, left, right = self.alternatives[(i, j)][nonterminal][alternative]
+        left_index, right_index = divmod(index, self._count(k + 1, j, right))
+        return ImmutableTree(label, [self._tree(i, k, left, left_index), self._tree(k + 1, j, right, right_index)])
+
+    def trees(self, item=None):
+        # lazy generator over all trees of an item
+        item = self.root if item is None else item
+        for index in range(self.count(item)):
+            yield self._tree(*item, index)
+
+
+# CKY parser returning a ParseForest, forest.success() is the result of CKY_recognize_compiled
+def CKY_parse_forest(sentence, compiled: CompiledGrammar):
+    alternatives = dict()
+
+    def add_alternatives(i, j, splits, rules):
+        cell = alternatives[(i, j)] = dict()
+        for k, lhs, left, right in zip(splits.tolist(), compiled.rule_lhs[rules].tolist(),
+                                       compiled.rule_left[rules].tolist(), compiled.rule_right[rules].tolist()):
+            cell.setdefault(lhs, []).append((i + k, left, right))
+
+    # a word without preterminal can't be covered by any tree
+    if all(word in compiled.lexical for word in sentence):
+        fill_chart(sentence, compiled, add_alternatives)
+
+    return ParseForest(sentence, compiled, alternatives)
+
+
+if __name__ == "__main__":
+    import time
+    import nltk
+
+    # define the path
+    GRAMMAR_PATH = "./atis/atis-grammar-cnf.cfg"
+    SENTENCES_PATH = "./atis/atis-test-sentences.txt"
+
+    grammar = nltk.data.load(GRAMMAR_PATH)  # load the grammar
+    raw_sentences = nltk.data.load(SENTENCES_PATH)  # load raw sentences
+    test_sentences = nltk.parse.util.extract_test_sentences(raw_sentences)  # extract test sentences
+
+    compiled_grammar = CompiledGrammar(grammar)
+
+    # count the trees of every test sentence and enumerate them lazily
+    time1 = time.time()
+    for sentence in test_sentences:
+        forest = CKY_parse_forest(sentence[0], compiled_grammar)
+        tree_num = forest.count()
+        print(sentence[0], '\t', tree_num)
+        if tree_num < 10000:
+            assert sum(1 for _ in forest.trees()) == tree_num
+
+    print("counted and enumerated all trees in %.3f s" % (time.time() - time1))
+
+    # the last tree of the most ambiguous sentence without building the others
+    forest = max((CKY_parse_forest(sentence[0], compiled_grammar) for sentence in test_sentences),
+                 key=lambda forest: forest.count())
+    print(forest.count(), "trees for", forest.sentence)
+    forest.nth_tree(forest.count() - 1).pretty_print()
@@ -0,0 +1,183 @@
+# probabilistic CKY: the best parse of a PCFG (Viterbi), with optional beam/threshold pruning of the chart cells
+from collections import Counter
+import nltk
+import numpy as np
+from nltk.grammar import Nonterminal, Production
+from nltk.tree import ImmutableTree
+from compiled_grammar import CompiledGrammar
+
+
+class CompiledPCFG(CompiledGrammar):
+    """
+    CompiledGrammar with the log probabilities of the binary rules (rule_logprob, in rule order) and of the lexical
+    rules (lexical_logprob, aligned with lexical).
+    The probabilities are the ones of an nltk PCFG, else rule_prob[production], else uniform over the productions of
+    each lhs. from_treebank estimates them from parsed trees.
+    """
+
+    def __init__(self, grammar: nltk.grammar.CFG, rule_prob=None):
+        super().__init__(grammar)
+
+        lhs_counts = Counter(production.lhs() for production in grammar.productions())
+
+        def prob(production):
+            if isinstance(production, nltk.grammar.ProbabilisticProduction):
+                return production.prob()
+            if rule_prob is not None:
+                return rule_prob.get(production, 0.0)
+            return 1 / lhs_counts[production.lhs()]
+
+        # log(0) = -inf, a rule with probability 0 is never used
+        with np.errstate(divide='ignore'):
+            self.rule_logprob = np.log(np.array([prob(production) for production in self.rule_productions],
+                                                dtype=np.float64))
+            self.lexical_logprob = {word: np.log(np.array([prob(production) for production in productions],
+                                                          dtype=np.float64))
+                                    for word, productions in self.lexical_productions.items()}
+
+    @classmethod
+    def from_treebank(cls, grammar: nltk.grammar.CFG, trees, smoothing=1.0):
+        """
+        Relative frequencies of the productions of the grammar in the trees, with add-smoothing so the rules that are
+        missing in the treebank keep a small probability.
+        :param grammar: The CNF grammar, only its productions get probabilities
+        :param trees: Iterable of nltk trees
+        :param smoothing: Count added to every production
+        """
+        counts = Counter(production for tree in trees for production in tree_productions(tree))
+
+        lhs_totals = Counter()
+        for production in grammar.productions():
+            lhs_totals[production.lhs()] += counts[production] + smoothing
+
+        rule_prob = {production: (counts[production] + smoothing) / lhs_totals[production.lhs()]
+                     for production in grammar.productions()}
+        return cls(grammar, rule_prob)
+
+
+# productions of a tree whose labels are strings (treebank) or Nonterminals (the trees of the CKY parsers)
+def tree_productions(tree):
+    def symbol(node):
+        if isinstance(node, nltk.Tree):
+            return node.label() if isinstance(node.label(), Nonterminal) else Nonterminal(node.label())
+        return node
+
+    for subtree in tree.subtrees():
+        yield Production(symbol(subtree), [symbol(child) for child in subtree])
+
+
+# keep only the beam_size best nonterminals of a cell and/or the ones within beam_threshold (log prob) of the best
+def prune_cell(cell, beam_size=None, beam_threshold=None):
+    if beam_threshold is not None:
+        cell[cell < cell.max() - beam_threshold] = -np.inf
+    if beam_size is not None and np.count_nonzero(cell > -np.inf) > beam_size:
+        cell[cell < np.partition(cell, -beam_size)[-beam_size]] = -np.inf
+
+
+def CKY_parse_viterbi(sentence, compiled: CompiledPCFG, beam_size=None, beam_threshold=None):
+    """
+    :param sentence: List of words
+    :param compiled: CompiledPCFG
+    :param beam_size: Keep at most beam_size nonterminals per span (ties are kept), None for no limit
+    :param beam_threshold: Drop the nonterminals whose log prob is more than this below the best one of their span,
+        None for no limit
+    :return: The log probability and the best tree, (-inf, None) if there is no parse (or the pruning removed all)
+    """
+    n = len(sentence)
+    if n == 0 or any(word not in compiled.lexical for word in sentence):
+        return -np.inf, None
+
+    # array-backed cells: best log prob, split point and rule of every (span, nonterminal)
+    scores = np.full((n, n, len(compiled)), -np.inf)
+    best_split = np.zeros((n, n, len(compiled)), dtype=np.int32)
+    best_rule = np.zeros((n, n, len(compiled)), dtype=np.int32)
+
+    for i in range(n):
+        np.maximum.at(scores[i, i], compiled.lexical[sentence[i]], compiled.lexical_logprob[sentence[i]])
+        prune_cell(scores[i, i], beam_size, beam_threshold)
+
+    for b in range(2, n + 1):
+        for i in range(0, n - b + 1):
+            j = i + b - 1
+            left_cells, right_cells = scores[i, i:j], scores[i + 1:j + 1, j]
+            splits, rules = compiled.combine(left_cells > -np.inf, right_cells > -np.inf)
+            if len(rules) == 0:
+                continue
+
+            candidates = (left_cells[splits, compiled.rule_left[rules]] + right_cells[splits, compiled.rule_right[rules]]
+                          + compiled.rule_logprob[rules])
+
+            # the best candidate of every lhs: the first one of its lhs in descending score order
+            order = np.argsort(-candidates, kind='stable')
+            lhs, first = np.unique(compiled.rule_lhs[rules][order], return_index=True)
+            winners = order[first]
+
+            scores[i, j, lhs] = candidates[winners]
+            best_split[i, j, lhs] = i + splits[winners]
+            best_rule[i, j, lhs] = rules[winners]
+            prune_cell(scores[i, j], beam_size, beam_threshold)
+
+    log_prob = scores[0, n - 1, compiled.start]
+    if log_prob == -np.inf:
+        return -np.inf, None
+
+    def build(i, j, nonterminal):
+        label = compiled.nonterminals[nonterminal]
+        if i == j:
+            return ImmutableTree(label, [sentence[i]])
+        k, rule = best_split[i, j, nonterminal], best_rule[i, j, nonterminal]
+        return ImmutableTree(label, [build(i, k, compiled.rule_left[rule]), build(k + 1, j, compiled.rule_right[rule])])
+
+    return float(log_prob), build(0, n - 1, compiled.start)
+
+
+# log probability of a tree under the compiled pcfg
+def tree_log_prob(tree, compiled: CompiledPCFG):
+    rule_logprob = dict(zip(compiled.rule_productions, compiled.rule_logprob.tolist()))
+    for word, productions in compiled.lexical_productions.items():
+        rule_logprob.update(zip(productions, compiled.lexical_logprob[word].tolist()))
+
+    return sum(rule_logprob[production] for production in tree_productions(tree))
+
+
+if __name__ == "__main__":
+    import time
+    from parse_forest import CKY_parse_forest
+
+    # define the path
+    GRAMMAR_PATH = "./atis/atis-grammar-cnf.cfg"
+    SENTENCES_PATH = "./atis/atis-test-sentences.txt"
+
+    grammar = nltk.data.load(GRAMMAR_PATH)  # load the grammar
+    raw_sentences = nltk.data.load(SENTENCES_PATH)  # load raw sentences
+    test_sentences = nltk.parse.util.extract_test_sentences(raw_sentences)  # extract test sentences
+
+    # no ATIS treebank is bundled, so the rules are uniform per lhs; CompiledPCFG.from_treebank takes a treebank
+    compiled_pcfg = CompiledPCFG(grammar)
+
+    # parse time against sentence length: exhaustive forest (all trees counted) vs viterbi with and without beam
+    decoders = {
+        "exhaustive": lambda sentence: CKY_parse_forest(sentence, compiled_pcfg).count(),
+        "viterbi": lambda sentence: CKY_parse_viterbi(sentence, compiled_pcfg),
+        "viterbi k=10": lambda sentence: CKY_parse_viterbi(sentence, compiled_pcfg, beam_size=10),
+        "viterbi t=5": lambda sentence: CKY_parse_viterbi(sentence, compiled_pcfg, beam_threshold=5.0),
+    }
+    times_by_length = {name: dict() for name in decoders}
+    found = {name: 0 for name in decoders}
+    for sentence in test_sentences:
+        words = sentence[0]
+        exact_log_prob = CKY_parse_viterbi(words, compiled_pcfg)[0]
+        for name, decode in decoders.items():
+            time1 = time.time()
+            result = decode(words)
+            times_by_length[name].setdefault(len(words), []).append(time.time() - time1)
+            # a pruned parser finds the best parse if it reaches the exact log prob
+            found[name] += result > 0 if name == "exhaustive" else result[0] == exact_log_prob > -np.inf
+
+    print("length " + " ".join("%14s" % name for name in decoders))
+    for length in sorted(times_by_length["exhaustive"]):
+        print("%6d " % length + " ".join("%11.2f ms" % (1000 * np.mean(times_by_length[name][length]))
+                                         for name in decoders))
+    print("total  " + " ".join("%12.2f s" % sum(sum(times) for times in times_by_length[name].values())
+                               for name in decoders))
+    print("parsed " + " ".join("%14d" % found[name] for name in decoders), "(viterbi: best parse found)")
@@ -0,0 +1,193 @@
+# batches of similar length padded to their own longest example, for the tagger and parser data loaders
+import random
+import numpy as np
+import torch
+
+# padding value of the per-token columns, the label columns use the ignore index of the loss
+TOKEN_PAD_VALUES = {
+    "attention_mask": 0,
+    "labels": -100,
+    "head": -100,
+    "deprel_ids": -100,
+    "hidden_states": 0.0,
+}
+
+# padding value of the per-word columns
+WORD_PAD_VALUES = {
+    "tokens_representing_words": -1,
+}
+
+
+def example_lengths(dataset):
+    # number of tokens inside the attention mask of every example
+    return np.array([int(sum(mask)) for mask in dataset["attention_mask"]], dtype=np.int64)
+
+
+class LengthBucketSampler(torch.utils.data.Sampler):
+    """
+    Batch sampler that puts examples of similar length into the same batch. With shuffle the examples are shuffled,
+    cut into buckets of bucket_batches batches, sorted by length inside each bucket and the batches are shuffled, so
+    the order still changes every epoch. Without shuffle the examples are sorted by length (for evaluation).
+    """
+
+    def __init__(self, lengths, batch_size=32, shuffle=True, bucket_batches=100, drop_last=False, seed=0):
+        """
+        :param lengths: Length of every example, see example_lengths
+        :param batch_size: Examples per batch
+        :param shuffle: Shuffle the examples and batches every epoch
+        :param bucket_batches: Number of batches sorted together, larger buckets waste less padding and shuffle less
+        :param drop_last: Drop the last batch of a bucket if it is smaller than batch_size
+        :param seed: Seed of the shuffling, the epoch number is added so every epoch is different
+        """
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_batches = bucket_batches
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def batches(self):
+        indices = list(range(len(self.lengths)))
+        if not self.shuffle:
+            buckets = [indices]
+        else:
+            generator = random.Random(self.seed + self.epoch)
+            generator.shuffle(indices)
+            bucket_size = self.batch_size * self.bucket_batches
+            buckets = [indices[start:start + bucket_size] for start in range(0, len(indices), bucket_size)]
+
+        batches = []
+        for bucket in buckets:
+            bucket.sort(key=lambda index: self.lengths[index])
+            for start in range(0, len(bucket), self.batch_size):
+                batch = bucket[start:start + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch)
+
+        if self.shuffle:
+            generator.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        batches = self.batches()
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self):
+        return len(self.batches())
+
+
+class DynamicPaddingCollator:
+    """
+    collate_fn that pads the examples of a batch to the longest one in the batch instead of a fixed length. The
+    examples may be unpadded or padded to any length: the per-token columns are cut or padded to the longest
+    attention mask of the batch (head values are token positions inside the mask, so they stay valid), the per-word
+    columns to the most words of the batch. The other columns are stacked as they are.
+    """
+
+    def __init__(self, pad_token_id=1, token_pad_values=None, word_pad_values=None):
+        """
+        :param pad_token_id: Padding id of input_ids, 1 for XLM-RoBERTa
+        :param token_pad_values: Dict column -> padding value of the per-token columns, TOKEN_PAD_VALUES by default
+        :param word_pad_values: Dict column -> padding value of the per-word columns, WORD_PAD_VALUES by default
+        """
+        self.token_pad_values = dict(TOKEN_PAD_VALUES if token_pad_values is None else token_pad_values,
+                                     input_ids=pad_token_id)
+        self.word_pad_values = WORD_PAD_VALUES if word_pad_values is None else word_pad_values
+
+    def __call__(self, examples):
+        columns = {column: [torch.as_tensor(example[column]) for example in examples] for column in examples[0]}
+        seq_len = max(int(mask.sum()) for mask in columns["attention_mask"])
+
+        batch = dict()
+        for column, values in columns.items():
+            if column in self.token_pad_values:
+                batch[column] = pad_stack(values, seq_len, self.token_pad_values[column])
+            elif column in self.word_pad_values:
+                pad_value = self.word_pad_values[column]
+                word_len = max(int((value != pad_value).sum()) for value in values)
+                batch[column] = pad_stack(values, word_len, pad_value)
+            else:
+                batch[column] = torch.stack(values)
+        return batch
+
+
+def pad_stack(values, length, pad_value):
+    # stack the tensors cut or padded to length along the first dimension
+    batch = torch.full((len(values), length) + tuple(values[0].shape[1:]), pad_value, dtype=values[0].dtype)
+    for row, value in enumerate(values):
+        batch[row, :min(length, len(value))] = value[:length]
+    return batch
+
+
+def padding_stats(lengths, batches, padded_length=None):
+    """
+    Real and padded token counts of an epoch.
+    :param lengths: Length of every example
+    :param batches: List of index lists
+    :param padded_length: Fixed length of every example (padding="max_length"), None for the longest of the batch
+    :return: (real tokens, padded tokens, padded cells of the (seq_len, seq_len) edge score matrices)
+    """
+    real = padded = score_cells = 0
+    for batch in batches:
+        seq_len = padded_length if padded_length is not None else int(lengths[batch].max())
+        real += int(lengths[batch].sum())
+        padded += len(batch) * seq_len
+        score_cells += len(batch) * seq_len * seq_len
+    return real, padded, score_cells
+
+
+if __name__ == "__main__":
+    import time
+    from feature_cache import tiny_encoder
+
+    # UD-like subword lengths (en_ewt train has 12543 sentences, most far below 200 subwords); no data is downloaded,
+    # the examples are random token ids padded to the longest one, like the a5 tokenization with padding=True
+    generator = np.random.default_rng(0)
+    lengths = np.clip(generator.lognormal(3.2, 0.6, size=2000).astype(np.int64) + 2, 3, 200)
+    max_length = int(lengths.max())
+    dataset = {
+        "input_ids": [[0] + generator.integers(5, 1000, size=length - 2).tolist() + [2] + [1] * (max_length - length)
+                      for length in lengths.tolist()],
+        "attention_mask": [[1] * length + [0] * (max_length - length) for length in lengths.tolist()],
+        "head": [[-100] + [0] * (length - 2) + [-100] * (max_length - length + 1) for length in lengths.tolist()],
+    }
+    examples = [{column: values[index] for column, values in dataset.items()} for index in range(len(lengths))]
+
+    in_order = [list(range(start, min(start + 32, len(lengths)))) for start in range(0, len(lengths), 32)]
+    pipelines = {
+        # a4: every sentence padded to max_length=200
+        "max_length 200": (in_order, 200),
+        # a5: the whole split padded to its longest sentence, dataset order
+        "longest of split": (in_order, max_length),
+        "longest of batch": (in_order, None),
+        "bucketed": (LengthBucketSampler(lengths, 32).batches(), None),
+    }
+
+    encoder = tiny_encoder(hidden_size=64)
+    encoder.eval()
+    edge_weights = torch.randn(64, 64)
+    collator = DynamicPaddingCollator()
+
+    print("%-18s %10s %10s %14s %12s" % ("pipeline", "waste", "cells", "real tokens/s", "epoch s"))
+    for name, (batches, padded_length) in pipelines.items():
+        real, padded, score_cells = padding_stats(lengths, batches, padded_length)
+
+        time1 = time.time()
+        with torch.no_grad():
+            for batch in batches:
+                if padded_length is None:
+                    data = collator([examples[index] for index in batch])
+                else:
+                    data = {column: torch.tensor([dataset[column][index] + [TOKEN_PAD_VALUES.get(column, 1)] *
+                                                  (padded_length - max_length) for index in batch])
+                            for column in dataset}
+                # encoder forward and the O(L^2) biaffine edge scores of the parser
+                hidden_states = encoder(input_ids=data["input_ids"], attention_mask=data["attention_mask"])
+                hidden_states = hidden_states.last_hidden_state
+                torch.einsum("bid,de,bje->bij", hidden_states, edge_weights, hidden_states)
+        seconds = time.time() - time1
+
+        print("%-18s %9.1f%% %10d %14.0f %12.2f" % (name, 100 * (1 - real / padded), score_cells, real / seconds,
+                                                     seconds))
@@ -0,0 +1,191 @@
+# run the frozen XLM-RoBERTa encoder once over a tokenized dataset and keep its last hidden states on disk
+import hashlib
+import json
+import os
+import numpy as np
+import torch
+from transformers import XLMRobertaConfig, XLMRobertaModel
+
+
+def cache_key(model_name, tokenizer_settings, input_ids, lengths):
+    """
+    The key covers everything the hidden states depend on: the encoder, the tokenizer settings and the token ids of
+    the examples (only the tokens inside the attention mask, padding doesn't change the hidden states of the others).
+    :param model_name: Name of the pretrained encoder, e.g. "xlm-roberta-base"
+    :param tokenizer_settings: Dict of the tokenizer name and arguments (max_length, truncation, ...)
+    :param input_ids: List of token id lists
+    :param lengths: Array of the number of tokens inside the attention mask of each example
+    """
+    digest = hashlib.sha1(json.dumps([model_name, tokenizer_settings], sort_keys=True, default=str).encode('utf-8'))
+    for ids, length in zip(input_ids, lengths.tolist()):
+        digest.update(np.asarray(ids[:length], dtype=np.int64).tobytes())
+        digest.update(b"|")
+    return digest.hexdigest()[:16]
+
+
+class HiddenStateCache:
+    """
+    last_hidden_state of every example of a dataset, the tokens of all examples stored one after the other in a
+    memory-mapped array (tokens, hidden_size): the states of example i are states[offsets[i]:offsets[i + 1]].
+    Only the tokens inside the attention mask are stored, the padding is added back when a batch is read.
+    """
+
+    def __init__(self, states, offsets):
+        self.states = states
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def hidden_size(self):
+        return self.states.shape[1]
+
+    def example(self, index, seq_len=None):
+        # float32 tensor (seq_len, hidden_size) of an example, zeros after its last token
+        start, end = self.offsets[index], self.offsets[index + 1]
+        hidden_states = torch.zeros(end - start if seq_len is None else seq_len, self.hidden_size)
+        hidden_states[:end - start] = torch.from_numpy(np.array(self.states[start:end], dtype=np.float32))
+        return hidden_states
+
+    @classmethod
+    def load(cls, encoder, dataset, model_name, tokenizer_settings, cache_dir="./.feature_cache", dtype=np.float16,
+             batch_size=32, device="cpu"):
+        """
+        Return the hidden states of a tokenized dataset, the encoder runs over the dataset on first access and the
+        states are memory-mapped afterwards.
+        :param encoder: XLMRobertaModel (any model returning last_hidden_state)
+        :param dataset: Dataset (or dict) with the columns input_ids and attention_mask, padded on the right
+        :param model_name: Name of the encoder weights, part of the cache key
+        :param tokenizer_settings: Dict of the tokenizer name and arguments, part of the cache key
+        :param cache_dir: Directory of the cache files
+        :param dtype: np.float16 halves the file size, np.float32 keeps the exact encoder output
+        :param batch_size: Batch size of the encoder pass
+        :param device: Device of the encoder pass
+        :return: HiddenStateCache
+        """
+        input_ids = dataset["input_ids"]
+        lengths = np.array([int(sum(mask)) for mask in dataset["attention_mask"]], dtype=np.int64)
+        key = cache_key(model_name, dict(tokenizer_settings, dtype=np.dtype(dtype).name), input_ids, lengths)
+        states_path = os.path.join(cache_dir, "%s.states.npy" % key)
+
+        if not os.path.exists(states_path):
+            os.makedirs(cache_dir, exist_ok=True)
+            # write to a temporary file first, so a parallel reader never maps a half written cache
+            temp_path = "%s.%d.tmp" % (states_path, os.getpid())
+            encode_dataset(encoder, input_ids, lengths, temp_path, dtype, batch_size, device)
+            os.replace(temp_path, states_path)
+
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        return cls(np.load(states_path, mmap_mode='r'), offsets)
+
+
+def encode_dataset(encoder, input_ids, lengths, path, dtype=np.float16, batch_size=32, device="cpu"):
+    # the examples are encoded in order of length, every batch is cut to its longest example
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    states = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                       shape=(int(offsets[-1]), encoder.config.hidden_size))
+    pad_token_id = encoder.config.pad_token_id if encoder.config.pad_token_id is not None else 0
+    order = np.argsort(lengths, kind='stable')
+
+    encoder.to(device)
+    encoder.eval()
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            seq_len = int(lengths[batch].max())
+            x = torch.full((len(batch), seq_len), pad_token_id, dtype=torch.long)
+            mask = torch.zeros((len(batch), seq_len), dtype=torch.long)
+            for row, index in enumerate(batch.tolist()):
+                x[row, :lengths[index]] = torch.as_tensor(input_ids[index][:lengths[index]])
+                mask[row, :lengths[index]] = 1
+
+            # Shape: (batch_size, seq_len, hidden_size)
+            hidden_states = encoder(input_ids=x.to(device), attention_mask=mask.to(device)).last_hidden_state
+            hidden_states = hidden_states.cpu().numpy()
+            for row, index in enumerate(batch.tolist()):
+                states[offsets[index]:offsets[index + 1]] = hidden_states[row, :lengths[index]]
+
+    states.flush()
+    del states
+
+
+class CachedFeatureDataset(torch.utils.data.Dataset):
+    """
+    A tokenized dataset with the cached hidden states of every example in the column "hidden_states", padded to the
+    length of its input_ids so the default DataLoader collation works.
+    """
+
+    def __init__(self, cache: HiddenStateCache, dataset, columns):
+        self.cache = cache
+        # the columns are read once, a Dataset or a dict of lists
+        self.columns = {column: dataset[column] for column in columns}
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __getitem__(self, index):
+        item = {column: torch.as_tensor(values[index]) for column, values in self.columns.items()}
+        item["hidden_states"] = self.cache.example(index, len(item["attention_mask"]))
+        return item
+
+
+def batch_hidden_states(data, device):
+    # the cached hidden states of a DataLoader batch, None if the batch comes from a dataset without cache
+    if "hidden_states" not in data:
+        return None
+    return data["hidden_states"].to(device)
+
+
+def tiny_encoder(vocab_size=1000, hidden_size=32, seed=0):
+    # small randomly initialized XLM-RoBERTa, stands in for xlm-roberta-base when nothing can be downloaded
+    torch.manual_seed(seed)
+    config = XLMRobertaConfig(vocab_size=vocab_size, hidden_size=hidden_size, num_hidden_layers=2,
+                              num_attention_heads=2, intermediate_size=2 * hidden_size, max_position_embeddings=520,
+                              pad_token_id=1)
+    return XLMRobertaModel(config)
+
+
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+    import time
+
+    # offline check with a tiny random encoder on random token ids: the cached states are the encoder output
+    encoder = tiny_encoder()
+    generator = np.random.default_rng(0)
+    lengths = generator.integers(3, 60, size=200)
+    max_length = int(lengths.max())
+    dataset = {
+        "input_ids": [[0] + generator.integers(5, 1000, size=length - 2).tolist() + [2] + [1] * (max_length - length)
+                      for length in lengths.tolist()],
+        "attention_mask": [[1] * length + [0] * (max_length - length) for length in lengths.tolist()],
+    }
+    settings = {"name": "tiny", "padding": True, "truncation": True}
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        time1 = time.time()
+        cache = HiddenStateCache.load(encoder, dataset, "tiny", settings, cache_dir, dtype=np.float32)
+        time2 = time.time()
+        cache = HiddenStateCache.load(encoder, dataset, "tiny", settings, cache_dir, dtype=np.float32)
+        time3 = time.time()
+        print("encoded %d examples in %.3f s, loaded the cache in %.3f s" % (len(cache), time2 - time1, time3 - time2))
+
+        x = torch.tensor(dataset["input_ids"][:8])
+        mask = torch.tensor(dataset["attention_mask"][:8])
+        with torch.no_grad():
+            expected = encoder(input_ids=x, attention_mask=mask).last_hidden_state * mask.unsqueeze(-1)
+        cached = torch.stack([cache.example(index, max_length) for index in range(8)])
+        assert torch.allclose(cached, expected, atol=1e-4)
+
+        half = HiddenStateCache.load(encoder, dataset, "tiny", settings, cache_dir, dtype=np.float16)
+        assert torch.allclose(torch.stack([half.example(index, max_length) for index in range(8)]), expected,
+                              atol=1e-2)
+        print("float32 %d bytes, float16 %d bytes" % (cache.states.nbytes, half.states.nbytes))
+
+        loader = torch.utils.data.DataLoader(CachedFeatureDataset(half, dataset, ["input_ids", "attention_mask"]),
+                                             batch_size=32)
+        print({column: tuple(values.shape) for column, values in next(iter(loader)).items()})
+    finally:
+        shutil.rmtree(cache_dir)
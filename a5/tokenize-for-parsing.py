@@ -1,6 +1,16 @@
 # Code for the assignment in https://github.com/coli-saar/cl/wiki/Assignment:-Dependency-parsing
 # Alexander Koller, December 2023
 
+import hashlib
+import json
+import os
+import sys
+from itertools import chain
+import numpy as np
+
+PREPROCESS_CACHE_VERSION = 1
+
+
 def strip_none_heads(examples, i):
     tokens = examples["tokens"][i]
     heads = examples["head"][i]
@@ -28,7 +38,81 @@ def pad_to_same_size(lists, padding_symbol):
     maxlen = max([len(l) for l in lists])
     return [l + (padding_symbol,)*(maxlen-len(l)) for l in lists]
 
-def tokenize_and_align_labels(examples, skip_index=-100):
+def align_batch(word_ids, heads, deprel_ids, skip_index=-100):
+    """
+    Token-level labels of a batch of sentences with numpy index arithmetic over the concatenated word_ids.
+
+    Example (word 0 is split into two tokens, HEAD is 1-based and 0 is the root):
+    > align_batch([[None, 0, 0, 1, None]], [[2, 0]], [[5, 7]])
+    ([[-100, 3, -100, 0, -100]], [[-100, 5, -100, 7, -100]], [[0, 1, 3]])
+
+    :param word_ids: Word id of every token per sentence, None for the special tokens and the padding
+    :param heads: HEAD of every word per sentence (1-based word position, 0 for the root)
+    :param deprel_ids: Deprel id of every word per sentence
+    :param skip_index: Label of the tokens that are not the first token of a word
+    :return: Lists (per sentence) of the head token position of every token, the deprel id of every token and the first
+        token of every word with the BOS token 0 in front
+    """
+    token_counts = np.array([len(ids) for ids in word_ids], dtype=np.int64)
+    word_counts = np.array([len(hh) for hh in heads], dtype=np.int64)
+    # every sentence gets word_count + 1 slots in the word to token map, slot 0 is the root
+    slot_offsets = np.concatenate([[0], np.cumsum(word_counts + 1)[:-1]])
+
+    # None -> nan -> -1
+    flat_ids = np.nan_to_num(np.fromiter(chain.from_iterable(word_ids), dtype=np.float64, count=token_counts.sum()),
+                             nan=-1).astype(np.int64)
+    sentences = np.repeat(np.arange(len(word_ids)), token_counts)
+    positions = np.arange(len(flat_ids)) - np.repeat(np.cumsum(token_counts) - token_counts, token_counts)
+
+    # the first token of each word: a word id different from the one of the previous token of the sentence
+    first = (flat_ids >= 0) & ((flat_ids != np.roll(flat_ids, 1)) | (positions == 0))
+    first_tokens = np.nonzero(first)[0]
+    first_slots = slot_offsets[sentences[first_tokens]] + flat_ids[first_tokens]
+
+    # first token position of every word, HEAD = 0 => map it to first token (BOS), truncated words keep -1
+    word_to_token = np.full(int((word_counts + 1).sum()), -1, dtype=np.int64)
+    word_to_token[first_slots + 1] = positions[first_tokens]
+    word_to_token[slot_offsets] = 0
+
+    word_sentences = np.repeat(np.arange(len(heads)), word_counts)
+    flat_heads = np.fromiter(chain.from_iterable(heads), dtype=np.int64, count=word_counts.sum())
+    head_tokens = word_to_token[slot_offsets[word_sentences] + flat_heads]
+    # a HEAD in the truncated part is skipped
+    head_tokens[head_tokens < 0] = skip_index
+    flat_deprels = np.fromiter(chain.from_iterable(deprel_ids), dtype=np.int64, count=word_counts.sum())
+
+    # word index of a slot: slot - sentence number - 1
+    first_words = first_slots - sentences[first_tokens]
+    token_heads = np.full(len(flat_ids), skip_index, dtype=np.int64)
+    token_heads[first_tokens] = head_tokens[first_words]
+    token_deprels = np.full(len(flat_ids), skip_index, dtype=np.int64)
+    token_deprels[first_tokens] = flat_deprels[first_words]
+
+    # first tokens per sentence with the BOS token in front
+    bos_first = np.insert(positions[first_tokens], np.searchsorted(first_tokens, np.cumsum(token_counts) - token_counts),
+                          0)
+    token_ends = np.cumsum(token_counts).tolist()
+    word_ends = np.cumsum(np.bincount(sentences[first_tokens], minlength=len(word_ids)) + 1).tolist()
+
+    return (split_list(token_heads.tolist(), token_ends), split_list(token_deprels.tolist(), token_ends),
+            split_list(bos_first.tolist(), word_ends))
+
+
+def split_list(values, ends):
+    # one tolist for the whole batch and list slices are much faster than a tolist per sentence
+    return [values[start:end] for start, end in zip([0] + ends[:-1], ends)]
+
+
+def tokenize_and_align_labels(examples, deprel_to_id, tokenizer, skip_index=-100, padding=True):
+    """
+    :param examples: Batch of a UD dataset (dict of lists with the columns tokens, head, deprel)
+    :param deprel_to_id: Dict deprel -> id
+    :param tokenizer: Fast tokenizer (word_ids are needed)
+    :param skip_index: Label of the tokens that are not the first token of a word
+    :param padding: Pad input_ids and tokens_representing_words to the longest sentence of the batch, False leaves
+        the padding to the collator (batching.py)
+    :return: BatchEncoding with head, deprel_ids, tokens_representing_words, num_words and tokenid_to_wordid
+    """
     # delete tokens with "None" head and their annotations
     examples_tokens, examples_heads, examples_deprels = [], [], []
     for sentence_id in range(len(examples["tokens"])):
@@ -37,78 +121,177 @@ def tokenize_and_align_labels(examples, skip_index=-100):
         examples_heads.append(hh)
         examples_deprels.append(dd)
 
-    tokenized_inputs = tokenizer(examples_tokens, truncation=True, is_split_into_words=True, padding=True) # get "tokenizer" from global variable
+    tokenized_inputs = tokenizer(examples_tokens, truncation=True, is_split_into_words=True, padding=padding)
     # tokenized_inputs is a dictionary with keys input_ids and attention_mask;
     # each is a list (per sentence) of lists (per token).
 
-    remapped_heads = [] # these will be lists (per sentence) of lists (per token)
-    deprel_ids = []
-    tokens_representing_words = []
-    num_words : list[int] = []
-    maxlen_t2w = 0  # max length of a token_to_word_here list
-
-    for sentence_id, annotated_heads in enumerate(examples_heads):
-        deprels = examples_deprels[sentence_id]
-        word_ids = tokenized_inputs.word_ids(batch_index=sentence_id)
-        word_pos_to_token_pos = map_first_occurrence(word_ids) # word-pos to first token-pos; both start at 0 for first word (actual) / first token (BOS)
-
-        previous_word_idx = None
-        heads_here : list[int] = []
-        deprel_ids_here : list[int] = []
-
-        # list of token positions that map to words (first token of each word)
-        # token 0 -> word 0 (BOS)
-        tokens_representing_word_here : list[int] = [0]
-
-        for sentence_position, word_idx in enumerate(word_ids):
-            # Special tokens (BOS, EOS) have a word id that is None. We set the label to -100 so they are automatically
-            # ignored in the loss function.
-            if word_idx is None:
-                heads_here.append(skip_index)
-                deprel_ids_here.append(skip_index)
-
-            # We set the label for the first token of each word;
-            # subsequent tokens of the same word will have the same word_idx.
-            elif word_idx != previous_word_idx:
-                if annotated_heads[word_idx] == "None": # added by padding
-                    print("A 'None' head survived!")
-                    sys.exit(0)
-                else:
-                    # Map HEAD annotation to position of first token of head word.
-                    # HEAD = 0 => map it to first token (BOS)
-                    # Otherwise, look up first token for HEAD-1 (HEAD is 1-based, word positions are 0-based)
-                    head_word_pos = int(annotated_heads[word_idx])
-                    head_token_pos = 0 if head_word_pos == 0 else word_pos_to_token_pos[head_word_pos-1]
-
-                    heads_here.append(head_token_pos)
-                    deprel_ids_here.append(deprel_to_id[deprels[word_idx]])
-
-                    tokens_representing_word_here.append(sentence_position)  # first word is index 1; index 0 is BOS
-
-            # For the other tokens in a word, we set the label to either the current label or -100, depending on
-            # the label_all_tokens flag.
-            else:
-                heads_here.append(skip_index)
-                deprel_ids_here.append(skip_index)
-
-            previous_word_idx = word_idx
-
-        remapped_heads.append(heads_here)
-        deprel_ids.append(deprel_ids_here)
-        tokens_representing_words.append(tokens_representing_word_here)
-        
-        num_words.append(len(tokens_representing_word_here))
-        if len(tokens_representing_word_here) > maxlen_t2w:
-            maxlen_t2w = len(tokens_representing_word_here)
+    for annotated_heads in examples_heads:
+        if "None" in annotated_heads:
+            print("A 'None' head survived!")
+            sys.exit(1)
+
+    # word ids are read once per sentence, the alignment runs over the whole batch at once
+    tokenid_to_wordid = [tokenized_inputs.word_ids(batch_index=i) for i in range(len(examples_heads))]
+    remapped_heads, deprel_ids, tokens_representing_words = align_batch(
+        tokenid_to_wordid, [[int(head) for head in heads] for heads in examples_heads],
+        [[deprel_to_id[deprel] for deprel in deprels] for deprels in examples_deprels], skip_index)
+    num_words = [len(t2w) for t2w in tokens_representing_words]
 
     # pad t2w lists to same length
-    for t2w in tokens_representing_words:
-        t2w += [-1] * (maxlen_t2w-len(t2w))
+    if padding:
+        maxlen_t2w = max(num_words, default=0)
+        for t2w in tokens_representing_words:
+            t2w += [-1] * (maxlen_t2w-len(t2w))
 
     tokenized_inputs["head"] = remapped_heads
     tokenized_inputs["deprel_ids"] = deprel_ids
     tokenized_inputs["tokens_representing_words"] = tokens_representing_words
     tokenized_inputs["num_words"] = num_words
-    tokenized_inputs["tokenid_to_wordid"] = [tokenized_inputs.word_ids(batch_index=i) for i in range(len(examples_heads))] # map token ID to word ID
+    tokenized_inputs["tokenid_to_wordid"] = tokenid_to_wordid
 
     return tokenized_inputs
+
+
+def tokenizer_hash(tokenizer):
+    # the vocabulary and the special tokens decide the token ids, the class decides how words are split
+    digest = hashlib.sha1(type(tokenizer).__name__.encode('utf-8'))
+    digest.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode('utf-8'))
+    digest.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def preprocess_dataset(dataset, deprel_to_id, tokenizer, cache_dir="./.preprocess_cache", num_proc=None,
+                       batch_size=1000, padding=False):
+    """
+    Tokenized and aligned version of a UD split, saved to disk on first use so a restart skips the tokenization.
+    The cache key covers the tokenizer vocabulary, the deprel ids, the padding and the dataset fingerprint.
+    :param dataset: datasets.Dataset of a UD split
+    :param deprel_to_id: Dict deprel -> id
+    :param tokenizer: Fast tokenizer
+    :param cache_dir: Directory of the preprocessed datasets
+    :param num_proc: Number of processes of Dataset.map, every process tokenizes one shard of the split
+    :param batch_size: Sentences per tokenizer call (and per padding group if padding is True)
+    :param padding: See tokenize_and_align_labels
+    :return: datasets.Dataset with the columns of tokenize_and_align_labels
+    """
+    import datasets
+
+    key = json.dumps([PREPROCESS_CACHE_VERSION, tokenizer_hash(tokenizer), sorted(deprel_to_id.items()), padding,
+                      batch_size, dataset._fingerprint])
+    path = os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+    if not os.path.exists(path):
+        processed = dataset.map(lambda examples: tokenize_and_align_labels(examples, deprel_to_id, tokenizer,
+                                                                           padding=padding),
+                                batched=True, batch_size=batch_size, num_proc=num_proc,
+                                remove_columns=dataset.column_names)
+        # write to a temporary directory first, so a parallel reader never loads a half written dataset
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        processed.save_to_disk(temp_path)
+        os.replace(temp_path, path)
+
+    return datasets.load_from_disk(path)
+
+
+def stand_in_tokenizer(words, piece_length=3):
+    """
+    Small fast WordPiece tokenizer with the special token ids of XLM-RoBERTa, for tests without download: every word
+    is split into pieces of piece_length characters.
+    """
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {"<s>": 0, "<pad>": 1, "</s>": 2, "<unk>": 3}
+    for word in sorted(set(words)):
+        for start in range(0, len(word), piece_length):
+            piece = word[start:start + piece_length] if start == 0 else "##" + word[start:start + piece_length]
+            vocab.setdefault(piece, len(vocab))
+
+    tokenizer = Tokenizer(models.WordPiece(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(single="<s> $A </s>",
+                                                             special_tokens=[("<s>", 0), ("</s>", 2)])
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", pad_token="<pad>",
+                                   unk_token="<unk>")
+
+
+# the original token by token walk, kept as the reference of align_batch
+def align_sentence_loop(word_ids, annotated_heads, deprel_ids, skip_index=-100):
+    word_pos_to_token_pos = map_first_occurrence(word_ids)
+    previous_word_idx = None
+    heads_here, deprel_ids_here, tokens_representing_word_here = [], [], [0]
+
+    for sentence_position, word_idx in enumerate(word_ids):
+        if word_idx is None:
+            heads_here.append(skip_index)
+            deprel_ids_here.append(skip_index)
+        elif word_idx != previous_word_idx:
+            head_word_pos = int(annotated_heads[word_idx])
+            # a HEAD in the truncated part is skipped, as in align_batch
+            head_token_pos = 0 if head_word_pos == 0 else word_pos_to_token_pos.get(head_word_pos-1, skip_index)
+            heads_here.append(head_token_pos)
+            deprel_ids_here.append(deprel_ids[word_idx])
+            tokens_representing_word_here.append(sentence_position)
+        else:
+            heads_here.append(skip_index)
+            deprel_ids_here.append(skip_index)
+        previous_word_idx = word_idx
+
+    return heads_here, deprel_ids_here, tokens_representing_word_here
+
+
+if __name__ == "__main__":
+    import random
+    import shutil
+    import tempfile
+    import time
+    import datasets
+
+    # offline check on random UD-like sentences with the stand-in tokenizer
+    generator = random.Random(0)
+    vocabulary = ["".join(generator.choice("abcdefghij") for _ in range(generator.randint(1, 9))) for _ in range(500)]
+    deprel_to_id = {deprel: i for i, deprel in enumerate(["root", "nsubj", "obj", "det", "amod", "punct"])}
+
+    examples = {"tokens": [], "head": [], "deprel": []}
+    for _ in range(5000):
+        length = generator.randint(1, 40)
+        # "None" heads are the empty nodes of UD, they are stripped before the tokenization
+        empty_nodes = generator.choice([0] * 9 + [1])
+        examples["tokens"].append([generator.choice(vocabulary) for _ in range(length + empty_nodes)])
+        examples["head"].append([str(generator.randint(0, length)) for _ in range(length)] + ["None"] * empty_nodes)
+        examples["deprel"].append([generator.choice(list(deprel_to_id)) for _ in range(length + empty_nodes)])
+    tokenizer = stand_in_tokenizer(vocabulary)
+
+    tokenized_inputs = tokenize_and_align_labels(examples, deprel_to_id, tokenizer)
+
+    # the same labels as the original token by token walk
+    word_ids = tokenized_inputs["tokenid_to_wordid"]
+    heads, deprel_ids = [], []
+    for sentence_id in range(len(examples["tokens"])):
+        _, hh, dd = strip_none_heads(examples, sentence_id)
+        heads.append([int(head) for head in hh])
+        deprel_ids.append([deprel_to_id[deprel] for deprel in dd])
+
+    time1 = time.time()
+    expected = [align_sentence_loop(*sentence) for sentence in zip(word_ids, heads, deprel_ids)]
+    time2 = time.time()
+    aligned = align_batch(word_ids, heads, deprel_ids)
+    time3 = time.time()
+    assert [list(sentence) for sentence in zip(*aligned)] == [list(sentence) for sentence in expected]
+    for sentence_id, (head_here, _, t2w) in enumerate(expected):
+        num_words = tokenized_inputs["num_words"][sentence_id]
+        assert tokenized_inputs["head"][sentence_id] == head_here
+        assert tokenized_inputs["tokens_representing_words"][sentence_id][:num_words] == t2w
+    print("aligned %d sentences: loop %.3f s, align_batch %.3f s" % (len(word_ids), time2 - time1, time3 - time2))
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        dataset = datasets.Dataset.from_dict(examples)
+        for attempt in ["first run", "restart"]:
+            time1 = time.time()
+            processed = preprocess_dataset(dataset, deprel_to_id, tokenizer, cache_dir, num_proc=2)
+            print("%s: preprocessed %d sentences in %.3f s" % (attempt, len(processed), time.time() - time1))
+        assert processed["head"] == [heads[:len(mask)] for heads, mask in
+                                     zip(tokenized_inputs["head"], processed["attention_mask"])]
+    finally:
+        shutil.rmtree(cache_dir)
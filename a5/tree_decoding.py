@@ -0,0 +1,334 @@
+# decode well-formed dependency trees from the biaffine edge scores of a whole batch
+import numpy as np
+import torch
+try:
+    # C implementation of the cycle contraction used by the notebook, the numpy version below is the fallback
+    from ufal.chu_liu_edmonds import chu_liu_edmonds as ufal_chu_liu_edmonds
+except ImportError:
+    ufal_chu_liu_edmonds = None
+
+
+def word_scores(edge_scores, tokens_representing_words, num_words):
+    """
+    Word-level score matrices of a batch: the rows and columns of the first token of every word.
+    :param edge_scores: Tensor or array (batch_size, seq_len, seq_len), edge_scores[b, dep, head] as in score_edges
+    :param tokens_representing_words: (batch_size, max_words) first token of every word, token 0 (BOS) is the root,
+        padded with -1
+    :param num_words: (batch_size,) number of words with the root
+    :return: float64 array (batch_size, max_words, max_words), scores[b, dep word, head word], -inf outside a sentence
+    """
+    if isinstance(edge_scores, torch.Tensor):
+        edge_scores = edge_scores.detach().cpu().double().numpy()
+    tokens = np.asarray(tokens_representing_words)
+    lengths = np.asarray(num_words)
+    m = int(lengths.max())
+    tokens = np.where(tokens[:, :m] < 0, 0, tokens[:, :m])
+
+    batch = np.arange(len(tokens))[:, None, None]
+    scores = edge_scores[batch, tokens[:, :, None], tokens[:, None, :]].astype(np.float64)
+    inside = np.arange(m)[None, :] < lengths[:, None]
+    scores[~(inside[:, :, None] & inside[:, None, :])] = -np.inf
+    return scores
+
+
+def eisner(scores, lengths, single_root=True):
+    """
+    Best projective trees of a batch with Eisner's O(n^3) algorithm, vectorized over the sentences and split points.
+    :param scores: Array (batch_size, n, n), scores[b, dep, head], position 0 is the root
+    :param lengths: (batch_size,) number of positions of every sentence with the root
+    :param single_root: Allow exactly one dependent of the root (UD trees), else any number
+    :return: int64 array (batch_size, n) of the head of every position, -1 for the root and the padding
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    lengths = np.asarray(lengths)
+    batch_size, n, _ = scores.shape
+    arcs = scores.copy()
+    if single_root:
+        # the root arcs are added after the tables are filled
+        arcs[:, :, 0] = -np.inf
+
+    # the span tables are stored twice, by start [b, s, width] and by end [b, t, width], so the split points of all
+    # spans of a width are plain slices; right: headed by s, left: headed by t, complete spans of width 0 score 0
+    complete_right = np.full((2, batch_size, n, n), -np.inf)
+    complete_left = np.full((2, batch_size, n, n), -np.inf)
+    incomplete_right = np.full((2, batch_size, n, n), -np.inf)
+    incomplete_left = np.full((2, batch_size, n, n), -np.inf)
+    complete_right[:, :, :, 0] = 0.0
+    complete_left[:, :, :, 0] = 0.0
+    # best split of every span [b, s, width], as an offset from s
+    split_complete_right = np.zeros((batch_size, n, n), dtype=np.int64)
+    split_complete_left = np.zeros((batch_size, n, n), dtype=np.int64)
+    split_incomplete = np.zeros((batch_size, n, n), dtype=np.int64)
+
+    def store(table, k, values):
+        table[0, :, :n - k, k] = values
+        table[1, :, k:, k] = values
+
+    def best(combined):
+        split = combined.argmax(axis=2)
+        return split, np.take_along_axis(combined, split[:, :, None], axis=2)[:, :, 0]
+
+    for k in range(1, n):
+        # spans s..t = s..s+k, split s+j
+        # s..s+j headed by s + s+j+1..t headed by t, then the arc t -> s or s -> t
+        split, score = best(complete_right[0, :, :n - k, :k] + complete_left[1, :, k:, k - 1::-1])
+        store(incomplete_left, k, score + np.diagonal(arcs, offset=k, axis1=1, axis2=2))
+        store(incomplete_right, k, score + np.diagonal(arcs, offset=-k, axis1=1, axis2=2))
+        split_incomplete[:, :n - k, k] = split
+
+        # s..s+j complete headed by s+j + s+j..t incomplete with the arc t -> s+j, j = 0..k-1
+        split, score = best(complete_left[0, :, :n - k, :k] + incomplete_left[1, :, k:, k:0:-1])
+        store(complete_left, k, score)
+        split_complete_left[:, :n - k, k] = split
+
+        # s..s+j incomplete with the arc s -> s+j + s+j..t complete headed by s+j, j = 1..k
+        split, score = best(incomplete_right[0, :, :n - k, 1:k + 1] + complete_right[1, :, k:, k - 1::-1])
+        store(complete_right, k, score)
+        split_complete_right[:, :n - k, k] = split + 1
+
+    heads = np.full((batch_size, n), -1, dtype=np.int64)
+    for b in range(batch_size):
+        last = int(lengths[b]) - 1
+        if last < 1:
+            continue
+        stack = []
+        if single_root:
+            # root -> r, r heads the words 1..r-1 on its left and r+1..last on its right
+            candidates = np.arange(1, last + 1)
+            totals = (scores[b, candidates, 0] + complete_left[0, b, 1, candidates - 1] +
+                      complete_right[0, b, candidates, last - candidates])
+            root_child = int(candidates[totals.argmax()])
+            heads[b, root_child] = 0
+            stack += [(split_complete_left, 1, root_child), (split_complete_right, root_child, last)]
+        else:
+            stack.append((split_complete_right, 0, last))
+
+        while stack:
+            table, s, t = stack.pop()
+            if s == t:
+                continue
+            r = s + int(table[b, s, t - s])
+            if table is split_complete_right:
+                heads[b, r] = s
+                stack += [(split_incomplete, s, r), (split_complete_right, r, t)]
+            elif table is split_complete_left:
+                heads[b, r] = t
+                stack += [(split_complete_left, s, r), (split_incomplete, r, t)]
+            else:
+                # the arc of an incomplete span is set by the complete span above it
+                stack += [(split_complete_right, s, r), (split_complete_left, r + 1, t)]
+
+    return heads
+
+
+def find_cycle(heads):
+    # the nodes of a cycle of a head array (heads[0] = -1 is the root), None if the heads form a tree
+    n = len(heads)
+    jump = np.where(heads < 0, 0, heads)
+    jump[0] = 0
+    # after n steps along the heads every node is on its cycle (or at the root), pointer doubling takes log n steps
+    for _ in range(max(n - 1, 1).bit_length()):
+        jump = jump[jump]
+    on_cycle = jump[jump > 0]
+    if len(on_cycle) == 0:
+        return None
+
+    # walk the cycle of one of its nodes
+    cycle = [on_cycle[0]]
+    node = heads[on_cycle[0]]
+    while node != cycle[0]:
+        cycle.append(node)
+        node = heads[node]
+    return np.array(cycle)
+
+
+def chu_liu_edmonds_sentence(scores):
+    """
+    Maximum spanning arborescence rooted in position 0 of one sentence (Chu-Liu-Edmonds with cycle contraction).
+    :param scores: float64 array (n, n), scores[dep, head], the diagonal and row 0 are ignored
+    :return: int64 array (n,) of heads, heads[0] = -1
+    """
+    scores = scores.copy()
+    np.fill_diagonal(scores, -np.inf)
+    scores[0] = -np.inf
+    heads = scores.argmax(axis=1)
+    heads[0] = -1
+
+    cycle = find_cycle(heads)
+    if cycle is None:
+        return heads
+
+    # contract the cycle into the new node c, the root stays node 0
+    in_cycle = np.zeros(len(scores), dtype=bool)
+    in_cycle[cycle] = True
+    outside = np.nonzero(~in_cycle)[0]
+    c = len(outside)
+    contracted = np.full((c + 1, c + 1), -np.inf)
+    contracted[:c, :c] = scores[outside[:, None], outside]
+
+    # outside dependent <- best head inside the cycle
+    from_cycle = scores[outside[:, None], cycle]
+    head_in_cycle = cycle[from_cycle.argmax(axis=1)]
+    contracted[:c, c] = from_cycle.max(axis=1)
+
+    # cycle <- outside head: the arc replaces the cycle arc of its dependent
+    into_cycle = scores[cycle[:, None], outside] - scores[cycle, heads[cycle]][:, None]
+    dep_in_cycle = cycle[into_cycle.argmax(axis=0)]
+    contracted[c, :c] = into_cycle.max(axis=0)
+    contracted[0] = -np.inf
+
+    contracted_heads = chu_liu_edmonds_sentence(contracted)
+
+    # expand: the cycle keeps its arcs except the one replaced by the arc into the cycle
+    result = heads.copy()
+    for i in range(1, c):
+        head = contracted_heads[i]
+        result[outside[i]] = head_in_cycle[i] if head == c else outside[head]
+    head = contracted_heads[c]
+    result[dep_in_cycle[head]] = outside[head]
+    return result
+
+
+def chu_liu_edmonds(scores, lengths, single_root=True):
+    """
+    Best non-projective trees of a batch. The argmax heads of the whole batch are computed at once, only the sentences
+    whose argmax heads are not a tree (a cycle, or several root dependents with single_root) go through the cycle
+    contraction.
+    :param scores: Array (batch_size, n, n), scores[b, dep, head], position 0 is the root, the padding scores may
+        be anything
+    :param lengths: (batch_size,) number of positions of every sentence with the root
+    :param single_root: Allow exactly one dependent of the root
+    :return: int64 array (batch_size, n) of the head of every position, -1 for the root and the padding
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    lengths = np.asarray(lengths)
+    batch_size, n, _ = scores.shape
+
+    # no self loops and no heads after the end of a sentence, whatever the padding scores are
+    outside = np.arange(n)[None, :] >= lengths[:, None]
+    masked = np.where(outside[:, None, :], -np.inf, scores)
+    masked[:, np.arange(n), np.arange(n)] = -np.inf
+    heads = masked.argmax(axis=2)
+    heads[:, 0] = -1
+    heads[outside] = -1
+
+    for b in range(batch_size):
+        length = int(lengths[b])
+        if length < 2:
+            continue
+        root_dependents = np.count_nonzero(heads[b, 1:length] == 0)
+        if find_cycle(heads[b, :length]) is None and (root_dependents == 1 or not single_root):
+            continue
+
+        sentence = scores[b, :length, :length].copy()
+        if single_root:
+            # every tree has a root arc, a penalty larger than any score difference allows only one
+            finite = sentence[np.isfinite(sentence)]
+            sentence[:, 0] -= 1.0 + length * (finite.max() - finite.min())
+        if ufal_chu_liu_edmonds is not None:
+            heads[b, :length] = ufal_chu_liu_edmonds(sentence)[0]
+        else:
+            heads[b, :length] = chu_liu_edmonds_sentence(sentence)
+
+    return heads
+
+
+def decode_heads(edge_scores, tokens_representing_words, num_words, method="chu_liu_edmonds"):
+    """
+    Token-level heads of a batch as in the training labels: the first token of every word gets the first token of its
+    head word, all other tokens -100.
+    :param method: "argmax" (no tree constraint), "eisner" (projective) or "chu_liu_edmonds" (non-projective)
+    :return: int64 tensor (batch_size, seq_len)
+    """
+    scores = word_scores(edge_scores, tokens_representing_words, num_words)
+    lengths = np.asarray(num_words)
+    if method == "argmax":
+        heads = scores.argmax(axis=2)
+    elif method == "eisner":
+        heads = eisner(scores, lengths)
+    else:
+        heads = chu_liu_edmonds(scores, lengths)
+
+    tokens = np.asarray(tokens_representing_words)[:, :scores.shape[1]]
+    token_heads = np.full(tuple(edge_scores.shape[:2]), -100, dtype=np.int64)
+    for b in range(len(tokens)):
+        length = int(lengths[b])
+        token_heads[b, tokens[b, 1:length]] = tokens[b, heads[b, 1:length]]
+    return torch.from_numpy(token_heads)
+
+
+if __name__ == "__main__":
+    import time
+
+    def random_tree(length, generator, projective=True):
+        # heads of a random tree over the words 1..length-1 with one root dependent
+        heads = np.full(length, -1)
+        if not projective:
+            # attached one by one to a word already in the tree
+            order = generator.permutation(np.arange(1, length))
+            heads[order[0]] = 0
+            for i in range(1, len(order)):
+                heads[order[i]] = order[generator.integers(0, i)]
+            return heads
+
+        # a random head of the span lo..hi, its dependents are the heads of the spans on its left and right
+        spans = [(1, length - 1, 0)]
+        while spans:
+            lo, hi, head = spans.pop()
+            if lo > hi:
+                continue
+            r = int(generator.integers(lo, hi + 1))
+            heads[r] = head
+            spans += [(lo, r - 1, r), (r + 1, hi, r)]
+        return heads
+
+    def is_tree(heads, length):
+        return np.count_nonzero(heads[1:length] == 0) == 1 and find_cycle(heads[:length]) is None
+
+    # no trained parser offline: noisy scores around random gold trees, so independent argmax breaks some trees;
+    # most UD trees are projective, a tenth of the gold trees here are not
+    generator = np.random.default_rng(0)
+    batch_size, sentence_num = 32, 1024
+    lengths = generator.integers(4, 41, size=sentence_num)
+    n = int(lengths.max())
+    gold = np.full((sentence_num, n), -1)
+    scores = np.full((sentence_num, n, n), -np.inf)
+    for i, length in enumerate(lengths.tolist()):
+        gold[i, :length] = random_tree(length, generator, projective=generator.random() < 0.9)
+        noise = generator.normal(0.0, 1.0, size=(length, length))
+        scores[i, :length, :length] = noise
+        scores[i, np.arange(1, length), gold[i, 1:length]] += 3.0
+
+    decoders = {
+        "argmax": lambda batch, batch_lengths: np.where(np.arange(n)[None, :] < batch_lengths[:, None],
+                                                        batch.argmax(axis=2), -1),
+        "eisner": eisner,
+        "chu_liu_edmonds": chu_liu_edmonds,
+    }
+    if ufal_chu_liu_edmonds is not None:
+        def chu_liu_edmonds_numpy(batch, batch_lengths):
+            # the same decoder with the numpy cycle contraction
+            global ufal_chu_liu_edmonds
+            ufal, ufal_chu_liu_edmonds = ufal_chu_liu_edmonds, None
+            try:
+                return chu_liu_edmonds(batch, batch_lengths)
+            finally:
+                ufal_chu_liu_edmonds = ufal
+
+        decoders["chu_liu_edmonds (numpy)"] = chu_liu_edmonds_numpy
+        decoders["ufal (loop)"] = lambda batch, batch_lengths: np.array(
+            [ufal_chu_liu_edmonds(sentence[:length, :length])[0] + [-1] * (n - length)
+             for sentence, length in zip(batch, batch_lengths.tolist())])
+
+    print("%-24s %8s %8s %14s" % ("decoder", "UAS", "trees", "sentences/s"))
+    for name, decode in decoders.items():
+        time1 = time.time()
+        heads = np.concatenate([decode(scores[start:start + batch_size], lengths[start:start + batch_size])
+                                for start in range(0, sentence_num, batch_size)])
+        seconds = time.time() - time1
+
+        words = np.arange(n)[None, :] < lengths[:, None]
+        words[:, 0] = False
+        uas = np.count_nonzero((heads == gold) & words) / np.count_nonzero(words)
+        trees = np.mean([is_tree(heads[i], length) for i, length in enumerate(lengths.tolist())])
+        print("%-24s %8.4f %8.3f %14.0f" % (name, uas, trees, sentence_num / seconds))
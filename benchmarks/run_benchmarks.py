@@ -0,0 +1,280 @@
+"""
+Benchmark suite for the HMM tagger (a2), the n-gram model (a1) and the CKY parser (a3).
+
+Every case is run on the bundled corpora (if present) and on synthetic inputs scaled by sentence length, tagset size
+and grammar size. Time is the best of --repeat runs, peak memory is measured with tracemalloc in one extra run.
+
+Usage:
+    python benchmarks/run_benchmarks.py                       # run and compare with benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --save-baseline       # run and store the results as the new baseline
+    python benchmarks/run_benchmarks.py --filter viterbi --threshold 0.3
+
+The exit code is 1 if a metric regressed by more than --threshold (relative) against the baseline.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ["a1", "a2", "a3"]:
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+import nltk
+from conllu import parse_incr
+from nltk.grammar import CFG, Nonterminal, Production
+from ngram import BasicNgram
+from collocations import Collocations
+from corpus_handler import CorpusHandler
+from dense_hmm import DenseHMM
+from viterbi import viterbi
+from cky import CKY_recognize_optimized, CKY_parse, count_trees
+from compiled_grammar import CKY_recognize_compiled
+from parse_forest import CKY_parse_forest
+from pcfg_cky import CompiledPCFG, CKY_parse_viterbi
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+DE_GSD_TRAIN = os.path.join(ROOT, "a2", "data", "de_gsd-ud-train.conllu")
+DE_GSD_TEST = os.path.join(ROOT, "a2", "data", "de_gsd-ud-test.conllu")
+DE_SGD_DEV = os.path.join(ROOT, "a2", "data", "de_gsd-ud-dev.conllu")
+JUNGLEBOOK = os.path.join(ROOT, "a1", "junglebook.txt")
+ATIS_GRAMMAR = os.path.join(ROOT, "a3", "atis", "atis-grammar-cnf.cfg")
+ATIS_SENTENCES = os.path.join(ROOT, "a3", "atis", "atis-test-sentences.txt")
+
+
+# synthetic inputs, all seeded so every run measures the same work
+
+def synthetic_hmm(tag_num, word_num, seed=0):
+    rng = random.Random(seed)
+    tags = ["T%d" % i for i in range(tag_num)]
+    words = ["w%d" % i for i in range(word_num)]
+
+    def distribution(keys):
+        weights = [rng.random() for _ in keys]
+        total = sum(weights)
+        return {key: weight / total for key, weight in zip(keys, weights)}
+
+    init_prob = distribution(tags)
+    transition_prob = {tag: distribution(tags) for tag in tags}
+    # every tag emits a random tenth of the vocabulary
+    emission_prob = {tag: distribution(rng.sample(words, max(1, word_num // 10))) for tag in tags}
+
+    return init_prob, transition_prob, emission_prob, words
+
+
+def synthetic_sentences(words, length, sentence_num, seed=0):
+    rng = random.Random(seed)
+    return [[rng.choice(words) for _ in range(length)] for _ in range(sentence_num)]
+
+
+def synthetic_cnf_grammar(nonterminal_num, binary_rule_num, word_num, seed=0):
+    rng = random.Random(seed)
+    nonterminals = [Nonterminal("N%d" % i) for i in range(nonterminal_num)]
+    words = ["w%d" % i for i in range(word_num)]
+
+    productions = set()
+    while len(productions) < binary_rule_num:
+        lhs, left, right = rng.choice(nonterminals), rng.choice(nonterminals), rng.choice(nonterminals)
+        productions.add(Production(lhs, [left, right]))
+    # every word has one to three preterminals
+    for word in words:
+        for lhs in rng.sample(nonterminals, rng.randint(1, 3)):
+            productions.add(Production(lhs, [word]))
+
+    return CFG(nonterminals[0], sorted(productions, key=str)), words
+
+
+def read_words(file_path):
+    words = []
+    with open(file_path, "r", encoding='utf-8') as file:
+        for line in file:
+            words += line.lower().split(" ")
+    return words
+
+
+# benchmark cases: name -> setup function returning the callable that is timed
+
+def viterbi_cases():
+    cases = {}
+    for tag_num in [17, 50]:
+        init_prob, transition_prob, emission_prob, words = synthetic_hmm(tag_num, 2000)
+        dense_hmm = DenseHMM.from_dicts(init_prob, transition_prob, emission_prob)
+        for length in [10, 40, 160]:
+            sentences = synthetic_sentences(words, length, 20)
+            cases["viterbi/dict/S=%d/T=%d" % (tag_num, length)] = \
+                lambda s=sentences, i=init_prob, t=transition_prob, e=emission_prob: [viterbi(i, t, e, x) for x in s]
+            cases["viterbi/dense/S=%d/T=%d" % (tag_num, length)] = \
+                lambda s=sentences, d=dense_hmm: [d.viterbi(x) for x in s]
+            cases["viterbi/batch/S=%d/T=%d" % (tag_num, length)] = \
+                lambda s=sentences, d=dense_hmm: d.viterbi_batch(s)
+            for beam_size in [1, 3]:
+                cases["viterbi/dict_beam/k=%d/S=%d/T=%d" % (beam_size, tag_num, length)] = \
+                    lambda s=sentences, i=init_prob, t=transition_prob, e=emission_prob, k=beam_size: \
+                    [viterbi(i, t, e, x, beam_size=k) for x in s]
+    return cases
+
+
+def corpus_handler_cases():
+    cases = {}
+    if not os.path.exists(DE_SGD_DEV) or not os.path.exists(DE_GSD_TEST):
+        return cases
+
+    # the train file is not always bundled, the dev file stands in for it
+    train_path = DE_GSD_TRAIN if os.path.exists(DE_GSD_TRAIN) else DE_SGD_DEV
+    trained = CorpusHandler(train_path)
+    trained.train_on_corpus(14000)
+
+    def train():
+        with open(train_path, 'r', encoding='utf-8') as file:
+            CorpusHandler(train_path).train(parse_incr(file), 14000)
+
+    cases["corpus_handler/train"] = train
+    cases["corpus_handler/predict"] = lambda: trained.predict(DE_GSD_TEST)
+    cases["corpus_handler/predict_batch"] = lambda: trained.predict_batch(DE_GSD_TEST)
+    return cases
+
+
+def ngram_cases():
+    cases = {}
+    if os.path.exists(JUNGLEBOOK):
+        corpus = read_words(JUNGLEBOOK)
+        for n in [2, 3, 4]:
+            cases["ngram/junglebook/n=%d" % n] = lambda c=corpus, n=n: BasicNgram(n, c)
+            cases["ngram/compact/junglebook/n=%d" % n] = lambda c=corpus, n=n: BasicNgram(n, c, storage="compact")
+        for n in [2, 3, 4]:
+            # after the first run every alias table is cached
+            cases["ngram/generate/junglebook/n=%d" % n] = \
+                lambda m=BasicNgram(n, corpus): m.generate_batch(200, 100, seed=0)
+        for window in [1, 3]:
+            cases["collocations/junglebook/window=%d" % window] = \
+                lambda c=corpus, w=window: Collocations(c, w).top_k(20)
+        # streamed from the file instead of the word list
+        cases["ngram/streaming/junglebook/n=3"] = lambda: BasicNgram(3, JUNGLEBOOK)
+
+    for size in [10000, 100000]:
+        corpus = synthetic_sentences(["w%d" % i for i in range(5000)], size, 1)[0]
+        cases["ngram/synthetic/N=%d/n=3" % size] = lambda c=corpus: BasicNgram(3, c)
+        cases["ngram/compact/synthetic/N=%d/n=3" % size] = lambda c=corpus: BasicNgram(3, c, storage="compact")
+    return cases
+
+
+def cky_cases():
+    cases = {}
+    if os.path.exists(ATIS_GRAMMAR) and os.path.exists(ATIS_SENTENCES):
+        grammar = nltk.data.load("file:" + ATIS_GRAMMAR)
+        sentences = [s for s, _ in nltk.parse.util.extract_test_sentences(nltk.data.load("file:" + ATIS_SENTENCES))]
+        cases["cky/atis/recognize"] = lambda: [CKY_recognize_optimized(s, grammar) for s in sentences]
+        cases["cky/atis/parse_count"] = lambda: [parse_and_count(s, grammar) for s in sentences]
+        compiled = CompiledPCFG(grammar)
+        cases["cky/atis/recognize_compiled"] = lambda: [CKY_recognize_compiled(s, compiled) for s in sentences]
+        cases["cky/atis/forest_count"] = lambda: [CKY_parse_forest(s, compiled).count() for s in sentences]
+        cases["cky/atis/viterbi"] = lambda: [CKY_parse_viterbi(s, compiled) for s in sentences]
+
+    for nonterminal_num, rule_num in [(20, 200), (60, 1500)]:
+        grammar, words = synthetic_cnf_grammar(nonterminal_num, rule_num, 200)
+        for length in [5, 10, 15]:
+            sentences = synthetic_sentences(words, length, 5)
+            name = "cky/synthetic/N=%d/R=%d/T=%d" % (nonterminal_num, rule_num, length)
+            cases[name + "/recognize"] = lambda s=sentences, g=grammar: [CKY_recognize_optimized(x, g) for x in s]
+            cases[name + "/parse_count"] = lambda s=sentences, g=grammar: [parse_and_count(x, g) for x in s]
+            compiled = CompiledPCFG(grammar)
+            cases[name + "/recognize_compiled"] = lambda s=sentences, c=compiled: [CKY_recognize_compiled(x, c) for x in s]
+            cases[name + "/forest_count"] = lambda s=sentences, c=compiled: [CKY_parse_forest(x, c).count() for x in s]
+            cases[name + "/viterbi"] = lambda s=sentences, c=compiled: [CKY_parse_viterbi(x, c) for x in s]
+            cases[name + "/viterbi_beam"] = lambda s=sentences, c=compiled: [CKY_parse_viterbi(x, c, 10) for x in s]
+    return cases
+
+
+def parse_and_count(sentence, grammar):
+    success, back_pointers = CKY_parse(sentence, grammar)
+    if success:
+        return count_trees(back_pointers, 0, len(sentence) - 1, grammar.start())
+    return 0
+
+
+def measure(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"time_s": min(times), "peak_mb": peak / 2 ** 20}
+
+
+def compare(results, baseline, threshold, min_time):
+    # a metric regresses if it is more than threshold (relative) above the baseline,
+    # timings below min_time seconds are too noisy to compare
+    regressions = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        for metric, value in metrics.items():
+            base = baseline[name].get(metric)
+            if not base or (metric == "time_s" and value < min_time):
+                continue
+            if value > base * (1 + threshold):
+                regressions.append((name, metric, base, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HMM tagger, the n-gram model and the CKY parser.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline json file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--min-time", type=float, default=0.005, help="ignore timings below this (seconds)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the best time counts")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--output", help="also write the results to this json file")
+    args = parser.parse_args()
+
+    results = {}
+    for case_group in [viterbi_cases, corpus_handler_cases, ngram_cases, cky_cases]:
+        for name, function in case_group().items():
+            if args.filter not in name:
+                continue
+            results[name] = measure(function, args.repeat)
+            print("%-50s %10.4f s %10.2f MB" % (name, results[name]["time_s"], results[name]["peak_mb"]))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+    if args.save_baseline:
+        # keep the cases of the old baseline that were not run this time
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as file:
+                baseline = json.load(file)
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print("baseline saved to", args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline at %s, run with --save-baseline first" % args.baseline)
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as file:
+        baseline = json.load(file)
+
+    regressions = compare(results, baseline, args.threshold, args.min_time)
+    for name, metric, base, value in regressions:
+        print("REGRESSION %s %s: %.4f -> %.4f (+%.0f%%)" % (name, metric, base, value, (value / base - 1) * 100))
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())